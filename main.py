@@ -1,98 +1,505 @@
 """Start Dispacher."""
 
 import logging
-import logging.config
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from protocols import MQTTHandler, SerialHandler
-from utils.config_loader import load_config
-from utils.envelope import make_envelope, serialize
-from utils.registry import DeviceRegistry
-from utils.database import write_data, envelope_to_point_dict, close_write_api
+from protocols.serial_handler import PRIORITY_TYPES
+from utils.config_loader import LazyConfig, load_config
+from utils.log_setup import configure_logging, stop_logging
+from utils.event_loop import EventLoop
+from utils.workers import ReaderPool
+from utils.envelope import Envelope, make_envelope, encode_envelope, serialize_bytes
+from utils.registry import DeviceRegistry, normalize_address
+from utils.routes import Route, RouteTable
+from utils.unknown_sources import UnknownSources
+from utils.deadband import DeadbandFilter
+from utils.state import StateStore
+from utils.rules import RuleSet, load_rules, SINK_DEVICE, SINK_MQTT, SINK_INFLUXDB, SINK_DROP
+from utils.spool import Spool
+from utils.capture import CaptureWriter
+from utils.sharding import ShardPool
+from utils.database import write_data, write_envelope, close_write_api, start_writer, writer_stats
+from utils.metrics import metrics
+from utils.startup import startup
 
-cfg = load_config("config/config.toml")
+# Lida no primeiro acesso: importar este módulo (ex.: nos processos do modo shards e
+# nos scripts de tests/) não lê o arquivo.
+cfg = LazyConfig("config/config.toml")
 
 logger = logging.getLogger()
 
+# Tabela de rotas compilada, criada em main() depois dos handlers.
+routes: RouteTable | None = None
+
+# Regras de roteamento extras (config/routes.toml), carregadas em main().
+rules: RuleSet | None = None
+
+# Cache negativo e limite de register_request para remetentes desconhecidos.
+unknown: UnknownSources | None = None
+
+# Filtro de leituras repetidas, quando [deadband] enabled.
+deadband: DeadbandFilter | None = None
+
+# Thread que escreve os logs, quando o perfil usa [queue] (ver config/logs.production.toml).
+log_listener = None
+
+# Processos de roteamento, quando [dispatcher] shards > 1.
+shards: ShardPool | None = None
+
+# Agregação da telemetria em janelas, quando [aggregation] enabled (utils.aggregation).
+aggregator = None
+
+# Último estado de cada dispositivo e a API que o serve, quando [state] enabled.
+state: StateStore | None = None
+state_api = None
+
 def setup_logging():
+    global log_listener
     logger_config = load_config(cfg.paths.logger_config)
-    logging.config.dictConfig(logger_config)
+    log_listener = configure_logging(logger_config)
+
+# setup_metrics()
+#   - Cadastra os contadores já mantidos por cada componente (filas, rotas, InfluxDB).
+#   - Abre o endpoint do Prometheus (HTTP e/ou socket UNIX) e a publicação via MQTT.
+def setup_metrics(handlers: dict):
+    metrics.enabled = cfg.metrics.enabled is not False
+    if not metrics.enabled:
+        return
+
+    metrics.add_collector("startup", startup.stats)
+
+    if state is not None:
+        metrics.add_collector("state", state.stats)
+    if state_api is not None:
+        metrics.add_collector("state_api", state_api.stats)
+
+    # No modo shards, rotas, cache negativo e InfluxDB vivem nos processos de roteamento.
+    if shards is not None:
+        metrics.add_collector("shards", shards.stats)
+        for name in ("influx", "routes", "unknown", "deadband", "aggregation"):
+            metrics.add_collector(name, lambda name=name: shards.collected(name))
+    else:
+        metrics.add_collector("influx", writer_stats)
+        metrics.add_collector("routes", routes.stats)
+
+        if unknown is not None:
+            metrics.add_collector("unknown", unknown.stats)
+
+        if deadband is not None:
+            metrics.add_collector("deadband", deadband.stats)
+
+        if aggregator is not None:
+            metrics.add_collector("aggregation", aggregator.stats)
+
+    for name, handler in handlers.items():
+        if hasattr(handler, "stats"):
+            metrics.add_collector(f"handler_{name}", handler.stats)
+
+    if cfg.metrics.http_port:
+        metrics.start_http_server(cfg.metrics.http_host or "127.0.0.1", cfg.metrics.http_port)
+
+    if cfg.metrics.unix_socket:
+        metrics.start_unix_server(cfg.metrics.unix_socket)
+
+    if cfg.metrics.mqtt_interval and "MQTT" in handlers:
+        metrics.start_publisher(
+            handlers["MQTT"],
+            interval=cfg.metrics.mqtt_interval,
+            topic=cfg.metrics.mqtt_topic or "bifrost/central/metrics",
+        )
+
+# setup_influx()
+#   - Inicia o escritor em lotes do InfluxDB.
+#   - Lotes que falharem ficam na fila em disco até o banco voltar. Cada processo do
+#     modo shards usa um subdiretório próprio da fila.
+def setup_influx(spool_subdir: str | None = None):
+    spool = None
+    if cfg.influxdb.spool_dir:
+        directory = Path(__file__).parent / cfg.influxdb.spool_dir
+        spool = Spool(
+            directory / spool_subdir if spool_subdir else directory,
+            segment_bytes=cfg.influxdb.spool_segment_bytes or 4 * 1024 * 1024,
+            max_bytes=cfg.influxdb.spool_max_bytes or 256 * 1024 * 1024,
+        )
+
+    start_writer(
+        batch_size=cfg.influxdb.batch_size or 500,
+        flush_interval=cfg.influxdb.flush_interval or 1.0,
+        queue_size=cfg.influxdb.queue_size or 10_000,
+        spool=spool,
+        retry_interval=cfg.influxdb.retry_interval or 10.0,
+    )
+
+# setup_aggregation()
+#   - Com [aggregation] enabled, a telemetria vai para o InfluxDB agregada em janelas.
+#   - O NumPy só é importado aqui. Se faltar, a telemetria segue sem agregação.
+def setup_aggregation(registry: DeviceRegistry):
+    global aggregator
+
+    if not cfg.aggregation.enabled:
+        return
+
+    try:
+        from utils.aggregation import Aggregator, STATS
+    except ImportError as e:
+        logger.error("[DISPATCHER] Agregação indisponível (%s), gravando a telemetria sem agregar", e)
+        return
+
+    aggregator = Aggregator(
+        emit=write_data,
+        window=cfg.aggregation.window or 10.0,
+        stats=cfg.aggregation.stats or STATS,
+        buffer_size=cfg.aggregation.buffer_size or 64,
+        measurements=cfg.aggregation.measurements or {},
+        passthrough=cfg.aggregation.passthrough or (),
+        identify=registry.get_id_by_address,
+    ).start()
+
+# setup_state()
+#   - Com [state] enabled, guarda o último estado de cada dispositivo cadastrado.
+#   - Com http_port, serve o estado via HTTP e Socket.IO (Flask só é importado aqui).
+def setup_state(registry: DeviceRegistry):
+    global state, state_api
+
+    if not cfg.state.enabled:
+        return
+
+    state = StateStore(
+        max_devices=cfg.state.max_devices or 1024,
+        max_fields=cfg.state.max_fields or 64,
+        types=cfg.state.types or ("state", "data"),
+    )
+    state.watch(registry)
+
+    if cfg.state.http_port:
+        from utils.state_api import StateAPI
+
+        api = StateAPI(
+            state,
+            host=cfg.state.http_host or "127.0.0.1",
+            port=cfg.state.http_port,
+            cors_origins=cfg.state.cors_origins or (),
+        )
+        if api.start():
+            state_api = api
+
+# record_state()
+#   - Atualiza o último estado do remetente, se ele estiver cadastrado.
+def record_state(message: Envelope, registry: DeviceRegistry):
+    device_id = registry.get_id_by_address(message.src)
+    if device_id is not None:
+        state.update(device_id, message)
+
+# setup_routing()
+#   - Cria a tabela de rotas, o cache de remetentes desconhecidos e o filtro de banda
+#     morta e carrega as regras.
+def setup_routing(registry: DeviceRegistry, handlers: dict):
+    global routes, rules, unknown, deadband
+
+    # Rotas (remetente, destino) compiladas sob demanda, invalidadas pelo registro.
+    routes = RouteTable(registry, handlers)
+
+    # Remetentes desconhecidos: um register_request a cada 1/rate segundos, no máximo.
+    unknown = UnknownSources(
+        registry,
+        ttl=cfg.dispatcher.unknown_ttl or 30.0,
+        rate=cfg.dispatcher.register_request_rate or 0.2,
+        burst=cfg.dispatcher.register_request_burst or 2,
+    )
+
+    # Regras declarativas: espelhos MQTT, cópias para outros dispositivos, descartes.
+    if cfg.paths.routing_rules:
+        rules = load_rules(cfg.paths.routing_rules)
+
+    # Leituras sem mudança além da banda não seguem para o MQTT nem para o InfluxDB.
+    if cfg.deadband.enabled:
+        deadband = DeadbandFilter(
+            cfg.deadband.device_types or {},
+            types=cfg.deadband.types or ("state", "data"),
+            max_silence=cfg.deadband.max_silence if cfg.deadband.max_silence is not None else 300.0,
+        )
+
+# start_handlers()
+#   - Cria os handlers em paralelo, uma thread para cada. O MQTT conecta em segundo
+#     plano, então nenhum handler espera pelo broker.
+#   - Um handler que falhar ao abrir é deixado de fora e o roteamento segue com os outros.
+def start_handlers(registry: DeviceRegistry) -> dict:
+    # - Comunicações do próprio Rasp devem ter sua própria Classe, como o MQTT.
+    # - Comunicações via serial devem ser declaradas em [uart.handlers] no config.toml.
+    factories = {
+        "MQTT": lambda: MQTTHandler(
+            cfg.mqtt.broker,
+            cfg.mqtt.port,
+            queue_size=cfg.mqtt.queue_size or 1024,
+            drop_policy=cfg.mqtt.drop_policy or "drop_oldest",
+            publish_fanout=cfg.mqtt.publish_fanout is not False,
+            publish_combined=bool(cfg.mqtt.publish_combined),
+            reply_topic=cfg.mqtt.reply_topic or "{topic}/reply",
+        ),
+    }
+
+    for protocol, port in (cfg.uart.handlers or {}).items():
+        factories[protocol] = lambda port=port, protocol=protocol: SerialHandler(
+            port,
+            cfg.uart.baudrate,
+            queue_size=cfg.uart.outbound_queue_size or 256,
+            pace=cfg.uart.pace is not False,
+            priority_types=cfg.uart.priority_types or PRIORITY_TYPES,
+            protocol=protocol,
+        )
+
+    with ThreadPoolExecutor(max_workers=len(factories), thread_name_prefix="handler-start") as pool:
+        futures = {name: pool.submit(factory) for name, factory in factories.items()}
+
+    handlers = {}
+    for name, future in futures.items():
+        try:
+            handlers[name] = future.result()
+        except Exception as e:
+            logger.error("[DISPATCHER] Handler '%s' indisponível, seguindo sem ele: %s", name, e)
+
+    if "MQTT" in handlers:
+        handlers["MQTT"].subscribe_registry(registry)
+
+    return handlers
+
+# shard_worker()
+#   - Executada em cada processo do modo shards (ver utils/sharding.py).
+#   - Recebe a réplica do registro e handlers que devolvem os envios ao processo principal.
+#   - Retorna a função chamada para cada mensagem do shard.
+def shard_worker(index: int, registry: DeviceRegistry, handlers: dict):
+    setup_influx(spool_subdir=f"shard-{index}")
+    setup_aggregation(registry)
+    setup_routing(registry, handlers)
+
+    metrics.add_collector("influx", writer_stats)
+    metrics.add_collector("routes", routes.stats)
+    metrics.add_collector("unknown", unknown.stats)
+
+    if deadband is not None:
+        metrics.add_collector("deadband", deadband.stats)
+
+    if aggregator is not None:
+        metrics.add_collector("aggregation", aggregator.stats)
+
+    return lambda message: timed_dispatch(message, registry, handlers)
+
+# shard_teardown()
+#   - Executada em cada processo do modo shards ao encerrar: grava as janelas abertas
+#     e os pontos pendentes.
+def shard_teardown():
+    if aggregator is not None:
+        aggregator.close()
+    close_write_api()
 
 # main()
 # - Inicializa a comunicação com as unidades de cada protocolo e monitora recebimentos.
 # - Se a mensagem recebida for válida, despacha para unidade de destino.
 def main():
     """Start Dispatcher."""
+    startup.mark("imports")
     setup_logging()
+    startup.mark("logging")
 
     logger.info("Iniciando Dispatcher...")
 
+    # Escritas no InfluxDB acontecem em lotes, fora do caminho de roteamento.
+    setup_influx()
+
     # Carrega o Registro de Dispositivos, com o protoclo e endereço/tópico de cada um.
-    registry = DeviceRegistry(Path(__file__).parent / cfg.paths.device_registry)
-    
-    # Instanciando o objeto de cada comunicação.
-    #
-    # - Comunicações do próprio Rasp devem ter sua própria Classe, como o MQTT.
-    # - Comunicações via serial devem ser declaradas usando a Classe SerialHandler.
-    handlers = {
-        "MQTT": MQTTHandler(cfg.mqtt.broker, cfg.mqtt.port),
-        "espnow": SerialHandler(cfg.uart.ports[1], cfg.uart.baudrate),
-    }
+    #  - Alterações vão para um journal, compactado no JSON de tempos em tempos.
+    registry = DeviceRegistry(
+        Path(__file__).parent / cfg.paths.device_registry,
+        debounce=cfg.registry.journal_debounce if cfg.registry.journal_debounce is not None else 0.5,
+        compact_after=cfg.registry.compact_after or 256,
+    )
+    startup.mark("registry")
+
+    # Instanciando o objeto de cada comunicação, em paralelo.
+    handlers = start_handlers(registry)
+    if not handlers:
+        logger.error("Nenhum handler disponível, encerrando Dispatcher.")
+        exit(1)
+
+    startup.mark("handlers")
+
+    setup_aggregation(registry)
+    setup_routing(registry, handlers)
+    setup_state(registry)
+
+    # Modo shards: o roteamento é dividido entre processos, um por remetente.
+    global shards
+    if (cfg.dispatcher.shards or 0) > 1:
+        shards = ShardPool(
+            workers=cfg.dispatcher.shards,
+            setup=shard_worker,
+            teardown=shard_teardown,
+            handlers=handlers,
+            registry=registry,
+            batch_size=cfg.dispatcher.shard_batch or 64,
+            queue_size=cfg.dispatcher.shard_queue_size or 1024,
+        ).start()
+
+    startup.mark("routing")
+
+    setup_metrics(handlers)
+
+    # Modo de gravação: guarda todo quadro recebido para reprodução posterior.
+    capture = None
+    if cfg.capture.enabled:
+        capture = CaptureWriter(
+            Path(__file__).parent / (cfg.capture.directory or "captures"),
+            max_file_bytes=cfg.capture.max_file_bytes or 16 * 1024 * 1024,
+            max_files=cfg.capture.max_files or 16,
+        )
+        for name, handler in handlers.items():
+            capture.attach(name, handler)
+
+    def on_message(message: Envelope):
+        if startup.first_message_at is None:
+            startup.first_message()
+
+        # Pedidos de registro alteram o registro, que só é gravado pelo processo principal.
+        if shards is not None and not (message.dst == "central" and message.type == "register"):
+            # O estado fica no processo principal, onde está a API.
+            if state is not None:
+                record_state(message, registry)
+            shards.submit(message)
+        else:
+            timed_dispatch(message, registry, handlers)
+
+    on_flush = shards.flush if shards is not None else None
 
     logger.info("Dispatcher Iniciado!")
 
-    # Faz a leitura contínua de todos os protocolos configurados.
-    #  - Sempre que receber uma mensagem, envia para o dispatcher.
+    # Sempre que receber uma mensagem, envia para o dispatcher.
+    #  - event_loop: um único loop acorda quando algum handler tem dados para leitura.
+    #  - threaded: uma thread leitora por handler alimenta uma fila compartilhada.
+    if cfg.dispatcher.mode == "threaded":
+        runner = ReaderPool(
+            on_message=on_message,
+            queue_size=cfg.dispatcher.inbound_queue_size or 1024,
+            workers=cfg.dispatcher.router_workers or 1,
+            on_flush=on_flush,
+        )
+    else:
+        runner = EventLoop(on_message=on_message, max_batch=cfg.dispatcher.max_batch or 64, on_flush=on_flush)
+
+    for name, handler in handlers.items():
+        runner.register(name, handler)
+
+    startup.ready()
+
     try:
-        while True:
-            for handler in handlers.values():
-                message = handler.read()
-                if (message):
-                    dispatch(message, registry, handlers)
-            time.sleep(0.1)
-    
+        runner.run_forever()
+
     # Encerra o programa
     except KeyboardInterrupt:
+        runner.close()
+
+        if shards is not None:
+            shards.close()
+
         for handler in handlers.values():
             handler.close()
 
+        registry.close()
+        metrics.close()
+
+        if capture is not None:
+            capture.close()
+
+        if aggregator is not None:
+            aggregator.close()
+
+        if state_api is not None:
+            state_api.close()
+
         close_write_api()
 
         logger.info("Encerrando Dispatcher...")    
+        stop_logging(log_listener)
         exit(1)
 
+# timed_dispatch()
+#   - Chama dispatch() e registra a duração total nas métricas, por protocolo e remetente.
+def timed_dispatch(message: Envelope, registry: DeviceRegistry, handlers: dict):
+    start = time.perf_counter()
+    protocol, source_address = message.protocol, message.src
+
+    dispatch(message, registry, handlers)
+    metrics.observe("dispatch", time.perf_counter() - start, protocol=protocol, device=source_address)
+
 # dispatch()
 #   - Salva o endereço do remetente, o ID do destinatário e o tipo de mensagem.
 #   - Confere se a mensagem recebida tem um destinatário válido.
 #   - Confere se esse destinatário possui um protocolo cadastrado.
 #   - Envia de acordo com protocolo e destino.
 #   - A validação dos campos PRECISA ACONTECER EM GET().
-def dispatch(message: dict, registry: DeviceRegistry, handlers: dict):
-    logger.debug("[DISPATCHER] Recebido a mensagem: %s", message)
+def dispatch(message: Envelope, registry: DeviceRegistry, handlers: dict):
+    logger.debug("[DISPATCHER] Recebido a mensagem: %s", message, extra={"device": message.src})
 
-    message_type   = message.get("type")
-    destination_id = message.get("dst")
-    source_address = message.get("src")
+    message_type   = message.type
+    destination_id = message.dst
+    source_address = message.src
+    protocol       = message.protocol
     
     # 1) Se for um dispositivo pedindo para se registrar
     if destination_id == "central" and message_type == "register":
         register_new_device(message=message, registry=registry, handlers=handlers)
         return
 
-    # 2) Se o remetente é desconhecido, pede para se registrar
-    info = registry.get_by_address(source_address)
+    # 2) Remetente que já sabemos ser desconhecido: nem consulta rotas e registro
+    if unknown is not None and unknown.contains(source_address):
+        request_for_register(source_address, handlers.get(protocol))
+        return
 
-    if info is None:
-        source_handler = message.get("protocol")
-        request_for_register(source_address, handlers.get(source_handler))
+    # 3) Caminho rápido: rota (remetente, destino) já compilada
+    start = time.perf_counter()
+    route = routes.lookup(source_address, destination_id) if routes is not None else None
+    metrics.observe("lookup", time.perf_counter() - start, protocol=protocol)
+
+    # 4) Se o remetente é desconhecido, pede para se registrar
+    if route is None and registry.get_by_address(source_address) is None:
+        if unknown is not None:
+            unknown.remember(source_address)
+
+        request_for_register(source_address, handlers.get(protocol))
+        return
+
+    # 5) Último estado do remetente, antes do filtro: a leitura mais recente sempre conta
+    if state is not None:
+        record_state(message, registry)
+
+    # 6) Leituras repetidas: dentro da banda morta, não seguem para nenhum sink
+    if deadband is not None:
+        device_type = route.measurement if route is not None else (registry.get_by_address(source_address) or {}).get("device_type")
+        if not deadband.accept(message, device_type):
+            return
+
+    # 7) Regras de roteamento (espelhos, cópias, descartes)
+    #    Measurements já gravados por um sink influxdb não são gravados de novo na entrega.
+    written = set()
+    if rules:
+        matched = rules.match(message)
+        if matched and not apply_rules(message, matched, registry, handlers, written):
+            return
+
+    if route is not None:
+        deliver(message, route, source_address, write=route.measurement not in written)
         return
-    # 3) Roteia mensagens válidas
+
+    info = registry.get_by_address(source_address)
+
+    # 8) Roteia mensagens válidas
     if destination_id == "central":
-        logger.info("[CENTRAL] %s -> central: %s", source_address, message.get("payload"))
+        logger.info("[CENTRAL] %s -> central: %s", source_address, message.payload)
     
-    # 4) Roteia Mensagens para outros dispositivos
+    # 9) Roteia Mensagens para outros dispositivos
     destination_info = registry.get_by_id(destination_id)
 
     if not destination_info:
@@ -103,32 +510,124 @@ def dispatch(message: dict, registry: DeviceRegistry, handlers: dict):
     destination_handler  = handlers.get(destination_protocol)
 
     if destination_handler:
-        message["dst"] = destination_info.get("adress") or destination_info.get("topic")
-        destination_handler.handleMessage(destination_info=destination_info, message=message)
-        logger.info("[DISPATCHER] '%s' → '%s' via '%s'", source_address, destination_info, destination_protocol)
-        
-        write_data(envelope_to_point_dict(message=message, measurement=info.get("device_type")))
-        #handlers["MQTT"].publish(f'bifrost/{destination_protocol}/{destination_id}/telemetry', serialize(message))
+        deliver(message, Route(
+            handler=destination_handler,
+            destination_info=destination_info,
+            address=destination_info.get("address") or destination_info.get("topic"),
+            protocol=destination_protocol,
+            measurement=info.get("device_type"),
+        ), source_address, write=info.get("device_type") not in written)
 
-
-    # 5) Mensagens ignoradas (descomentar para debugging)
+    # 10) Mensagens ignoradas (descomentar para debugging)
     else:
         logger.debug("[DISPATCHER] Protocolo %s não implementado.", destination_protocol)
 
+# deliver()
+#   - Entrega a mensagem ao destino (send_to_route) e registra a telemetria no InfluxDB,
+#     a não ser que um sink influxdb já tenha gravado no mesmo measurement (write=False).
+def deliver(message: Envelope, route: Route, source_address: str, write: bool = True):
+    send_to_route(message, route, source_address)
+    if write:
+        write_telemetry(message, route.measurement)
+
+# send_to_route()
+#   - Reescreve o destino da mensagem com o endereço/tópico resolvido.
+#   - Entrega ao handler do destino, sem gravar telemetria.
+def send_to_route(message: Envelope, route: Route, source_address: str):
+    destination_id = message.dst
+    message.dst = route.address
+
+    start = time.perf_counter()
+    route.handler.handleMessage(destination_info=route.destination_info, message=message)
+    metrics.observe("send", time.perf_counter() - start, protocol=route.protocol, device=destination_id)
+    logger.debug("[DISPATCHER] '%s' → '%s' via '%s'", source_address, destination_id, route.protocol, extra={"device": source_address})
+
+# write_telemetry()
+#   - Grava a telemetria da mensagem no InfluxDB: na janela do agregador ou, sem
+#     agregação (ou para dispositivos em passthrough), um ponto por mensagem.
+def write_telemetry(message: Envelope, measurement: str):
+    if aggregator is None or not aggregator.add(message, measurement):
+        write_envelope(message, measurement)
+
+# apply_rules()
+#   - Executa os sinks das regras que casaram com a mensagem, na ordem do arquivo.
+#   - Cada sink recebe uma cópia, a mensagem original segue para o `dst`.
+#   - Os measurements gravados pelos sinks influxdb vão para `written`: cada um é gravado
+#     uma vez por mensagem, e a entrega ao `dst` não grava de novo.
+#   - Retorna False se alguma regra descartou a mensagem.
+def apply_rules(message: Envelope, matched: list, registry: DeviceRegistry, handlers: dict, written: set | None = None) -> bool:
+    if written is None:
+        written = set()
+
+    source_address = message.src
+    source_info    = registry.get_by_address(source_address) or {}
+
+    for rule in matched:
+        for sink in rule.sinks:
+            if sink.kind == SINK_DROP:
+                logger.debug("[DISPATCHER] Mensagem de '%s' descartada pela regra '%s'", source_address, rule.name)
+                return False
+
+            if sink.kind == SINK_MQTT:
+                mqtt_handler = handlers.get("MQTT")
+                if mqtt_handler is None:
+                    continue
+
+                try:
+                    topic = sink.target.format_map({
+                        "src": source_address,
+                        "dst": message.dst,
+                        "type": message.type,
+                        "protocol": message.protocol,
+                        "id": registry.get_id_by_address(source_address),
+                    })
+                except (KeyError, ValueError) as e:
+                    logger.error("[DISPATCHER] Regra '%s': tópico inválido '%s' (%s)", rule.name, sink.target, e)
+                    continue
+
+                mqtt_handler.publish(topic, serialize_bytes(message))
+
+            elif sink.kind == SINK_DEVICE:
+                route = routes.lookup(source_address, sink.target) if routes is not None else None
+                if route is None:
+                    logger.debug("[DISPATCHER] Regra '%s': destino '%s' indisponível", rule.name, sink.target)
+                    continue
+
+                # A telemetria já é gravada na entrega ao `dst`, só encaminha a cópia.
+                send_to_route(message.copy(), route, source_address)
+
+            elif sink.kind == SINK_INFLUXDB:
+                measurement = sink.target or source_info.get("device_type")
+                if measurement not in written:
+                    written.add(measurement)
+                    write_telemetry(message, measurement)
+
+    return True
+
 # register_new_device()
-#   - Recebe o dict da mensagem, o endereço do destinatário.
-#   - Registra os dados no Registry
-#   - Usa a comunicação de origem para enviar a resposta.
-def register_new_device(message: dict, registry: DeviceRegistry, handlers):
-    device_id       = message["payload"].get("id")
-    source_address  = message.get("src")
-    device_protocol = message.get("protocol")
+#   - Recebe o Envelope da mensagem, o endereço do destinatário.
+#   - Registra os dados no Registry, junto do formato de envelope pedido ("json" ou "compact").
+#   - Usa a comunicação de origem para enviar a resposta, já no formato negociado.
+def register_new_device(message: Envelope, registry: DeviceRegistry, handlers):
+    device_id       = message.payload.get("id")
+    device_format   = message.payload.get("format")
+    source_address  = message.src
+    device_protocol = message.protocol
+
+    extra = {"format": device_format} if device_format else {}
+    response = registry.add(device_id=device_id, address=source_address, protocol=device_protocol, **extra)
 
-    response = registry.add(device_id=device_id, address=source_address, protocol=device_protocol)
-    handlers[device_protocol].send(serialize(response))
+    # Dispositivo já registrado renegociando o formato do envelope.
+    info = registry.get_by_id(device_id)
+    registered_address = info.get("address") or info.get("topic")
+    if device_format and registered_address == normalize_address(source_address) and info.get("format") != device_format:
+        registry.update(device_id, format=device_format)
+
+    handlers[device_protocol].send(encode_envelope(response, info.get("format")))
 
 
 # request_for_register()
+#   - Respeita o limite de pedidos por endereço (pedidos suprimidos só são contados).
 #   - Monta o JSON para requisitar os dados do dispositivo.
 #   - Envia a requisição.
 def request_for_register(source_address: str, handler) -> bool:
@@ -137,6 +636,9 @@ def request_for_register(source_address: str, handler) -> bool:
         logger.error("request_for_register() -> HANDLER tem valor nulo")
         return False
 
+    if unknown is not None and not unknown.allow(source_address):
+        return False
+
     request = make_envelope(
         src = "central",
         dst = source_address,
@@ -144,7 +646,7 @@ def request_for_register(source_address: str, handler) -> bool:
         payload={"status":"not_registered"}
     )
 
-    handler.send(serialize(request))
+    handler.send(serialize_bytes(request))
     logger.debug("[DISPATCHER] %s não cadastrado, solicitação de registro enviada.", source_address)
     return True
 
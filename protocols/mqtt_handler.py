@@ -1,7 +1,8 @@
 """Handler para abstrair a Conexao/Envio/Recebimento com o broker mqtt
 
 A classe faz a conexão  e reconexão com o broker automaticamente, evitando
-problemas com queda da rede.
+problemas com queda da rede. A conexão acontece em segundo plano: o handler pode ser
+usado logo após ser criado, mesmo com o broker fora do ar.
 
 As funções principais devem seguir o padrão dos handlers da bifrost, os erros são logados
 com a lib logging.
@@ -16,17 +17,51 @@ Exemplo de uso:
 
 # TODO - Armazenar tópicos em um json.
 
+import math
+import os
+import threading
 import time
 import logging
+from collections import deque
 
 import paho.mqtt.client as mqtt
 
-from utils.envelope import serialize, deserialize
+from utils.envelope import Envelope, serialize_bytes, decode_envelope
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+def _encode_value(value) -> str | bytes:
+    """Serializa o valor de um subtópico, evitando o json para str, int e float.
+
+    Para esses tipos o resultado é idêntico ao do codec JSON, sem o custo do encoder.
+    """
+    kind = type(value)
+
+    if kind is str:
+        return value
+    if kind is int:
+        return int.__repr__(value)
+    if kind is float and math.isfinite(value):
+        return float.__repr__(value)
+
+    return serialize_bytes(value)
+
+# Políticas para quando a fila de entrada estiver cheia.
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
 class MQTTHandler:
-    def __init__(self, broker: str, port: int = 1883):
+    def __init__(
+        self,
+        broker: str,
+        port: int = 1883,
+        queue_size: int = 1024,
+        drop_policy: str = DROP_OLDEST,
+        publish_fanout: bool = True,
+        publish_combined: bool = False,
+        reply_topic: str = "{topic}/reply",
+    ):
         """Classe para abstrair a Conexao/Envio/Recebimento com o broker mqtt
 
         Cria uma instância da lib PahoMQTT. Mantemos o padrão de recebimento e envio de dados dos
@@ -35,18 +70,63 @@ class MQTTHandler:
         A lista de todas os tópicos inscritos é salva em uma variável local, sendo restaurados
         ao reconectar. A classe faz a reconexão automática com o broker em caso de falhas. 
 
+        As mensagens recebidas no padrão Bifrost são guardadas em uma fila limitada,
+        consumida por read()/read_batch(). Se a fila encher, a política de descarte
+        decide se sai a mensagem mais antiga (drop_oldest) ou a recém-chegada (drop_newest).
+
         Args:
             broker: Endereço do broker MQTT.
             port: Porta do broker, por padrão usa a 1883
+            queue_size: Tamanho máximo da fila de mensagens recebidas.
+            drop_policy: "drop_oldest" ou "drop_newest".
+            publish_fanout: Em handleMessage(), publica cada chave do payload em um subtópico.
+            publish_combined: Em handleMessage(), publica o payload inteiro no tópico base.
+            reply_topic: Tópico das respostas da central (send()), a partir do tópico do
+                dispositivo. Precisa ser diferente do tópico em que ele publica.
         """
         self.port   = port
         self.broker = broker
         self.client = mqtt.Client()
         
         self._subscriptions = {}
+
+        # Gravação opcional dos payloads crus (utils.capture.CaptureWriter.attach).
+        self.capture = None
         self._connected = False
+        self._connected_event = threading.Event()
+
+        # Início da primeira conexão, usado apenas para logar quanto tempo ela levou.
+        self._connect_started: float | None = None
         self._should_reconnect = True
 
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Política de descarte inválida: {drop_policy}")
+
+        # Fila de entrada, alimentada pela thread da paho e consumida pelo Dispatcher.
+        # deque.append()/popleft() são atômicos, e só existe um produtor.
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self._inbound = deque(maxlen=queue_size if drop_policy == DROP_OLDEST else None)
+
+        self.received = 0
+        self.dropped = 0
+        self.invalid = 0
+
+        # Publicação em lote (handleMessage)
+        self.publish_fanout = publish_fanout
+        self.publish_combined = publish_combined
+        self.reply_topic = reply_topic
+        self._topic_cache: dict[str, dict[str, str]] = {}
+
+        self.published = 0
+        self.handled = 0
+
+        # Pipe usado para acordar o loop de eventos do Dispatcher a partir da thread da paho.
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._wake_pending = False
+
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
@@ -55,27 +135,30 @@ class MQTTHandler:
         self._connect()
 
     def _connect(self):
-        """Configura e tenta conexão com o broker mqtt.
+        """Configura a conexão com o broker mqtt e inicia o loop da paho, sem esperar.
 
-        Inicia o loop não travante do mqtt, a primeira tentativa de conexão precisa 
-        ser bem sucedida, do contrário encerra o código.
+        A primeira conexão e as reconexões acontecem na thread da paho. Enquanto não
+        conectar, publish() retorna False e as inscrições ficam guardadas para
+        _on_connect(). Use wait_connected() para esperar a conexão.
 
         Não deve ser chamado pelo usuário.
         """
+        self._connect_started = time.monotonic()
+
         try:
             self.client.reconnect_delay_set(min_delay=1, max_delay=60)
             self.client.connect_async(self.broker, self.port)
             self.client.loop_start()
+        except Exception as e:
+            logger.error("Não foi possível iniciar a conexão com %s:%s: %s", self.broker, self.port, e)
 
-            for _ in range(10):
-                if self._connected:
-                    return True
-                time.sleep(0.5)
-            raise Exception("Timeout na Conexão")
+    def wait_connected(self, timeout: float | None = None) -> bool:
+        """Espera a conexão com o broker por até `timeout` segundos.
 
-        except Exception as e:
-            logger.error("Timeout na primeira conexão com %s:%s!", self.broker, self.port)
-            exit(1)
+        Returns:
+            True se estiver conectado.
+        """
+        return self._connected_event.wait(timeout)
 
     def _on_connect(self, client, userdata, flags, rc):
         """Reinscreve em todos os tópis ao conectar - assíncrono
@@ -87,9 +170,15 @@ class MQTTHandler:
         """
         if rc == 0:
             self._connected = True
-            logger.info("Conectado ao Broker com sucesso!")
+            self._connected_event.set()
 
-            for topic in self._subscriptions:
+            if self._connect_started is not None:
+                logger.info("Conectado ao Broker com sucesso em %.2fs!", time.monotonic() - self._connect_started)
+                self._connect_started = None
+            else:
+                logger.info("Conectado ao Broker com sucesso!")
+
+            for topic in list(self._subscriptions):
                 self.client.subscribe(topic)
         else:
             logger.warning("Falha na conexão com o Broker. Código: %s", rc)
@@ -101,6 +190,7 @@ class MQTTHandler:
         interno da conexão para False e logamos
         """
         self._connected = False
+        self._connected_event.clear()
         logger.warning("Desconectado de %s:%s. Código: %s", self.broker, self.port, rc)
     
     def _on_message(self, client, userdata, msg):
@@ -108,24 +198,104 @@ class MQTTHandler:
 
         Aqui são recebidas todas as mensagens dos tópicos inscritos. Para cada tópico
         é conferido se existe uma função callback registrada, se existe, é executada.
+
+        Mensagens no padrão Bifrost (envelope com "dst") entram na fila de entrada
+        e acordam o loop do Dispatcher. Se o envelope não tiver "src", o tópico é usado
+        como endereço do remetente, assim como no registro de dispositivos.
         """
+        if self.capture is not None:
+            self.capture(msg.payload, msg.topic)
+
         try:
-            raw_payload = msg.payload.decode()
-            payload = deserialize(raw_payload)
+            # O codec lê os bytes direto, sem decode(), em JSON ou no formato compacto.
+            start = time.perf_counter()
+            payload = decode_envelope(msg.payload)
+            message = Envelope.from_dict(payload, src=msg.topic, protocol="MQTT")
+            metrics.observe("parse", time.perf_counter() - start, protocol="MQTT")
             
             logger.debug(
-                "[MQTT::_on_message] Mensagem recebida | Tópico: '%s' | Payload: %s | Raw: %s",
+                "[MQTT::_on_message] Mensagem recebida | Tópico: '%s' | Payload: %s",
                 msg.topic,
                 payload,
-                raw_payload,
+                extra={"device": msg.topic},
             )
                 
-            if msg.topic in self._subscriptions:
-                self._subscriptions[msg.topic](msg)
+            callback = self._match_subscription(msg.topic)
+            if callback is not None:
+                callback(msg)
+
+            if message is None:
+                self.invalid += 1
+                return
+
+            # Respostas da própria central voltando por uma inscrição com coringa.
+            if message.src == "central":
+                return
+
+            self._enqueue(message)
                     
         except Exception as e:
             logger.error("[MQTT::_on_message] Erro ao processar mensagem do tópico '%s': %s", msg.topic, e)
 
+    def _match_subscription(self, topic: str):
+        """Retorna o callback da inscrição que corresponde ao tópico (aceita + e #)."""
+        callback = self._subscriptions.get(topic)
+        if callback is not None:
+            return callback
+
+        for subscription, callback in self._subscriptions.items():
+            if mqtt.topic_matches_sub(subscription, topic):
+                return callback
+        return None
+
+    def _enqueue(self, message: Envelope):
+        """Coloca a mensagem na fila de entrada, aplicando a política de descarte."""
+        if len(self._inbound) >= self.queue_size:
+            self.dropped += 1
+
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("[MQTT] Fila de entrada cheia (%s), %d mensagens descartadas.", self.drop_policy, self.dropped)
+
+            if self.drop_policy == DROP_NEWEST:
+                return
+
+        # Com drop_oldest, a deque (maxlen) descarta a mais antiga sozinha.
+        self._inbound.append(message)
+        self.received += 1
+        self._wakeup()
+
+    def _wakeup(self):
+        """Sinaliza o pipe interno para acordar o loop de eventos.
+
+        Só escreve no pipe se o sinal anterior já foi consumido por read(), evitando
+        uma syscall por mensagem durante rajadas.
+        """
+        if self._wake_pending:
+            return
+
+        self._wake_pending = True
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _clear_wakeup(self):
+        """Consome os sinais pendentes no pipe interno.
+
+        O pipe é esvaziado antes de liberar a flag, assim um sinal escrito durante a
+        limpeza nunca é perdido (no pior caso, o loop acorda uma vez a mais).
+        """
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        self._wake_pending = False
+
+    def fileno(self) -> int:
+        """Descritor que fica legível quando chegam mensagens, usado pelo loop de eventos."""
+        return self._wake_r
+
     def subscribe(self, topic: str, callback = None):
         """Se inscreve em um tópico e salva função callback
 
@@ -137,8 +307,9 @@ class MQTTHandler:
             callback: Uma função que será usada como callback e deve
                 esperar "msg".
         """
-        self.client.subscribe(topic)
+        # Guardada antes: se a conexão chegar agora, _on_connect() já inscreve o tópico.
         self._subscriptions[topic] = callback or (lambda x: None)
+        self.client.subscribe(topic)
         logger.info("Inscrito com sucesso no tópico: '%s'", topic)
 
     def publish(self, topic: str, payload, qos: int = 0, retain: bool = False) -> bool:
@@ -163,52 +334,215 @@ class MQTTHandler:
             return False
         
         try:
-            if not isinstance(payload, str):
-                payload = serialize(payload)
+            if not isinstance(payload, (str, bytes, bytearray)):
+                payload = serialize_bytes(payload)
             
             info = self.client.publish(topic, payload, qos=qos, retain=retain)
+            self.published += 1
             return info.rc == mqtt.MQTT_ERR_SUCCESS
 
         except Exception as e:
             logger.warning("Erro ao publicar MQTT | Tópico: '%s' | Payload: %s", topic, payload)
             return False
 
-    def handleMessage(self, destination_info: dict, message:dict) -> bool:
+    def publish_many(self, messages: list[tuple[str, str]], qos: int = 0, retain: bool = False) -> bool:
+        """Publica um lote de mensagens já serializadas.
+
+        A conexão é conferida uma única vez para o lote inteiro e as mensagens são
+        apenas colocadas na fila de saída da paho, que envia tudo na sua própria thread.
+
+        Args:
+            messages: Lista de tuplas (tópico, payload), com os payloads já em str ou bytes.
+            qos: Nível de qos das mensagens (padrão é 0).
+            retain: Se as mensagens devem ser retidas ou não (padrão é False).
+
+        Returns:
+            True se todas as mensagens foram enfileiradas, False em caso de erro ou
+            se não houver conexão ativa.
+        """
+        if not self._connected:
+            logger.warning("Tentativa de publicação sem conexão ativa | %d mensagens descartadas", len(messages))
+            return False
+
+        publish = self.client.publish
+        ok = True
+
+        try:
+            for topic, payload in messages:
+                if publish(topic, payload, qos=qos, retain=retain).rc != mqtt.MQTT_ERR_SUCCESS:
+                    ok = False
+        except Exception as e:
+            logger.warning("Erro ao publicar lote MQTT (%d mensagens): %s", len(messages), e)
+            return False
+
+        self.published += len(messages)
+        return ok
+
+    def _subtopics(self, base_topic: str, keys) -> dict[str, str]:
+        """Retorna (e guarda) os subtópicos "base/chave" de um destino."""
+        topics = self._topic_cache.get(base_topic)
+
+        if topics is None:
+            topics = self._topic_cache[base_topic] = {}
+
+        for key in keys:
+            if key not in topics:
+                topics[key] = f"{base_topic.rstrip('/')}/{key}"
+
+        return topics
+
+    def handleMessage(self, destination_info: dict, message: Envelope) -> bool:
         """ Função para lidar com mensagens recebidas pelo Dispatcher
+
+        Payloads em dicionário são distribuídos em um subtópico por chave
+        (publish_fanout) e/ou enviados inteiros no tópico base (publish_combined),
+        tudo em um único lote.
         
         Args:
             destination_info: Dicionário com as informações do destinatário (tópico e protocolo).
-            message: Dicionário no padrão de mensagem da Bifrost.
+            message: Envelope no padrão de mensagem da Bifrost.
 
         Returns:
             Bool: Em caso de sucesso, irá retornar True. Se ocorrer algum erro,
                 irá retornar False.  
         """
-        base_topic = destination_info["topic"].rstrip("/")
-        payload = message.get("payload",{})
+        # Registros antigos de dispositivos MQTT guardavam o tópico em "address".
+        base_topic = destination_info.get("topic") or destination_info["address"]
+        payload = message.payload if message.payload is not None else {}
 
-        if isinstance(payload, dict):
-            for key, value in payload.items():
-                subtopic = f"{base_topic}/{key}"
+        self.handled += 1
 
-                logger.debug("Publicando em tópico: '%s' | Payload: %s", subtopic, payload)
-                self.publish(subtopic, value)
-        else:
+        if not isinstance(payload, dict):
             logger.debug("Publicando em tópico: '%s' | Payload: %s", base_topic, payload)
-            self.publish(base_topic, payload)
+            return self.publish(base_topic.rstrip("/"), payload)
+
+        batch = []
+
+        if self.publish_fanout:
+            topics = self._subtopics(base_topic, payload)
+            batch.extend([(topics[key], _encode_value(value)) for key, value in payload.items()])
+
+        if self.publish_combined:
+            batch.append((base_topic.rstrip("/"), serialize_bytes(payload)))
+
+        logger.debug("Publicando %d mensagens em '%s' | Payload: %s", len(batch), base_topic, payload)
+        return self.publish_many(batch)
 
-    def read(self) -> dict | None:
+    def send(self, data: bytes | None, topic: str | None = None) -> bool:
+        """Envia um envelope já codificado a um dispositivo MQTT, como os handlers seriais.
+
+        Usado pelo Dispatcher nos pedidos e respostas de registro. O envelope vai para o
+        tópico de resposta do dispositivo (reply_topic), não para o tópico em que ele
+        publica, que é o tópico inscrito pelo Dispatcher.
+
+        Args:
+            data: Envelope codificado (JSON ou compacto).
+            topic: Tópico do dispositivo. Se None, usa o "dst" do envelope.
+
+        Returns:
+            True se a mensagem foi publicada.
+        """
+        if data is None:
+            logger.error("[MQTT::send] Envelope vazio, nada foi enviado")
+            return False
+
+        if topic is None:
+            try:
+                topic = decode_envelope(data).get("dst")
+            except Exception as e:
+                logger.error("[MQTT::send] Envelope inválido, sem tópico de destino: %s", e)
+                return False
+
+        if not isinstance(topic, str) or not topic:
+            logger.error("[MQTT::send] Envelope sem tópico de destino: %r", data)
+            return False
+
+        return self.publish(self.reply_topic.format(topic=topic.rstrip("/")), data)
+
+    def publish_stats(self) -> dict:
+        """Contadores de publicação: mensagens publicadas e média por handleMessage()."""
+        return {
+            "published": self.published,
+            "handled": self.handled,
+            "per_dispatch": self.published / self.handled if self.handled else 0.0,
+        }
+
+    def subscribe_registry(self, registry) -> int:
+        """Se inscreve nos tópicos de todos os dispositivos MQTT do registro.
+
+        Os tópicos do registro podem usar os coringas do MQTT (+ e #).
+
+        Args:
+            registry: O DeviceRegistry do Dispatcher.
+
+        Returns:
+            Quantidade de tópicos inscritos.
+        """
+        topics = {
+            topic for info in registry.get_by_protocol("MQTT").values()
+            if (topic := info.get("topic") or info.get("address"))
+        }
+
+        for topic in topics:
+            if topic not in self._subscriptions:
+                self.subscribe(topic)
+
+        return len(topics)
+
+    def read(self) -> Envelope | None:
         """Função padrão da bifrost para leitura dos Handlers
         
         Returns:
-            None
+            A mensagem mais antiga da fila de entrada, ou None se estiver vazia.
         """
-        # TODO - AINDA NÃO IMPLMENTADA, PRECISA SER USADA COMO CALLBACK DOS SUBSCRIBES
-        return None
+        self._clear_wakeup()
+
+        try:
+            message = self._inbound.popleft()
+        except IndexError:
+            return None
+
+        if self._inbound:
+            self._wakeup()
+        return message
+
+    def read_batch(self, max_messages: int | None = None) -> list[Envelope]:
+        """Esvazia a fila de entrada, até max_messages mensagens.
+
+        Returns:
+            Lista (possivelmente vazia) de mensagens, da mais antiga para a mais nova.
+        """
+        self._clear_wakeup()
+
+        count = len(self._inbound) if max_messages is None else min(max_messages, len(self._inbound))
+        messages = []
+
+        for _ in range(count):
+            try:
+                messages.append(self._inbound.popleft())
+            except IndexError:
+                break
+
+        # Se sobraram mensagens, mantém o descritor legível para a próxima passada.
+        if self._inbound:
+            self._wakeup()
+
+        return messages
+
+    def stats(self) -> dict:
+        """Contadores da fila de entrada."""
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "pending": len(self._inbound),
+        }
     
     def close(self):
         """Função padrão da Bifrost para fechar a conexão, um encapsulamento de disconnect()"""
         self.disconnect()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
 
     def disconnect(self):
         """Desativa a reconexão e chama mqtt.disconnect()"""
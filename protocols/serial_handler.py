@@ -3,6 +3,18 @@
 A classe estabelece a conexão serial com as centrais da Bifrost, as funções 
 seguem o padrão com read(), send(), handleMessage() e close(). 
 
+Os envios não escrevem direto na porta: send() coloca o quadro em uma fila da porta,
+esvaziada por uma thread escritora no ritmo do baudrate (10 bits por byte). Assim uma
+rajada de mensagens roteadas não prende o Dispatcher enquanto a UART transmite.
+    - Comandos e mensagens de registro passam na frente da telemetria e de qualquer
+      outro tipo (priority_types).
+    - Telemetria ("state") ainda na fila para o mesmo destino é substituída pela
+      mais recente, em vez de transmitir leituras velhas.
+    - Com a fila cheia, a telemetria mais antiga é descartada primeiro.
+
+Quadros JSON terminam em '\n'. Quadros compactos não: o corpo em MessagePack pode
+conter 0x0A, e o tamanho no cabeçalho (MAGIC + varint) já diz onde o quadro acaba.
+
 Exemplo de uso:
 
     ser = SerialHandler("/dev/ttyUSB0")
@@ -14,15 +26,37 @@ Exemplo de uso:
 """
 
 import logging
+import threading
+import time
+from collections import deque
 
 import serial
 
-from utils.envelope import deserialize, serialize, make_envelope
+from utils import compact
+from utils.envelope import Envelope, decode_message, encode_envelope
+from utils.framer import LineFramer
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Prioridades da fila de saída
+PRIORITY_HIGH = 0   # Respostas de registro, pedidos de registro e comandos
+PRIORITY_LOW = 1    # Telemetria e os demais tipos
+
+# Tipos de mensagem enviados com PRIORITY_HIGH em handleMessage(), os outros vão com PRIORITY_LOW
+PRIORITY_TYPES = {"command", "register", "register_request", "register_response"}
+
+# Tipos de mensagem que podem ser substituídos pela versão mais recente na fila
+COALESCE_TYPES = {"state"}
+
+# Primeiro byte dos quadros compactos
+_MAGIC = bytes([compact.MAGIC])
+
+# Bits transmitidos por byte na UART (start + 8 dados + stop)
+BITS_PER_BYTE = 10
+
 class SerialHandler:
-    def __init__(self, port: str, baudrate: int):
+    def __init__(self, port: str, baudrate: int, queue_size: int = 256, pace: bool = True, priority_types=PRIORITY_TYPES, protocol: str | None = None):
         """ Classe para abstrair a Conexão/Envio/Recebimento de Dados Seriais
 
         Cria uma instância da lib pySerial. Mantemos o padrão de recebimento e 
@@ -31,87 +65,303 @@ class SerialHandler:
         Args:
             port: porta que será usada para tentar conectar Serial
             baudrate: velocidade da transmissão de dados
+            queue_size: Quadros aguardando envio, somando as duas prioridades.
+            pace: Espaça as escritas pelo tempo de transmissão no baudrate.
+            priority_types: Tipos de mensagem que passam na frente dos demais na fila.
+            protocol: Nome do handler no Dispatcher (ex.: "espnow"), o rótulo `protocol`
+                das métricas, como nas de leitura. Se None, a porta.
+
+        Se a porta não puder ser aberta, o erro é logado e repassado a quem criou o
+        handler, que decide se segue sem ele.
         """
         self.port = port
         self.baudrate = baudrate
+        self.queue_size = queue_size
+        self.pace = pace
+        self.priority_types = frozenset(priority_types)
+        self.protocol = protocol or port
+
+        # Quadros incompletos ficam no framer, mensagens já lidas e não entregues em _pending.
+        self._framer = LineFramer(binary_magic=compact.MAGIC, frame_length=compact.frame_length)
+        self._pending = deque()
+
+        # Gravação opcional dos quadros crus (utils.capture.CaptureWriter.attach).
+        self.capture = None
+
+        # Fila de saída: um deque por prioridade. Cada item é [dados, chave de coalescência].
+        self._outbound = (deque(), deque())
+        self._coalesce: dict[tuple, list] = {}
+        self._out_cond = threading.Condition()
+        self._closing = False
+
+        # Contadores expostos em stats()
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.coalesced = 0
 
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
+            # timeout=0: as leituras nunca bloqueiam, o loop só lê o que já chegou.
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0)
             self.ser.flushInput()
             logger.info("Conectado à porta '%s' @ %dbps", self.port, self.baudrate)
         except Exception as e:
             logger.error("Não foi possível abrir '%s': %s", self.port, e)
-            exit(1)
+            raise
+
+        self._writer = threading.Thread(target=self._write_loop, name=f"serial-writer-{self.port}", daemon=True)
+        self._writer.start()
         
-    def close(self):
-        """Instancia a função .close() do pySerial"""
-        self.ser.close = self.close
+    def close(self, timeout: float = 2.0):
+        """Envia o que ainda estiver na fila (até `timeout` segundos) e fecha a porta."""
+        with self._out_cond:
+            self._closing = True
+            self._out_cond.notify()
+
+        self._writer.join(timeout)
+
+        if self._writer.is_alive():
+            logger.warning("%s - %d quadro(s) não enviados ao fechar", self.port, self._depth())
 
-    def read(self) -> dict | None:
-        """ Faz a leitura e filtragem de dados na porta conectada.
+        self.ser.close()
 
-        Faz a leitura dos dados até que receba uma quebra de linha. Ignora as sujeiras
-        recebidas. Todas as mensagens são convertidas em dicionário.
+    def stats(self) -> dict:
+        """Contadores da fila de saída."""
+        with self._out_cond:
+            return {
+                "queued": self._depth(),
+                "queued_high": len(self._outbound[PRIORITY_HIGH]),
+                "sent": self.sent,
+                "sent_bytes": self.sent_bytes,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+    def fileno(self) -> int:
+        """Descritor da porta serial, usado pelo loop de eventos do Dispatcher."""
+        return self.ser.fileno()
+
+    def read(self) -> Envelope | None:
+        """ Retorna uma mensagem recebida na porta conectada.
+
+        Mantido para compatibilidade, entrega as mensagens de read_batch() uma a uma.
 
         Returns:
-            dict: Retorna um dicionário com uma mensagem bifrost válida
+            Envelope: Retorna uma mensagem bifrost válida, ou None.
         """
-        if not self.ser.in_waiting:
-            return None
-        
-        # Tenta ler até encontrar uma quebra de linha ou limite de tamanho
-        raw = self.ser.readline().decode('utf-8', errors='ignore').strip()
+        if not self._pending:
+            self._pending.extend(self.read_batch())
+
+        return self._pending.popleft() if self._pending else None
+
+    def read_batch(self, max_messages: int | None = None) -> list[Envelope]:
+        """ Faz a leitura e filtragem de todos os dados disponíveis na porta.
+
+        Lê de uma vez tudo que está em in_waiting, sem bloquear, e separa todas as
+        linhas completas. Linhas incompletas ficam guardadas para a próxima chamada.
+        Ignora as sujeiras recebidas. Todas as mensagens são convertidas em Envelope.
+
+        Args:
+            max_messages: Quantidade máxima de mensagens retornadas, o excedente é
+                entregue nas próximas chamadas.
+
+        Returns:
+            list: Lista (possivelmente vazia) de mensagens bifrost válidas.
+        """
+        waiting = self.ser.in_waiting
+        if waiting:
+            for frame in self._framer.feed(self.ser.read(waiting)):
+                if self.capture is not None:
+                    self.capture(frame)
+
+                message = self._parse(frame)
+                if message is not None:
+                    self._pending.append(message)
+
+        if max_messages is None or len(self._pending) <= max_messages:
+            messages = list(self._pending)
+            self._pending.clear()
+            return messages
+
+        return [self._pending.popleft() for _ in range(max_messages)]
+
+    def _parse(self, frame: memoryview) -> Envelope | None:
+        """Converte um quadro em uma mensagem, retorna None para quadros inválidos."""
 
         # Descarta qualquer lixo que entrar na serial -> Mensagem mínima válida: {}
-        if not raw or len(raw) < 3:  
+        if len(frame) < 3:
             return None
 
-        if not (raw.startswith('{') and raw.endswith('}')):
+        # Quadros compactos começam com compact.MAGIC, os JSON com '{' ... '}'
+        if frame[0] != compact.MAGIC and not (frame[0] == 0x7B and frame[-1] == 0x7D):
             return None
         
-        # Tenta converter em um dicionário.
+        # Tenta converter em um Envelope (exige "src" e "dst").
         # Se erro, retorna Nulo.
-        # Se sucesso, retorna dicionário.
         try:
-            data = deserialize(raw)
-            
-            if not isinstance(data, dict):
-                return None
-                
-            # Verifica campos obrigatórios
-            if 'src' not in data or 'dst' not in data:
-                logger.debug("%s - JSON recebido com estrutura incompleta: %s", self.port, raw)
+            # O codec lê o memoryview do framer direto, sem cópia nem decode().
+            start = time.perf_counter()
+            message = decode_message(frame)
+            metrics.observe("parse", time.perf_counter() - start, protocol=self.protocol)
+
+            if message is None:
+                logger.debug("%s - Envelope recebido com estrutura incompleta: %s", self.port, frame.tobytes())
                 return None
-                
-            return data
+
+            return message
         except Exception as e:
-            logger.warning("%s - Erro inesperado: %s", self.port, raw)
+            logger.warning("%s - Erro inesperado: %s", self.port, frame.tobytes())
             return None
     
-    def send(self, string: str):
-        """Envia uma string para a porta serial conectada
-        
+    def send(self, string: str | bytes, priority: int = PRIORITY_HIGH, coalesce_key: tuple | None = None, binary: bool | None = None) -> bool:
+        """Coloca uma string na fila de envio da porta serial conectada
+
+        Retorna sem esperar a transmissão, a thread escritora envia na ordem de
+        prioridade.
+
         Args:
-            string: Uma string com os dados que serão enviados
+            string: Uma string (ou bytes já codificados) com os dados que serão enviados
+            priority: PRIORITY_HIGH (padrão, respostas e comandos) ou PRIORITY_LOW.
+            coalesce_key: Se outro quadro com a mesma chave ainda estiver na fila, ele
+                é substituído por este, mantendo a posição.
+            binary: Quadro compacto, enviado sem o '\n' no fim. Com None, vale para
+                dados que começam com compact.MAGIC.
+
+        Returns:
+            False se o quadro foi descartado por falta de espaço na fila ou se não há
+            dados para enviar.
+        """
+        if string is None:
+            logger.error("%s - Nada para enviar, quadro vazio (None)", self.port)
+            return False
+
+        data = string.encode('utf-8') if isinstance(string, str) else string
+
+        if binary is None:
+            binary = data[:1] == _MAGIC
+        if not binary:
+            data += b'\n'
+
+        with self._out_cond:
+            if coalesce_key is not None:
+                item = self._coalesce.get(coalesce_key)
+                if item is not None:
+                    item[0] = data
+                    self.coalesced += 1
+                    return True
+
+            if self._depth() >= self.queue_size and not self._make_room():
+                self.dropped += 1
+                logger.debug("%s - Fila de saída cheia, quadro descartado", self.port)
+                return False
+
+            item = [data, coalesce_key]
+            self._outbound[priority].append(item)
+            if coalesce_key is not None:
+                self._coalesce[coalesce_key] = item
+
+            self._out_cond.notify()
+
+        logger.debug("Enfileirado: '%s' para '%s' @ %dbps", string, self.port, self.baudrate, extra={"device": self.port})
+        return True
+
+    def _depth(self) -> int:
+        return len(self._outbound[PRIORITY_HIGH]) + len(self._outbound[PRIORITY_LOW])
+
+    def _make_room(self) -> bool:
+        """Descarta a telemetria mais antiga para abrir espaço. Chamado com _out_cond.
+
+        Returns:
+            False se a fila só tem quadros de prioridade alta.
+        """
+        low = self._outbound[PRIORITY_LOW]
+        if not low:
+            return False
+
+        _, key = low.popleft()
+        if key is not None:
+            self._coalesce.pop(key, None)
+
+        self.dropped += 1
+        return True
+
+    def _next_frame(self) -> bytes | None:
+        """Espera e retira o próximo quadro, os de prioridade alta primeiro.
+
+        Returns:
+            O quadro, ou None quando a porta está sendo fechada e a fila esvaziou.
         """
-        self.ser.write(string.encode('utf-8') + b'\n')
-        logger.info("Enviado: '%s' para '%s' @ %dbps - ", string, self.port, self.baudrate)
+        with self._out_cond:
+            while not self._depth():
+                if self._closing:
+                    return None
+                self._out_cond.wait()
+
+            queue = self._outbound[PRIORITY_HIGH] or self._outbound[PRIORITY_LOW]
+            data, key = queue.popleft()
+
+            if key is not None:
+                self._coalesce.pop(key, None)
+
+            return data
+
+    def _write_loop(self) -> None:
+        """Thread escritora: envia os quadros da fila no ritmo do baudrate."""
+        ready_at = time.monotonic()
 
-    def handleMessage(self, destination_info: dict, message: dict):
+        while True:
+            data = self._next_frame()
+            if data is None:
+                return
+
+            # Espera a UART transmitir o quadro anterior. Sem isso, o quadro iria
+            # para o buffer do sistema e não poderia mais ser priorizado ou substituído.
+            if self.pace:
+                delay = ready_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            try:
+                self.ser.write(data)
+            except Exception as e:
+                logger.error("%s - Falha ao enviar: %s", self.port, e)
+                continue
+
+            self.sent += 1
+            self.sent_bytes += len(data)
+            ready_at = max(ready_at, time.monotonic()) + len(data) * BITS_PER_BYTE / self.baudrate
+
+            logger.debug("Enviado: '%s' para '%s' @ %dbps", data, self.port, self.baudrate, extra={"device": self.port})
+
+    def handleMessage(self, destination_info: dict, message: Envelope) -> bool:
         """Faz o tratamento dos dados recebidos para enviar via send()
 
         É uma implementação padrão dos Handlers da Bifrost.
 
         Args:
             destination_info: Um dicionário com as infomações do destinatário.
-            message: Um dicionário com a mensagem que deve ser redirecionada.
+            message: O Envelope da mensagem que deve ser redirecionada.
+
+        Returns:
+            False se a mensagem não pôde ser codificada ou foi descartada na fila.
         """
-        source = message["src"]
+        source = message.src
         destination = destination_info["address"]
-        payload = message["payload"]
+        message_type = message.type or "state"
+
+        # Envelopando e enviando no formato negociado pelo destinatário (json ou compact)
+        message = Envelope(source, destination, message.payload, type=message_type, ts=int(time.time()))
+        sendMessage = encode_envelope(message, destination_info.get("format"))
+        if sendMessage is None:
+            logger.error("%s - Mensagem de '%s' para '%s' não pôde ser codificada, descartada", self.port, source, destination)
+            return False
+
+        # Comandos e registro vão na frente; o resto (telemetria, "data"...) vai atrás,
+        # e só a leitura mais recente de cada remetente para o destino é transmitida.
+        binary = sendMessage[:1] == _MAGIC
+        if message_type in self.priority_types:
+            return self.send(b"SEND:" + sendMessage, binary=binary)
 
-        # Envelopando e enviando
-        message = make_envelope(source, destination, payload)
-        sendMessage = serialize(message)
-        self.send("SEND:" + sendMessage)
+        coalesce_key = (destination, message_type, source) if message_type in COALESCE_TYPES else None
+        return self.send(b"SEND:" + sendMessage, priority=PRIORITY_LOW, coalesce_key=coalesce_key, binary=binary)
 
@@ -0,0 +1,73 @@
+"""Benchmark da agregação da telemetria (utils.aggregation).
+
+Simula uma frota de sensores enviando telemetria por alguns minutos de relógio virtual
+e compara a gravação de um ponto por mensagem com a agregação em janelas:
+
+    - µs de CPU por mensagem no caminho de roteamento (Aggregator.add);
+    - pontos e bytes de line protocol enviados ao InfluxDB.
+
+Uso:
+    python -m tests.bench_aggregation
+    python -m tests.bench_aggregation --devices 50 --rate 20 --window 60
+"""
+
+import argparse
+import random
+import time
+from unittest import mock
+
+from utils.aggregation import Aggregator
+from utils.envelope import Envelope
+
+def line_size(point: dict) -> int:
+    """Tamanho aproximado da linha do ponto em line protocol."""
+    tags = ",".join(f"{key}={value}" for key, value in point["tags"].items() if value is not None)
+    fields = ",".join(f"{key}={value}" for key, value in point["fields"].items())
+    return len(point["measurement"]) + len(tags) + len(fields) + 22
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da agregação da telemetria")
+    parser.add_argument("--devices", type=int, default=20, help="sensores simulados")
+    parser.add_argument("--rate", type=float, default=10.0, help="mensagens/s de cada sensor")
+    parser.add_argument("--seconds", type=int, default=300, help="duração simulada (s)")
+    parser.add_argument("--window", type=float, default=10.0, help="janela da agregação (s)")
+    args = parser.parse_args()
+
+    clock = [1_754_413_680.0]
+    points = []
+    aggregator = Aggregator(emit=points.append, window=args.window)
+
+    messages = []
+    for step in range(int(args.seconds * args.rate)):
+        for device in range(args.devices):
+            messages.append(Envelope(
+                src=f"AA:BB:CC:00:00:{device:02X}", dst="painel", protocol="espnow", type="state",
+                payload={"temperature": round(random.uniform(15, 35), 1), "humidity": random.randint(30, 90)},
+            ))
+
+    raw_bytes = sum(
+        line_size({"measurement": "bench", "tags": {"src": m.src, "protocol": m.protocol, "type": m.type}, "fields": m.payload})
+        for m in messages
+    )
+
+    cpu = time.process_time()
+
+    # Relógio virtual: avança 1/rate segundo a cada rodada da frota.
+    with mock.patch("utils.aggregation.time.time", lambda: clock[0]):
+        for i, message in enumerate(messages):
+            if i % args.devices == 0:
+                clock[0] += 1 / args.rate
+            aggregator.add(message, "bench")
+
+        cpu = time.process_time() - cpu
+        aggregator.close()
+
+    aggregated_bytes = sum(line_size(point) for point in points)
+
+    print(f"mensagens: {len(messages):,} | {cpu / len(messages) * 1e6:.2f} µs de CPU/msg em add()")
+    print(f"     sem agregação: {len(messages):>9,} pontos | {raw_bytes / 1024:>9,.0f} KiB")
+    print(f"janela de {args.window:g}s: {len(points):>9,} pontos | {aggregated_bytes / 1024:>9,.0f} KiB")
+    print(f"\npontos: {len(points) / len(messages):.1%} | bytes: {aggregated_bytes / raw_bytes:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark dos codecs JSON disponíveis para os envelopes da Bifrost.
+
+Mede serialize_bytes() e deserialize() com cada codec instalado (orjson, msgspec,
+json), usando envelopes iguais aos que circulam entre as centrais.
+
+Uso:
+    python -m tests.bench_codec
+"""
+
+import time
+
+from utils import envelope
+from utils.envelope import CODECS, deserialize, select_codec, serialize_bytes
+
+ROUNDS = 50_000
+
+ENVELOPES = [
+    # Telemetria do termohigrômetro via ESP-NOW
+    {
+        "v": 1, "src": "2C:F4:32:16:F5:17", "dst": "termohigrometro-MQTT", "protocol": "espnow",
+        "type": "state", "ts": 1754413674, "payload": {"temperature": 24.7, "humidity": 61.2},
+    },
+    # Pedido de registro
+    {
+        "v": 1, "src": "CC:7B:5C:4F:FA:90", "dst": "central", "protocol": "espnow",
+        "type": "register", "ts": 1754413674, "payload": {"id": "esp8266-ping", "device_type": "ping"},
+    },
+    # Resposta de registro enviada pela central
+    {
+        "v": 1, "src": "central", "dst": "CC:7B:5C:4F:CD:09", "type": "register_response",
+        "ts": 1754413674, "payload": {"status": "already_registered", "device_id": "ESP_Blink"},
+    },
+    # Comando para um atuador
+    {
+        "v": 1, "src": "central", "dst": "48:55:19:00:04:1E", "type": "command",
+        "ts": 1754413674, "payload": {"status": "registered", "led": 1},
+    },
+]
+
+def main():
+    encoded = [serialize_bytes(e) for e in ENVELOPES]
+    print(f"Tamanho médio do envelope: {sum(map(len, encoded)) / len(encoded):.0f} bytes\n")
+    print(f"{'codec':>8} | {'serialize (µs)':>14} | {'deserialize (µs)':>16}")
+
+    for name in CODECS:
+        try:
+            CODECS[name]()
+        except ImportError:
+            print(f"{name:>8} | {'não instalado':>14} |")
+            continue
+
+        select_codec(name)
+        encoded = [serialize_bytes(e) for e in ENVELOPES]
+        assert [deserialize(memoryview(e)) for e in encoded] == ENVELOPES
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for e in ENVELOPES:
+                serialize_bytes(e)
+        dumps = (time.perf_counter() - start) / (ROUNDS * len(ENVELOPES))
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for e in encoded:
+                deserialize(e)
+        loads = (time.perf_counter() - start) / (ROUNDS * len(ENVELOPES))
+
+        print(f"{envelope.CODEC:>8} | {dumps * 1e6:>14.2f} | {loads * 1e6:>16.2f}")
+
+    select_codec()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""Benchmark de carga do Dispatcher, sem hardware.
+
+Monta o Dispatcher completo (handlers reais, tabela de rotas, escritor do InfluxDB,
+loop de eventos ou threads leitoras) em volta de dublês locais:
+
+    - uma porta serial virtual (par de pty): o gerador escreve os quadros dos
+      dispositivos ESP-NOW no lado mestre e o SerialHandler lê o lado escravo;
+    - um broker MQTT stub (tests/mqtt_stub.py), onde publicam os dispositivos MQTT
+      e chegam as entregas ao painel;
+    - um InfluxDB stub (tests/influx_stub.py).
+
+A frota sintética tem N dispositivos seriais e K dispositivos MQTT, todos mandando
+telemetria ao "painel" (um tópico MQTT), a M mensagens/s no total (0 = o mais rápido
+possível). Cada mensagem leva o instante de envio, então a latência de ponta a ponta
+é medida na chegada ao broker. Com --downlink, uma fração das mensagens vai para um
+atuador na própria serial.
+
+Com --replay, as mensagens vêm de uma captura em vez da frota sintética: um arquivo
+.bcap gravado pelo Dispatcher (utils.capture) ou um envelope JSON por linha.
+Remetentes e destinos da captura são cadastrados automaticamente.
+
+Com --shards N, o roteamento roda em N processos (utils.sharding), como com
+[dispatcher] shards no config.toml.
+
+Ao final, mostra vazão, latência de ponta a ponta, percentis de cada etapa
+(utils.metrics), CPU e memória (RSS). No modo shards, CPU e RSS são apenas do
+processo principal.
+
+Uso:
+    python -m tests.bench_dispatch --devices 50 --rate 500 --duration 10
+    python -m tests.bench_dispatch --rate 0 --messages 20000 --format compact
+    python -m tests.bench_dispatch --mode threaded --downlink 0.1
+    python -m tests.bench_dispatch --rate 0 --messages 50000 --shards 4
+    python -m tests.bench_dispatch --replay captures/capture-20250805-141500-000001.bcap
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+import tty
+from pathlib import Path
+
+from tests.influx_stub import InfluxStub
+from tests.mqtt_stub import MQTTStub
+from utils.capture import SUFFIX, decode_record, read_capture
+
+PANEL_TOPIC = "bench/painel"
+ACTUATOR_ADDRESS = "AA:BB:CC:FF:FF:FF"
+
+# Intervalo do gerador: a cada passo, envia as mensagens devidas até ali.
+TICK = 0.005
+
+def shard_setup(index: int, registry, handlers: dict):
+    """Processo de roteamento do modo --shards, montado como o Harness monta o seu."""
+    import main as dispatcher
+    from utils.database import start_writer
+    from utils.routes import RouteTable
+    from utils.unknown_sources import UnknownSources
+
+    start_writer(batch_size=500, flush_interval=0.5)
+
+    dispatcher.routes = RouteTable(registry, handlers)
+    dispatcher.unknown = UnknownSources(registry)
+    dispatcher.rules = None
+
+    return lambda message: dispatcher.timed_dispatch(message, registry, handlers)
+
+def mac(i: int) -> str:
+    return ":".join(f"{b:02X}" for b in (0xAA, 0xBB, *i.to_bytes(4, "big")))
+
+def rss_kib() -> tuple[int, int]:
+    """RSS atual e pico (KiB) do processo."""
+    current = 0
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1])
+    except OSError:
+        pass
+    return current, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Fleet:
+    """Dispositivos cadastrados no registro de teste e o roteiro das mensagens."""
+
+    def __init__(self, args):
+        self.args = args
+        self.devices: dict[str, dict] = {
+            "painel": {"protocol": "MQTT", "topic": PANEL_TOPIC},
+            "atuador": {"protocol": "espnow", "address": ACTUATOR_ADDRESS},
+        }
+        self.senders: list[tuple[str, str]] = []
+        self.replay: list[dict] | None = None
+
+        if args.replay:
+            self._load_replay(Path(args.replay))
+            return
+
+        for i in range(args.devices):
+            self.devices[f"serial-{i}"] = {"protocol": "espnow", "address": mac(i), "device_type": "bench"}
+            self.senders.append(("espnow", mac(i)))
+
+        for i in range(args.mqtt_devices):
+            topic = f"bench/sensor-{i}"
+            self.devices[f"mqtt-{i}"] = {"protocol": "MQTT", "topic": topic, "device_type": "bench"}
+            self.senders.append(("MQTT", topic))
+
+    def _load_replay(self, path: Path):
+        self.replay = []
+
+        if path.suffix == SUFFIX:
+            messages = (decode_record(record) for record in read_capture([path]))
+            self.replay = [message for message in messages if message is not None]
+        else:
+            self._load_jsonl(path)
+
+        self._register_replay()
+
+    def _load_jsonl(self, path: Path):
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(message, dict) and "src" in message and "dst" in message:
+                    self.replay.append(message)
+
+    def _register_replay(self):
+        known = set()
+        for message in self.replay:
+            protocol = message.get("protocol") or "espnow"
+            source, destination = message["src"], message["dst"]
+
+            if source not in known:
+                known.add(source)
+                field = "topic" if protocol == "MQTT" else "address"
+                self.devices[f"replay-{len(known)}"] = {"protocol": protocol, field: source, "device_type": "replay"}
+
+            if destination != "central" and destination not in self.devices:
+                self.devices[destination] = {"protocol": "MQTT", "topic": f"bench/replay/{destination}"}
+
+    def messages(self, count: int):
+        """Gera `count` mensagens como (protocolo, endereço do remetente, envelope)."""
+        if self.replay is not None:
+            for i in range(count):
+                message = dict(self.replay[i % len(self.replay)])
+                yield message.get("protocol") or "espnow", message["src"], message
+            return
+
+        for i in range(count):
+            protocol, address = self.senders[i % len(self.senders)]
+            downlink = self.args.downlink and random.random() < self.args.downlink
+
+            yield protocol, address, {
+                "v": 1, "src": address, "dst": "atuador" if downlink else "painel", "protocol": protocol,
+                "type": "state", "ts": int(time.time()),
+                "payload": {"temperature": round(random.uniform(15, 35), 1), "humidity": round(random.uniform(30, 90), 1)},
+            }
+
+class Harness:
+    """Dispatcher completo ligado aos dublês, rodando em uma thread."""
+
+    def __init__(self, args, fleet: Fleet):
+        self.args = args
+        self.fleet = fleet
+        self.tmp = tempfile.TemporaryDirectory()
+
+        self.influx = InfluxStub(port=0).start()
+        self.broker = MQTTStub(port=0).start()
+        os.environ["INFLUXDB_URL"] = self.influx.url
+        os.environ.setdefault("INFLUXDB_ORG", "bench")
+        os.environ.setdefault("INFLUXDB_BUCKET", "bench")
+
+        # Importados depois dos stubs: o InfluxDB lê a URL do ambiente na primeira escrita.
+        import main as dispatcher
+        from protocols import MQTTHandler, SerialHandler
+        from utils.database import close_write_api, start_writer
+        from utils.envelope import encode_envelope
+        from utils.event_loop import EventLoop
+        from utils.metrics import Histogram, metrics
+        from utils.registry import DeviceRegistry
+        from utils.routes import RouteTable
+        from utils.sharding import ShardPool
+        from utils.unknown_sources import UnknownSources
+        from utils.workers import ReaderPool
+
+        self.dispatcher = dispatcher
+        self.encode_envelope = encode_envelope
+        self.metrics = metrics
+
+        # Latência de ponta a ponta, do gerador até o broker.
+        self.latency = Histogram()
+        self.delivered = 0
+        self.downlinked = 0
+        self.broker.on_publish = self._on_panel_publish
+
+        path = Path(self.tmp.name) / "devices.json"
+        path.write_text(json.dumps(fleet.devices), encoding="utf-8")
+        self.registry = DeviceRegistry(path, debounce=0)
+
+        # Par de pty: o gerador escreve no mestre, o SerialHandler lê o escravo.
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        self._slave = slave
+
+        start_writer(batch_size=500, flush_interval=0.5)
+
+        self.handlers = {
+            "MQTT": MQTTHandler(self.broker.host, self.broker.port, queue_size=args.queue_size),
+            "espnow": SerialHandler(os.ttyname(slave), args.baudrate, pace=args.pace, protocol="espnow"),
+        }
+        self.handlers["MQTT"].subscribe_registry(self.registry)
+
+        dispatcher.routes = RouteTable(self.registry, self.handlers)
+        dispatcher.unknown = UnknownSources(self.registry)
+        dispatcher.rules = None
+
+        def on_message(message: dict):
+            dispatcher.timed_dispatch(message, self.registry, self.handlers)
+
+        on_flush = None
+        self.shards = None
+
+        if args.shards > 1:
+            self.shards = ShardPool(
+                workers=args.shards,
+                setup=shard_setup,
+                teardown=close_write_api,
+                handlers=self.handlers,
+                registry=self.registry,
+            ).start()
+            on_message, on_flush = self.shards.submit, self.shards.flush
+
+        if args.mode == "threaded":
+            self.runner = ReaderPool(on_message=on_message, queue_size=args.queue_size, on_flush=on_flush)
+        else:
+            self.runner = EventLoop(on_message=on_message, max_batch=64, on_flush=on_flush)
+
+        for name, handler in self.handlers.items():
+            self.runner.register(name, handler)
+
+        self._stop = threading.Event()
+        self.loop_cpu = 0.0
+        self._thread = threading.Thread(target=self._run, name="bench-dispatcher", daemon=True)
+        self._drain = threading.Thread(target=self._drain_downlink, name="bench-downlink", daemon=True)
+
+    def start(self):
+        # Espera o MQTTHandler se inscrever nos tópicos da frota.
+        deadline = time.monotonic() + 5
+        while self.broker.subscribers() < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.metrics.reset()
+        self._thread.start()
+        self._drain.start()
+
+    def _run(self):
+        cpu = time.thread_time()
+
+        if self.args.mode == "threaded":
+            self.runner.run_forever()
+        else:
+            while not self._stop.is_set():
+                self.runner.run_once(0.1)
+
+        self.loop_cpu = time.thread_time() - cpu
+
+    def _drain_downlink(self):
+        """Lê o que o Dispatcher escreve na serial (mensagens para o atuador)."""
+        while not self._stop.is_set():
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                return
+            self.downlinked += data.count(b"\n")
+
+    def _on_panel_publish(self, topic: str, payload: bytes):
+        if topic == f"{PANEL_TOPIC}/sent":
+            self.latency.record(int((time.perf_counter() - float(payload)) * 1e9))
+            self.delivered += 1
+
+    def generate(self, rate: float, count: int) -> tuple[int, float]:
+        """Envia `count` mensagens, a `rate` por segundo (0 = sem limite).
+
+        Returns:
+            Mensagens enviadas e duração do envio.
+        """
+        fmt = self.args.format
+        sent = 0
+        start = time.perf_counter()
+
+        for protocol, address, message in self.fleet.messages(count):
+            if rate:
+                due = start + sent / rate
+                delay = due - time.perf_counter()
+                if delay > TICK:
+                    time.sleep(delay)
+
+            if isinstance(message.get("payload"), dict) and self.fleet.replay is None:
+                message["payload"]["sent"] = time.perf_counter()
+
+            data = self.encode_envelope(message, fmt)
+            if protocol == "MQTT":
+                self.broker.publish(address, data)
+            else:
+                os.write(self.master, data + b"\n")
+
+            sent += 1
+
+        return sent, time.perf_counter() - start
+
+    def wait_idle(self, expected: int, timeout: float = 10.0):
+        """Espera as entregas pararem de chegar (ou atingirem `expected`)."""
+        deadline = time.monotonic() + timeout
+        last, last_change = -1, time.monotonic()
+
+        while time.monotonic() < deadline:
+            done = self._deliveries()
+            if done >= expected:
+                return
+            if done != last:
+                last, last_change = done, time.monotonic()
+            elif time.monotonic() - last_change > 1.0:
+                return
+            time.sleep(0.05)
+
+    def _deliveries(self) -> int:
+        if self.fleet.replay is not None:
+            return sum(h.count for (stage, _, _), h in self.metrics.histograms().items() if stage == "send")
+        return self.delivered + self.downlinked
+
+    def close(self):
+        self._stop.set()
+
+        if self.args.mode == "threaded":
+            self.runner.close()
+        self._thread.join(5)
+
+        if self.shards is not None:
+            self.shards.close()
+
+        for handler in self.handlers.values():
+            handler.close()
+
+        from utils.database import close_write_api
+        close_write_api()
+
+        self.registry.close()
+        os.close(self.master)
+        os.close(self._slave)
+        self.broker.stop()
+        self.influx.stop()
+        self.tmp.cleanup()
+
+def report(harness: Harness, sent: int, elapsed: float, total: float, cpu: float):
+    delivered = harness._deliveries()
+    current_rss, peak_rss = rss_kib()
+
+    print(f"\nenviadas:    {sent} em {elapsed:.2f}s ({sent / elapsed:,.0f} msg/s oferecidas)")
+    print(f"entregues:   {delivered} ({delivered / total:,.0f} msg/s, {sent - delivered} faltando)")
+    print(f"InfluxDB:    {harness.influx.lines} pontos em {harness.influx.requests} escritas")
+    print(f"CPU:         {cpu:.2f}s no processo, {harness.loop_cpu:.2f}s na thread do Dispatcher"
+          f" ({harness.loop_cpu / max(delivered, 1) * 1e6:.1f} µs/msg)")
+    print(f"memória:     RSS {current_rss / 1024:.1f} MiB, pico {peak_rss / 1024:.1f} MiB")
+
+    if harness.latency.count:
+        h = harness.latency
+        print(
+            f"ponta a ponta (ms): p50 {h.percentile(0.5) / 1e6:.2f} | p90 {h.percentile(0.9) / 1e6:.2f} | "
+            f"p99 {h.percentile(0.99) / 1e6:.2f} | max {h.max / 1e6:.2f}"
+        )
+
+    print(f"\n{'etapa':>9} {'protocolo':>20} | {'n':>8} | {'p50 µs':>8} | {'p99 µs':>8} | {'max µs':>9}")
+
+    stages: dict[tuple, object] = {}
+    for (stage, protocol, _), histogram in harness.metrics.histograms().items():
+        merged = stages.get((stage, protocol))
+        if merged is None:
+            merged = stages[(stage, protocol)] = type(histogram)()
+        merged.merge(histogram)
+
+    for (stage, protocol), h in sorted(stages.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        print(
+            f"{stage:>9} {str(protocol or '-')[-20:]:>20} | {h.count:>8} | {h.percentile(0.5) / 1e3:>8.1f} | "
+            f"{h.percentile(0.99) / 1e3:>8.1f} | {h.max / 1e3:>9.1f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga do Dispatcher")
+    parser.add_argument("--devices", type=int, default=20, help="dispositivos seriais (ESP-NOW)")
+    parser.add_argument("--mqtt-devices", type=int, default=5, help="dispositivos MQTT")
+    parser.add_argument("--rate", type=float, default=200, help="mensagens/s no total, 0 = sem limite")
+    parser.add_argument("--duration", type=float, default=5.0, help="duração (s) com --rate")
+    parser.add_argument("--messages", type=int, help="total de mensagens (padrão: rate * duration)")
+    parser.add_argument("--format", choices=("json", "compact"), default="json")
+    parser.add_argument("--mode", choices=("event_loop", "threaded"), default="event_loop")
+    parser.add_argument("--downlink", type=float, default=0.0, help="fração das mensagens para o atuador serial")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--pace", action="store_true", help="espaça a saída serial pelo baudrate")
+    parser.add_argument("--queue-size", type=int, default=4096)
+    parser.add_argument("--replay", help="captura .bcap ou arquivo com um envelope JSON por linha")
+    parser.add_argument("--shards", type=int, default=0, help="processos de roteamento (utils.sharding)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    count = args.messages or int((args.rate or 1000) * args.duration)
+
+    fleet = Fleet(args)
+    harness = Harness(args, fleet)
+    harness.start()
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+
+    sent, elapsed = harness.generate(args.rate, count)
+    harness.wait_idle(sent)
+
+    total = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    harness.close()
+    report(harness, sent, elapsed, total, cpu)
+
+if __name__ == "__main__":
+    main()
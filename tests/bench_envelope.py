@@ -0,0 +1,109 @@
+"""Benchmark da representação das mensagens dentro do Dispatcher.
+
+Compara o caminho antigo, em que cada quadro virava um dicionário (com as chaves
+preenchidas por setdefault, como fazia o handler MQTT), com o atual, em que o quadro
+vira um Envelope (utils.envelope) com __slots__:
+
+    memória -- bytes e blocos alocados por mensagem mantida viva (tracemalloc), como
+               as que esperam nas filas do InfluxDB, das portas seriais e dos shards;
+    tempo   -- µs por mensagem para decodificar o quadro, ler os campos do roteamento
+               e montar o ponto do InfluxDB.
+
+O payload decodificado é o mesmo nos dois casos, então a diferença vem só do objeto
+da mensagem.
+
+Uso:
+    python -m tests.bench_envelope
+    python -m tests.bench_envelope --messages 100000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from utils.database import envelope_to_point_dict
+from utils.envelope import Envelope, decode_envelope, decode_message, serialize_bytes
+
+def make_frames(count: int) -> list[bytes]:
+    return [
+        serialize_bytes({
+            "v": 1, "src": f"AA:BB:CC:00:{i // 256 % 256:02X}:{i % 256:02X}", "dst": "display",
+            "type": "state", "ts": 1754413674 + i,
+            "payload": {"temperature": 24.7, "humidity": 61.2},
+        })
+        for i in range(count)
+    ]
+
+def decode_dict(frame: bytes, protocol: str = "espnow") -> dict | None:
+    """Caminho antigo: o dicionário decodificado é a mensagem."""
+    message = decode_envelope(frame)
+    if not isinstance(message, dict) or "src" not in message or "dst" not in message:
+        return None
+
+    message.setdefault("protocol", protocol)
+    return message
+
+def decode_object(frame: bytes, protocol: str = "espnow") -> Envelope | None:
+    return decode_message(frame, protocol=protocol)
+
+def route_dict(message: dict) -> dict:
+    message.get("src"), message.get("type"), message.get("protocol")
+    message["dst"] = "bench/display"
+    return envelope_to_point_dict(message, "bench")
+
+def route_object(message: Envelope) -> dict:
+    message.src, message.type, message.protocol
+    message.dst = "bench/display"
+    return envelope_to_point_dict(message, "bench")
+
+def measure_memory(decode, frames: list[bytes]) -> tuple[float, float]:
+    """Bytes e blocos por mensagem mantida viva."""
+    gc.collect()
+    tracemalloc.start()
+
+    before, blocks_before = tracemalloc.get_traced_memory()[0], _blocks()
+    messages = [decode(frame) for frame in frames]
+    after, blocks_after = tracemalloc.get_traced_memory()[0], _blocks()
+
+    tracemalloc.stop()
+
+    # A lista em si não faz parte da mensagem.
+    overhead = messages.__sizeof__()
+    return (after - before - overhead) / len(frames), (blocks_after - blocks_before - 1) / len(frames)
+
+def _blocks() -> int:
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+
+def measure_time(decode, route, frames: list[bytes], rounds: int) -> float:
+    """Menor tempo (µs) por mensagem entre as rodadas."""
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for frame in frames:
+            route(decode(frame))
+        best = min(best, time.perf_counter() - start)
+
+    return best / len(frames) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da representação das mensagens")
+    parser.add_argument("--messages", type=int, default=20_000, help="mensagens por medição")
+    parser.add_argument("--rounds", type=int, default=5, help="rodadas de tempo, fica com a mais rápida")
+    args = parser.parse_args()
+
+    frames = make_frames(args.messages)
+    results = {}
+
+    for label, decode, route in (("dict", decode_dict, route_dict), ("Envelope", decode_object, route_object)):
+        size, blocks = measure_memory(decode, frames)
+        elapsed = measure_time(decode, route, frames, args.rounds)
+        results[label] = (size, blocks, elapsed)
+        print(f"{label:>10} | {size:>7.0f} bytes/msg | {blocks:>5.1f} blocos/msg | {elapsed:>6.2f} µs/msg")
+
+    old, new = results["dict"], results["Envelope"]
+    print(f"\nEnvelope/dict: memória {new[0] / old[0]:.2f}x | tempo {new[2] / old[2]:.2f}x")
+
+if __name__ == "__main__":
+    main()
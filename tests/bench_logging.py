@@ -0,0 +1,125 @@
+"""Benchmark do custo dos logs no dispatch.
+
+Mede mensagens/s em main.dispatch() com handlers falsos, em quatro situações:
+
+    desligado  -- logging.disable(), o limite superior
+    debug      -- config/logs.toml, logs síncronos em DEBUG
+    debug+fila -- config/logs.toml com a [queue] ativa
+    produção   -- config/logs.production.toml
+
+Os arquivos de log vão para um diretório temporário e o console para /dev/null. As
+escritas do InfluxDB vão para o stub de tests/influx_stub.py.
+
+Uso:
+    python -m tests.bench_logging
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from tests.influx_stub import InfluxStub
+
+MESSAGES = 50_000
+
+# Remetentes cadastrados no registro de teste, cada um com sua telemetria.
+DEVICES = 20
+
+class FakeHandler:
+    """Handler que só conta as entregas."""
+    def __init__(self):
+        self.count = 0
+
+    def handleMessage(self, destination_info, message):
+        self.count += 1
+
+    def send(self, data):
+        self.count += 1
+
+    def publish(self, topic, payload):
+        self.count += 1
+
+def make_registry(tmp: Path):
+    from utils.registry import DeviceRegistry
+
+    devices = {"display": {"protocol": "MQTT", "topic": "bench/display"}}
+    for i in range(DEVICES):
+        devices[f"sensor-{i}"] = {"address": f"AA:BB:CC:00:00:{i:02X}", "protocol": "espnow", "device_type": "bench"}
+
+    path = tmp / "devices.json"
+    path.write_text(json.dumps(devices), encoding="utf-8")
+    return DeviceRegistry(path, debounce=0)
+
+def log_config(path: str, tmp: Path, devnull, queue: bool | None = None) -> dict:
+    from utils.config_loader import load_config
+
+    config = json.loads(json.dumps(load_config(path)))
+    config["handlers"]["file"]["filename"] = str(tmp / "bench.log")
+    config["handlers"]["console"]["stream"] = devnull
+
+    if queue is not None:
+        config.setdefault("queue", {})["enabled"] = queue
+
+    return config
+
+def run(label: str, main, registry, handlers, messages) -> None:
+    start = time.perf_counter()
+    cpu = time.process_time()
+
+    for message in messages:
+        main.dispatch(message.copy(), registry, handlers)
+
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    print(f"{label:>10} | {len(messages) / elapsed:>12,.0f} msg/s | {cpu / len(messages) * 1e6:>8.2f} µs de CPU/msg")
+
+def main():
+    stub = InfluxStub(port=0).start()
+    os.environ["INFLUXDB_URL"] = stub.url
+
+    import main as dispatcher
+    from utils.envelope import Envelope
+    from utils.log_setup import configure_logging, stop_logging
+    from utils.routes import RouteTable
+
+    messages = [
+        Envelope(
+            src=f"AA:BB:CC:00:00:{i % DEVICES:02X}", dst="display", protocol="espnow",
+            type="state", ts=1754413674, payload={"temperature": 24.7, "humidity": 61.2},
+        )
+        for i in range(MESSAGES)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        tmp = Path(tmp)
+        registry = make_registry(tmp)
+        handlers = {"MQTT": FakeHandler(), "espnow": FakeHandler()}
+        dispatcher.routes = RouteTable(registry, handlers)
+
+        profiles = [
+            ("debug", "config/logs.toml", False),
+            ("debug+fila", "config/logs.toml", True),
+            ("produção", "config/logs.production.toml", None),
+        ]
+
+        logging.disable(logging.CRITICAL)
+        run("desligado", dispatcher, registry, handlers, messages)
+        logging.disable(logging.NOTSET)
+
+        for label, path, queue in profiles:
+            listener = configure_logging(log_config(path, tmp, devnull, queue))
+            run(label, dispatcher, registry, handlers, messages)
+
+            start = time.perf_counter()
+            stop_logging(listener)
+            if listener is not None:
+                print(f"{'':>10} | fila de logs esvaziada em {time.perf_counter() - start:.2f}s")
+
+    stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark da publicação MQTT feita por MQTTHandler.handleMessage.
+
+Compara a publicação antiga (um publish() por chave do payload) com o lote de
+handleMessage(), medindo a latência por dispatch e quantas mensagens MQTT cada
+dispatch gera.
+
+Sem --broker, usa um cliente falso que só conta as chamadas, medindo apenas o
+custo do Dispatcher. Com --broker, publica de verdade no broker informado.
+
+Uso:
+    python -m tests.bench_mqtt_publish
+    python -m tests.bench_mqtt_publish --broker localhost --combined
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from protocols.mqtt_handler import MQTTHandler
+from utils.envelope import Envelope
+
+DISPATCHES = 20_000
+
+DESTINATION = {"protocol": "MQTT", "topic": "sensores/termohigrometro"}
+
+MESSAGE = Envelope.from_dict({
+    "v": 1,
+    "src": "2C:F4:32:16:F5:17",
+    "dst": "sensores/termohigrometro",
+    "protocol": "espnow",
+    "type": "state",
+    "ts": 1686026400,
+    "payload": {f"campo_{i}": 20.0 + i for i in range(20)},
+})
+
+class FakeClient:
+    """Substitui o cliente da paho, apenas contando as publicações."""
+    def __init__(self):
+        self.count = 0
+        self._info = SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.count += 1
+        return self._info
+
+    def disconnect(self):
+        pass
+
+def make_handler(args) -> MQTTHandler:
+    if args.broker:
+        return MQTTHandler(args.broker, args.port, publish_combined=args.combined)
+
+    MQTTHandler._connect = lambda self: None
+    handler = MQTTHandler("fake", publish_combined=args.combined)
+    handler.client = FakeClient()
+    handler._connected = True
+    return handler
+
+def legacy_handle_message(handler: MQTTHandler, destination_info: dict, message: Envelope):
+    """Implementação anterior de handleMessage, mantida para comparação."""
+    base_topic = destination_info["topic"].rstrip("/")
+    payload = message.get("payload", {})
+
+    for key, value in payload.items():
+        handler.publish(f"{base_topic}/{key}", value)
+
+def run(label: str, handler: MQTTHandler, function):
+    handler.published = 0
+    handler.handled = 0
+
+    start = time.perf_counter()
+    for _ in range(DISPATCHES):
+        function(handler, DESTINATION, MESSAGE)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:>8} | {elapsed / DISPATCHES * 1e6:>10.2f} µs/dispatch | "
+        f"{handler.published / DISPATCHES:>5.1f} mensagens/dispatch"
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--combined", action="store_true", help="ativa publish_combined")
+    args = parser.parse_args()
+
+    handler = make_handler(args)
+
+    for _ in range(2):
+        run("antes", handler, legacy_handle_message)
+        run("depois", handler, lambda h, d, m: h.handleMessage(destination_info=d, message=m))
+
+    handler.close()
+
+if __name__ == "__main__":
+    main()
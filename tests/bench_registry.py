@@ -0,0 +1,54 @@
+"""Micro-benchmark do DeviceRegistry.get_by_address.
+
+Compara a busca indexada com a antiga busca linear para frotas de tamanhos
+diferentes. O tempo por consulta da versão indexada deve ficar estável.
+
+Uso:
+    python -m tests.bench_registry
+"""
+
+import json
+import tempfile
+import timeit
+from pathlib import Path
+
+from utils.registry import DeviceRegistry
+
+SIZES = [10, 100, 1_000, 10_000]
+LOOKUPS = 20_000
+
+def make_address(i: int) -> str:
+    return ":".join(f"{b:02X}" for b in i.to_bytes(6, "big"))
+
+def linear_get_by_address(registry: DeviceRegistry, address: str) -> dict | None:
+    """Implementação antiga, mantida apenas para comparação."""
+    for id, info in registry._registry.items():
+        if info.get("address") == address or info.get("topic") == address:
+            return info
+    return None
+
+def main():
+    print(f"{'dispositivos':>12} | {'indexado (ns)':>14} | {'linear (ns)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in SIZES:
+            path = Path(tmp) / f"devices_{size}.json"
+            devices = {
+                f"device-{i}": {"address": make_address(i), "protocol": "espnow"}
+                for i in range(size)
+            }
+            path.write_text(json.dumps(devices), encoding="utf-8")
+
+            registry = DeviceRegistry(path)
+
+            # Pior caso da busca linear: o último dispositivo cadastrado.
+            address = make_address(size - 1)
+            assert registry.get_by_address(address) is linear_get_by_address(registry, address)
+
+            indexed = timeit.timeit(lambda: registry.get_by_address(address), number=LOOKUPS)
+            linear = timeit.timeit(lambda: linear_get_by_address(registry, address), number=max(LOOKUPS // size, 10))
+
+            print(f"{size:>12} | {indexed / LOOKUPS * 1e9:>14.1f} | {linear / max(LOOKUPS // size, 10) * 1e9:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Stub HTTP do InfluxDB para testes sem o banco real.
+
+Responde aos endpoints usados pelo influxdb_client (/api/v2/write, /ping e /health)
+e contabiliza as linhas recebidas. Também pode simular um banco lento ou fora do ar.
+
+Uso:
+    python -m tests.influx_stub --port 8086 --delay 0.5
+    INFLUXDB_URL=http://localhost:8086 python main.py
+
+Também pode ser usado dentro de outros scripts:
+
+    stub = InfluxStub(port=0).start()
+    os.environ["INFLUXDB_URL"] = stub.url
+"""
+
+import argparse
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class InfluxStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8086, delay: float = 0.0, fail: bool = False):
+        """Cria o servidor stub.
+
+        Args:
+            host: Endereço de escuta.
+            port: Porta de escuta, 0 para escolher uma porta livre.
+            delay: Atraso (s) aplicado a cada escrita, simula um banco lento.
+            fail: Se True, responde 503 a todas as escritas.
+        """
+        self.delay = delay
+        self.fail = fail
+
+        self.requests = 0
+        self.lines = 0
+        self.received: list[str] = []
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "InfluxStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                if stub.fail or not self.path.startswith("/api/v2/write"):
+                    self.send_response(503 if stub.fail else 404)
+                    self.end_headers()
+                    return
+
+                lines = [line for line in body.decode("utf-8").split("\n") if line]
+                with stub._lock:
+                    stub.requests += 1
+                    stub.lines += len(lines)
+                    stub.received.extend(lines)
+
+                self.send_response(204)
+                self.end_headers()
+
+            def do_GET(self):
+                self.send_response(204 if self.path.startswith("/ping") else 200)
+                self.end_headers()
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub HTTP do InfluxDB")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail", action="store_true")
+    args = parser.parse_args()
+
+    stub = InfluxStub(port=args.port, delay=args.delay, fail=args.fail).start()
+    print(f"Stub do InfluxDB em {stub.url}")
+
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requisições: {stub.requests} | linhas: {stub.lines}")
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Stub de broker MQTT para testes sem o Mosquitto.
+
+Implementa apenas o necessário do MQTT 3.1.1 para o MQTTHandler: CONNECT, SUBSCRIBE,
+UNSUBSCRIBE, PUBLISH (QoS 0 e 1), PINGREQ e DISCONNECT. As publicações recebidas são
+contadas por tópico e repassadas, em QoS 0, aos clientes inscritos (aceita + e #).
+
+O stub também pode publicar por conta própria com publish(), simulando dispositivos
+MQTT sem precisar de outro cliente.
+
+Uso:
+    python -m tests.mqtt_stub --port 1883
+
+Também pode ser usado dentro de outros scripts:
+
+    broker = MQTTStub(port=0).start()
+    handler = MQTTHandler(broker.host, broker.port)
+    broker.publish("sensores/sala", b'{"dst": "central", ...}')
+"""
+
+import argparse
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+class MQTTStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 1883):
+        """Cria o broker stub.
+
+        Args:
+            host: Endereço de escuta.
+            port: Porta de escuta, 0 para escolher uma porta livre.
+        """
+        self.published = 0
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+        # Função opcional (tópico, payload) chamada a cada publicação recebida.
+        self.on_publish = None
+
+        # conexão -> filtros inscritos
+        self._clients: dict = {}
+
+        self._server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MQTTStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def subscribers(self) -> int:
+        """Quantidade de inscrições ativas, somando todos os clientes."""
+        with self._lock:
+            return sum(len(filters) for filters in self._clients.values())
+
+    def count(self, prefix: str = "") -> int:
+        """Publicações recebidas em tópicos que começam com `prefix`."""
+        with self._lock:
+            return sum(count for topic, count in self.counts.items() if topic.startswith(prefix))
+
+    def publish(self, topic: str, payload: bytes) -> int:
+        """Entrega uma publicação aos inscritos, como se viesse de um dispositivo.
+
+        Returns:
+            Quantidade de clientes que receberam.
+        """
+        packet = _packet(PUBLISH << 4, _string(topic) + payload)
+
+        with self._lock:
+            targets = [
+                connection for connection, filters in self._clients.items()
+                if any(mqtt.topic_matches_sub(sub, topic) for sub in filters)
+            ]
+
+        for connection in targets:
+            connection.write(packet)
+
+        return len(targets)
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def setup(self):
+                self.reader = self.request.makefile("rb")
+                self.write_lock = threading.Lock()
+
+            def write(self, data: bytes):
+                try:
+                    with self.write_lock:
+                        self.request.sendall(data)
+                except OSError:
+                    pass
+
+            def handle(self):
+                while True:
+                    header = self.reader.read(1)
+                    if not header:
+                        break
+
+                    body = self.reader.read(_read_length(self.reader))
+                    kind, flags = header[0] >> 4, header[0] & 0x0F
+
+                    if kind == CONNECT:
+                        with stub._lock:
+                            stub._clients[self] = set()
+                        self.write(bytes((CONNACK << 4, 2, 0, 0)))
+
+                    elif kind == PUBLISH:
+                        self._on_publish(flags, body)
+
+                    elif kind == SUBSCRIBE:
+                        packet_id, offset, granted = body[:2], 2, bytearray()
+                        while offset < len(body):
+                            size = struct.unpack_from("!H", body, offset)[0]
+                            topic = body[offset + 2:offset + 2 + size].decode("utf-8")
+                            granted.append(min(body[offset + 2 + size], 1))
+                            offset += 3 + size
+                            with stub._lock:
+                                stub._clients.setdefault(self, set()).add(topic)
+                        self.write(_packet(SUBACK << 4, packet_id + bytes(granted)))
+
+                    elif kind == UNSUBSCRIBE:
+                        offset = 2
+                        while offset < len(body):
+                            size = struct.unpack_from("!H", body, offset)[0]
+                            topic = body[offset + 2:offset + 2 + size].decode("utf-8")
+                            offset += 2 + size
+                            with stub._lock:
+                                stub._clients.get(self, set()).discard(topic)
+                        self.write(_packet(UNSUBACK << 4, body[:2]))
+
+                    elif kind == PINGREQ:
+                        self.write(bytes((PINGRESP << 4, 0)))
+
+                    elif kind == DISCONNECT:
+                        break
+
+            def _on_publish(self, flags: int, body: bytes):
+                size = struct.unpack_from("!H", body)[0]
+                topic = body[2:2 + size].decode("utf-8")
+                offset = 2 + size
+
+                qos = (flags >> 1) & 0x03
+                if qos:
+                    self.write(_packet(PUBACK << 4, body[offset:offset + 2]))
+                    offset += 2
+
+                with stub._lock:
+                    stub.published += 1
+                    stub.counts[topic] += 1
+
+                if stub.on_publish is not None:
+                    stub.on_publish(topic, body[offset:])
+
+                stub.publish(topic, body[offset:])
+
+            def finish(self):
+                with stub._lock:
+                    stub._clients.pop(self, None)
+
+        return Handler
+
+def _read_length(reader) -> int:
+    """Lê o "remaining length" (varint de até 4 bytes) do cabeçalho fixo."""
+    length, shift = 0, 0
+    while True:
+        byte = reader.read(1)
+        if not byte:
+            return 0
+        length |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return length
+        shift += 7
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+def _string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+def _packet(header: int, body: bytes) -> bytes:
+    return bytes((header,)) + _encode_length(len(body)) + body
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub de broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = MQTTStub(port=args.port).start()
+    print(f"Stub MQTT em {broker.host}:{broker.port}")
+
+    try:
+        while True:
+            time.sleep(5)
+            print(f"publicações: {broker.published} | inscrições: {broker.subscribers()}")
+    except KeyboardInterrupt:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Reproduz uma captura do Dispatcher (utils.capture) sem os dispositivos.
+
+Os quadros gravados passam pelo mesmo dispatch de main.py, com o registro de
+dispositivos copiado para um diretório temporário e handlers de mentira que apenas
+contam (e, com --verbose, mostram) o que seria enviado. Nada é escrito no InfluxDB.
+
+Serve para reproduzir bugs de roteamento com o tráfego real e para perfilar o
+dispatch com o formato de tráfego de produção (ex.: python -m cProfile).
+
+Uso:
+    python -m tests.replay_capture captures/capture-*.bcap
+    python -m tests.replay_capture captures/*.bcap --speed 10 --verbose
+    python -m tests.replay_capture captures/*.bcap --speed 0 --registry config/devices.json
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+class DryRunHandler:
+    """Handler que registra as entregas em vez de enviá-las."""
+
+    def __init__(self, name: str, verbose: bool):
+        self.name = name
+        self.verbose = verbose
+        self.counts: Counter = Counter()
+
+    def handleMessage(self, destination_info: dict, message):
+        self.counts["handleMessage"] += 1
+        if self.verbose:
+            print(f"[{self.name}] {message.src} -> {message.dst}: {message.payload}")
+
+    def send(self, data, *args, **kwargs):
+        self.counts["send"] += 1
+        if self.verbose:
+            print(f"[{self.name}] send: {bytes(data)[:120]!r}")
+
+    def publish(self, topic: str, payload, *args, **kwargs):
+        self.counts["publish"] += 1
+        if self.verbose:
+            print(f"[{self.name}] publish {topic}: {bytes(payload)[:120]!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduz capturas do Dispatcher")
+    parser.add_argument("files", nargs="+", help="arquivos .bcap, em ordem")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tempo real, N = N vezes mais rápido, 0 = sem espera")
+    parser.add_argument("--registry", default="config/devices.json", help="registro de dispositivos usado como ponto de partida")
+    parser.add_argument("--verbose", action="store_true", help="mostra cada entrega")
+    args = parser.parse_args()
+
+    import main as dispatcher
+    from utils.capture import read_capture, replay
+    from utils.registry import DeviceRegistry
+    from utils.routes import RouteTable
+    from utils.rules import load_rules
+    from utils.unknown_sources import UnknownSources
+
+    points = Counter()
+    dispatcher.write_envelope = lambda message, measurement: points.update([measurement]) or True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "devices.json"
+        if Path(args.registry).exists():
+            shutil.copy(args.registry, path)
+
+        registry = DeviceRegistry(path, debounce=0)
+        handlers = {
+            name: DryRunHandler(name, args.verbose)
+            for name in ("MQTT", *(dispatcher.cfg.uart.handlers or {}))
+        }
+
+        dispatcher.routes = RouteTable(registry, handlers)
+        dispatcher.unknown = UnknownSources(registry)
+        if dispatcher.cfg.paths.routing_rules:
+            dispatcher.rules = load_rules(dispatcher.cfg.paths.routing_rules)
+
+        start = time.perf_counter()
+        stats = replay(
+            read_capture(args.files),
+            lambda message: dispatcher.timed_dispatch(message, registry, handlers),
+            speed=args.speed,
+        )
+        elapsed = time.perf_counter() - start
+
+        registry.close()
+
+    print(f"\nregistros: {stats['records']} | mensagens: {stats['messages']} | inválidos: {stats['invalid']} | erros: {stats['errors']}")
+    print(f"tempo: {elapsed:.2f}s ({stats['messages'] / elapsed if elapsed else 0:,.0f} msg/s)")
+
+    for name, handler in handlers.items():
+        print(f"{name:>10}: {dict(handler.counts)}")
+
+    print(f"{'InfluxDB':>10}: {dict(points)}")
+    print(f"{'registro':>10}: {dispatcher.unknown.stats()}")
+
+if __name__ == "__main__":
+    main()
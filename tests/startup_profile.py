@@ -0,0 +1,72 @@
+"""Perfil dos imports do Dispatcher, no estilo do python -X importtime.
+
+Executa `python -X importtime -c "import main"` em um processo novo (algumas vezes,
+ficando com a mais rápida, já que a primeira costuma pagar o cache do disco) e mostra
+o tempo total do import e os módulos mais caros, pelo tempo acumulado (o módulo e
+tudo o que ele importou) e pelo tempo próprio.
+
+O tempo de cada fase da inicialização e o tempo até a primeira mensagem aparecem no
+log do Dispatcher ("[STARTUP] ...") e nas métricas bifrost_startup_*.
+
+Uso:
+    python -m tests.startup_profile
+    python -m tests.startup_profile --module utils.database --top 30
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+def import_times(module: str) -> list[tuple[int, int, int, str]]:
+    """Importa `module` em um processo novo.
+
+    Returns:
+        Uma tupla (própria µs, acumulada µs, profundidade, módulo) para cada import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(own), int(cumulative), depth, name.strip()))
+
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil dos imports do Dispatcher")
+    parser.add_argument("--module", default="main", help="módulo importado (padrão: main)")
+    parser.add_argument("--runs", type=int, default=3, help="execuções, fica com a mais rápida")
+    parser.add_argument("--top", type=int, default=15, help="módulos mostrados em cada lista")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    rows = min(runs, key=lambda rows: sum(own for own, _, _, _ in rows))
+
+    total = sum(own for own, _, _, _ in rows)
+    print(f"import {args.module}: {total / 1000:.1f} ms, {len(rows)} módulos\n")
+
+    # Pacotes de primeiro nível: quem foi importado direto pelo módulo (e a biblioteca padrão).
+    print(f"{'acumulado ms':>12} | pacote")
+    top_level = sorted((row for row in rows if row[2] <= 1), key=lambda row: -row[1])
+    for own, cumulative, depth, name in top_level[:args.top]:
+        print(f"{cumulative / 1000:>12.1f} | {name}")
+
+    print(f"\n{'próprio ms':>12} | módulo")
+    for own, cumulative, depth, name in sorted(rows, key=lambda row: -row[0])[:args.top]:
+        print(f"{own / 1000:>12.1f} | {name}")
+
+if __name__ == "__main__":
+    main()
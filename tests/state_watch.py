@@ -0,0 +1,45 @@
+"""Acompanha o estado dos dispositivos pela API do Dispatcher ([state] em config.toml).
+
+Mostra o estado atual (GET /api/state) e, em seguida, cada mudança recebida pelo
+Socket.IO. Usa o cliente do python-socketio, instalado junto com o Flask-SocketIO
+(com websocket-client instalado, a conexão usa WebSocket; sem ele, long polling).
+
+Uso:
+    python -m tests.state_watch
+    python -m tests.state_watch --url http://raspberrypi.local:9110 termohigrometro
+"""
+
+import argparse
+import json
+import urllib.request
+
+import socketio
+
+def main():
+    parser = argparse.ArgumentParser(description="Acompanha o estado dos dispositivos")
+    parser.add_argument("devices", nargs="*", help="IDs dos dispositivos (padrão: todos)")
+    parser.add_argument("--url", default="http://127.0.0.1:9110", help="endereço da API")
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(f"{args.url}/api/state") as response:
+        for device_id, state in json.load(response).items():
+            if not args.devices or device_id in args.devices:
+                print(f"{device_id}: {state['fields']}")
+
+    client = socketio.Client()
+
+    @client.on("state")
+    def on_state(change):
+        print(f"{change['device']}: {change['changed']}")
+
+    client.connect(args.url)
+    client.emit("subscribe", {"devices": args.devices} if args.devices else {})
+    print(f"\nAguardando mudanças ({client.transport()}), Ctrl+C para sair...")
+
+    try:
+        client.wait()
+    except KeyboardInterrupt:
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
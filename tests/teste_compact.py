@@ -0,0 +1,39 @@
+"""Ida e volta de envelopes pelo formato compacto (utils.compact).
+
+Confere que o envelope decodificado é igual ao original e que um dispositivo
+registrado com o MAC em minúsculas continua sendo encontrado pelo endereço que sai
+do formato compacto (em maiúsculas).
+
+Uso:
+    python -m tests.teste_compact
+"""
+
+from utils import compact
+from utils.registry import DeviceRegistry
+
+ENVELOPES = [
+    {
+        "v": 1, "src": "2C:F4:32:16:F5:17", "dst": "central", "protocol": "espnow",
+        "type": "state", "ts": 1754413674, "payload": {"temperature": 24.5, "humidity": 61},
+    },
+    {
+        "v": 1, "src": "central", "dst": "48:55:19:00:04:1E", "type": "command",
+        "ts": 1754413674, "payload": {"status": "registered", "led": 1},
+    },
+]
+
+def main():
+    for envelope in ENVELOPES:
+        frame = compact.encode(envelope)
+        decoded = compact.decode(frame)
+        print(f"{len(frame):>3} bytes | ida e volta: {'ok' if decoded == envelope else f'DIFERENTE {decoded}'}")
+
+    registry = DeviceRegistry(None)
+    registry.add("termohigrometro", "2c:f4:32:16:f5:17", "espnow")
+
+    decoded = compact.decode(compact.encode({"v": 1, "src": "2c:f4:32:16:f5:17", "dst": "central", "payload": {}}))
+    print(f"MAC em minúsculas: {decoded['src']} -> {registry.get_id_by_address(decoded['src'])}")
+    print(f"Busca em minúsculas: {registry.get_id_by_address('2c:f4:32:16:f5:17')}")
+
+if __name__ == "__main__":
+    main()
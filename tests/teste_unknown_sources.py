@@ -0,0 +1,55 @@
+"""Registro de um remetente que já estava no cache de desconhecidos (utils.unknown_sources).
+
+Um dispositivo com o MAC em minúsculas manda telemetria antes de se registrar, entra
+no cache negativo e recebe um register_request. Depois de se registrar, a próxima
+mensagem dele deve ser roteada, sem novo register_request. Usa o dispatch() do
+main.py com um registro em memória e handlers falsos, sem porta serial nem broker.
+
+Uso:
+    python -m tests.teste_unknown_sources
+"""
+
+import main as dispatcher
+from utils.envelope import Envelope, decode_envelope
+from utils.registry import DeviceRegistry
+from utils.routes import RouteTable
+from utils.unknown_sources import UnknownSources
+
+MAC = "2c:f4:32:16:f5:17"
+
+class FakeHandler:
+    """Guarda o tipo de cada envelope enviado pelo Dispatcher."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data: bytes) -> bool:
+        self.sent.append(decode_envelope(data)["type"])
+        return True
+
+    def handleMessage(self, destination_info: dict, message: Envelope) -> bool:
+        self.sent.append(message.type)
+        return True
+
+def main():
+    handler = FakeHandler()
+    handlers = {"espnow": handler}
+
+    registry = DeviceRegistry(None, devices={"display": {"address": "48:55:19:00:04:1E", "protocol": "espnow"}})
+    dispatcher.routes = RouteTable(registry, handlers)
+    dispatcher.unknown = UnknownSources(registry)
+
+    telemetry = lambda: Envelope(src=MAC, dst="display", protocol="espnow", type="state", payload={"temperature": 24.5})
+
+    dispatcher.dispatch(telemetry(), registry, handlers)
+    print(f"Antes do registro: {handler.sent} | {dispatcher.unknown.stats()}")
+
+    handler.sent.clear()
+    dispatcher.dispatch(Envelope(src=MAC, dst="central", protocol="espnow", type="register", payload={"id": "termohigrometro"}), registry, handlers)
+    dispatcher.dispatch(telemetry(), registry, handlers)
+
+    ok = handler.sent == ["register_response", "state"] and not dispatcher.unknown.stats()["unknown_sources"]
+    print(f"Depois do registro: {handler.sent} | {dispatcher.unknown.stats()} -> {'ok' if ok else 'FALHOU'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""Agregação da telemetria em janelas de tempo, antes do InfluxDB.
+
+Sem agregação, cada mensagem roteada vira um ponto no InfluxDB. Com ela, os campos
+numéricos do payload são acumulados por série (measurement, remetente e tipo da
+mensagem) e, ao fim de cada janela, a série vira um único ponto com as estatísticas
+pedidas de cada campo:
+
+    temperature_min, temperature_max, temperature_mean, temperature_last, temperature_count
+
+As amostras ficam em um buffer NumPy por série, reutilizado a cada janela. Quando o
+buffer enche, ele é reduzido (min, max, soma, contagem e último valor de cada coluna,
+de uma vez) e volta ao início, então a memória por série é fixa e as estatísticas
+continuam exatas para qualquer quantidade de mensagens na janela. Campos não numéricos
+vão para o ponto com o último valor recebido.
+
+As janelas são alinhadas ao relógio (uma janela de 10 s começa em :00, :10, ...) e o
+ponto usa o início da janela como horário, com a tag "window" (ex.: "10s"). Uma thread
+fecha as janelas vencidas mesmo sem novas mensagens, e séries sem mensagens em uma
+janela são descartadas.
+
+Dispositivos em `passthrough` (pelo ID ou pelo endereço) e measurements com raw = true
+continuam com um ponto por mensagem: add() retorna False e quem chamou grava o ponto.
+
+Exemplo de uso:
+
+    aggregator = Aggregator(emit=write_data, window=10.0).start()
+
+    if not aggregator.add(message, measurement):
+        write_envelope(message, measurement)
+"""
+
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATS = ("min", "max", "mean", "last", "count")
+
+class _Series:
+    """Janela aberta de uma série: buffer das amostras e a redução parcial."""
+
+    __slots__ = (
+        "tags", "window", "stats", "start", "end", "capacity", "fields", "other",
+        "values", "size", "messages", "minimum", "maximum", "total", "counts", "last",
+    )
+
+    def __init__(self, tags: dict, window: float, stats: tuple, capacity: int, now: float):
+        self.tags = tags
+        self.window = window
+        self.stats = stats
+        self.capacity = capacity
+
+        # campo numérico -> coluna do buffer; campos não numéricos -> último valor
+        self.fields: dict[str, int] = {}
+        self.other: dict = {}
+
+        self.values = np.empty((capacity, 0))
+        self.minimum = np.empty(0)
+        self.maximum = np.empty(0)
+        self.total = np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.last = np.empty(0)
+
+        self.open(now)
+
+    def open(self, now: float) -> None:
+        """Começa a janela que contém `now`, reaproveitando os buffers."""
+        self.start = math.floor(now / self.window) * self.window
+        self.end = self.start + self.window
+        self.size = 0
+        self.messages = 0
+        self.other.clear()
+
+        self.minimum.fill(np.nan)
+        self.maximum.fill(np.nan)
+        self.total.fill(0.0)
+        self.counts.fill(0)
+        self.last.fill(np.nan)
+
+    def add(self, payload: dict) -> None:
+        numeric = []
+        for key, value in payload.items():
+            if value.__class__ is float or value.__class__ is int:
+                numeric.append((key, value))
+            else:
+                self.other[key] = value
+
+        if not numeric:
+            return
+
+        fields = self.fields
+        for key, _ in numeric:
+            if key not in fields:
+                self._add_column(key)
+
+        row = [np.nan] * len(fields)
+        for key, value in numeric:
+            row[fields[key]] = value
+
+        self.values[self.size] = row
+        self.size += 1
+        self.messages += 1
+
+        if self.size == self.capacity:
+            self.fold()
+
+    def fold(self) -> None:
+        """Reduz as amostras do buffer na redução parcial da janela e esvazia o buffer."""
+        size = self.size
+        if not size:
+            return
+
+        block = self.values[:size]
+        valid = ~np.isnan(block)
+
+        self.minimum = np.fmin(self.minimum, np.fmin.reduce(block, axis=0))
+        self.maximum = np.fmax(self.maximum, np.fmax.reduce(block, axis=0))
+        self.total += np.where(valid, block, 0.0).sum(axis=0)
+
+        counts = valid.sum(axis=0)
+        self.counts += counts
+
+        # Última amostra válida de cada coluna.
+        rows = size - 1 - np.argmax(valid[::-1], axis=0)
+        self.last = np.where(counts > 0, block[rows, np.arange(block.shape[1])], self.last)
+
+        self.size = 0
+
+    def point(self, measurement: str) -> dict | None:
+        """Ponto do InfluxDB com as estatísticas da janela, ou None se ela ficou vazia."""
+        self.fold()
+
+        if not self.messages and not self.other:
+            return None
+
+        stats = self.stats
+        minimum, maximum = self.minimum.tolist(), self.maximum.tolist()
+        total, counts, last = self.total.tolist(), self.counts.tolist(), self.last.tolist()
+
+        fields = dict(self.other)
+        for name, column in self.fields.items():
+            count = counts[column]
+            if not count:
+                continue
+
+            if "min" in stats:
+                fields[f"{name}_min"] = minimum[column]
+            if "max" in stats:
+                fields[f"{name}_max"] = maximum[column]
+            if "mean" in stats:
+                fields[f"{name}_mean"] = total[column] / count
+            if "last" in stats:
+                fields[f"{name}_last"] = last[column]
+            if "count" in stats:
+                fields[f"{name}_count"] = count
+
+        if not fields:
+            return None
+
+        return {
+            "measurement": measurement,
+            "time": int(self.start * 1_000_000_000),
+            "tags": self.tags,
+            "fields": fields,
+        }
+
+    def _add_column(self, key: str) -> None:
+        self.fields[key] = len(self.fields)
+
+        self.values = np.concatenate((self.values, np.full((self.capacity, 1), np.nan)), axis=1)
+        self.minimum = np.append(self.minimum, np.nan)
+        self.maximum = np.append(self.maximum, np.nan)
+        self.total = np.append(self.total, 0.0)
+        self.counts = np.append(self.counts, 0)
+        self.last = np.append(self.last, np.nan)
+
+class Aggregator:
+    def __init__(
+        self,
+        emit,
+        window: float = 10.0,
+        stats=STATS,
+        buffer_size: int = 64,
+        measurements: dict | None = None,
+        passthrough=(),
+        identify=None,
+    ):
+        """Prepara a agregação, a thread que fecha as janelas é iniciada em start().
+
+        Args:
+            emit: Função chamada com o dicionário de cada ponto agregado (ex.: write_data).
+            window: Duração padrão (s) das janelas.
+            stats: Estatísticas padrão, entre "min", "max", "mean", "last" e "count".
+            buffer_size: Amostras guardadas por série antes de uma redução parcial.
+            measurements: Ajustes por measurement: {nome: {"window", "stats", "raw"}}.
+            passthrough: IDs ou endereços de dispositivos gravados sem agregação.
+            identify: Função endereço -> ID do dispositivo, usada com `passthrough`.
+        """
+        self.emit = emit
+        self.window = window
+        self.stat_names = self._check_stats(stats)
+        self.buffer_size = buffer_size
+        self.measurements = measurements or {}
+        self.passthrough = set(passthrough)
+        self.identify = identify
+
+        self._series: dict[tuple, _Series] = {}
+        self._raw: set[tuple] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Contadores expostos em stats()
+        self.samples = 0
+        self.raw = 0
+        self.points = 0
+
+    def start(self) -> "Aggregator":
+        windows = [self.window] + [
+            options.get("window") or self.window for options in self.measurements.values()
+        ]
+        self._tick = min(1.0, *windows)
+
+        self._thread = threading.Thread(target=self._run, name="aggregator", daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, message, measurement: str | None) -> bool:
+        """Acumula a telemetria de uma mensagem na janela da sua série.
+
+        Returns:
+            True se a mensagem foi agregada, False se ela deve ser gravada como está
+            (passthrough, measurement com raw = true ou payload que não é dicionário).
+        """
+        payload = message.payload
+        if measurement is None or payload.__class__ is not dict:
+            return False
+
+        key = (measurement, message.src, message.type)
+        points = None
+
+        with self._lock:
+            series = self._series.get(key)
+
+            if series is None:
+                if key in self._raw or self._is_raw(key):
+                    self.raw += 1
+                    return False
+                series = self._series[key] = self._new_series(key, message)
+
+            now = time.time()
+            if now >= series.end:
+                points = self._close(key, series, now)
+
+            series.add(payload)
+            self.samples += 1
+
+        if points:
+            self._emit(points)
+        return True
+
+    def flush(self, now: float | None = None) -> int:
+        """Fecha as janelas vencidas (todas, com now = inf) e retorna os pontos emitidos."""
+        now = time.time() if now is None else now
+        points = []
+
+        with self._lock:
+            for key, series in list(self._series.items()):
+                if now < series.end:
+                    continue
+
+                empty = not series.messages and not series.other
+                points.extend(self._close(key, series, now))
+
+                # Série sem mensagens na última janela: o remetente sumiu ou mudou de tipo.
+                if empty:
+                    del self._series[key]
+
+        self._emit(points)
+        return len(points)
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._series),
+            "samples": self.samples,
+            "points": self.points,
+            "raw": self.raw,
+        }
+
+    def close(self, timeout: float | None = 5.0) -> None:
+        """Para a thread e emite as janelas abertas, mesmo incompletas."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        self.flush(math.inf)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._tick):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("[AGGREGATION] Erro ao fechar as janelas")
+
+    def _close(self, key: tuple, series: _Series, now: float) -> list[dict]:
+        """Gera o ponto da janela atual e abre a seguinte. Chamado com self._lock."""
+        point = series.point(key[0])
+
+        if math.isfinite(now):
+            series.open(now)
+
+        return [point] if point is not None else []
+
+    def _emit(self, points: list[dict]) -> None:
+        for point in points:
+            self.emit(point)
+        self.points += len(points)
+
+    def _is_raw(self, key: tuple) -> bool:
+        """Decide, uma vez por série, se ela fica fora da agregação."""
+        measurement, source, _ = key
+        raw = bool((self.measurements.get(measurement) or {}).get("raw"))
+
+        if not raw and self.passthrough:
+            raw = source in self.passthrough
+            if not raw and self.identify is not None:
+                raw = self.identify(source) in self.passthrough
+
+        if raw:
+            self._raw.add(key)
+        return raw
+
+    def _new_series(self, key: tuple, message) -> _Series:
+        measurement, source, message_type = key
+        options = self.measurements.get(measurement) or {}
+
+        stats = self.stat_names
+        if options.get("stats"):
+            stats = self._check_stats(options["stats"])
+
+        window = options.get("window") or self.window
+        tags = {"src": source, "protocol": message.protocol, "type": message_type, "window": f"{window:g}s"}
+
+        return _Series(tags, window, stats, self.buffer_size, time.time())
+
+    @staticmethod
+    def _check_stats(stats) -> tuple:
+        valid = tuple(stat for stat in stats if stat in STATS)
+
+        for stat in stats:
+            if stat not in STATS:
+                logger.warning("[AGGREGATION] Estatística desconhecida '%s' ignorada (use %s)", stat, ", ".join(STATS))
+
+        return valid or STATS
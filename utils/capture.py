@@ -0,0 +1,219 @@
+"""Gravação e reprodução do tráfego recebido pelo Dispatcher.
+
+No modo de gravação, cada quadro recebido pelos handlers é guardado exatamente como
+chegou (bytes crus, inclusive lixo e quadros inválidos), junto do instante de
+recebimento, do nome do handler e, no MQTT, do tópico. Os arquivos são binários,
+com registros de tamanho prefixado, e giram por tamanho:
+
+    capture-20250805-141500-000001.bcap
+
+    Cabeçalho do arquivo: MAGIC (8 bytes)
+    Cada registro:        <d instante> <B tamanho do handler> <H tamanho do tópico>
+                          <I tamanho dos dados> handler tópico dados
+
+Depois, read_capture() lê os arquivos em ordem e replay() entrega as mensagens a
+uma função (normalmente o dispatch) em tempo real, N vezes mais rápido ou o mais
+rápido possível. Os quadros são convertidos como os handlers fariam, então a
+reprodução é determinística: a mesma captura sempre gera as mesmas mensagens, na
+mesma ordem.
+
+Exemplo de uso:
+
+    recorder = CaptureWriter("captures")
+    recorder.attach("espnow", serial_handler)
+    ...
+    replay(read_capture(["captures/capture-...bcap"]), on_message, speed=10)
+"""
+
+import logging
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from utils.envelope import Envelope, decode_message
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BIFCAP1\n"
+SUFFIX = ".bcap"
+
+_HEADER = struct.Struct("<dBHI")
+
+class CaptureRecord(NamedTuple):
+    ts: float
+    handler: str
+    topic: str | None
+    raw: bytes
+
+class CaptureWriter:
+    def __init__(self, directory: str | Path, max_file_bytes: int = 16 * 1024 * 1024, max_files: int = 16, flush_interval: float = 1.0):
+        """Abre o primeiro arquivo de captura.
+
+        Args:
+            directory: Diretório dos arquivos (criado se não existir).
+            max_file_bytes: Tamanho a partir do qual um novo arquivo é aberto.
+            max_files: Arquivos mantidos no diretório, os mais antigos são apagados.
+            flush_interval: Tempo máximo (s) de um registro no buffer antes de ir ao disco.
+        """
+        self.directory = Path(directory)
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+
+        self.records = 0
+        self.bytes = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._sequence = 0
+        self._flushed_at = time.monotonic()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._rotate()
+
+    def attach(self, name: str, handler) -> None:
+        """Passa a gravar os quadros recebidos por um handler."""
+        handler.capture = lambda raw, topic=None: self.record(name, raw, topic)
+
+    def record(self, handler: str, raw: bytes | memoryview, topic: str | None = None) -> None:
+        """Grava um quadro recebido. Pode ser chamado de qualquer thread."""
+        name = handler.encode("utf-8")[:255]
+        topic_bytes = topic.encode("utf-8")[:65535] if topic else b""
+        data = _HEADER.pack(time.time(), len(name), len(topic_bytes), len(raw)) + name + topic_bytes + bytes(raw)
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            try:
+                self._file.write(data)
+            except OSError as e:
+                logger.error("[CAPTURE] Falha ao gravar a captura, gravação interrompida: %s", e)
+                self._close_file()
+                return
+
+            self._size += len(data)
+            self.records += 1
+            self.bytes += len(data)
+
+            if self._size >= self.max_file_bytes:
+                self._rotate()
+            elif time.monotonic() - self._flushed_at >= self.flush_interval:
+                self._file.flush()
+                self._flushed_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"records": self.records, "bytes": self.bytes, "files": self._sequence}
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_file()
+
+    def _rotate(self) -> None:
+        """Fecha o arquivo atual, abre o próximo e apaga os excedentes. Chamado com _lock."""
+        self._close_file()
+        self._sequence += 1
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.directory / f"capture-{stamp}-{self._sequence:06d}{SUFFIX}"
+
+        try:
+            self._file = path.open("wb")
+            self._file.write(MAGIC)
+        except OSError as e:
+            logger.error("[CAPTURE] Não foi possível abrir '%s': %s", path, e)
+            self._file = None
+            return
+
+        self._size = len(MAGIC)
+        logger.info("[CAPTURE] Gravando em '%s'", path)
+
+        files = sorted(self.directory.glob(f"capture-*{SUFFIX}"))
+        for old in files[:-self.max_files]:
+            old.unlink(missing_ok=True)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_capture(paths: Iterable[str | Path]) -> Iterator[CaptureRecord]:
+    """Lê os registros de um ou mais arquivos de captura, na ordem dos arquivos.
+
+    Um registro incompleto no fim do arquivo (gravação interrompida) é ignorado.
+    """
+    for path in paths:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logger.warning("[CAPTURE] '%s' não é um arquivo de captura", path)
+                continue
+
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+
+                ts, name_size, topic_size, raw_size = _HEADER.unpack(header)
+                body = f.read(name_size + topic_size + raw_size)
+                if len(body) < name_size + topic_size + raw_size:
+                    break
+
+                name = body[:name_size].decode("utf-8")
+                topic = body[name_size:name_size + topic_size].decode("utf-8") or None
+                yield CaptureRecord(ts, name, topic, body[name_size + topic_size:])
+
+def decode_record(record: CaptureRecord) -> Envelope | None:
+    """Converte um registro na mensagem que o handler teria entregado, ou None.
+
+    Segue as regras dos handlers: envelopes sem "src"/"dst" são descartados e, no
+    MQTT, o tópico é o remetente padrão.
+    """
+    try:
+        if record.topic is not None:
+            return decode_message(record.raw, src=record.topic, protocol="MQTT")
+        return decode_message(record.raw)
+    except Exception:
+        return None
+
+def replay(records: Iterable[CaptureRecord], on_message, speed: float = 1.0) -> dict:
+    """Entrega as mensagens da captura a `on_message`, respeitando os intervalos.
+
+    Args:
+        records: Registros, normalmente de read_capture().
+        on_message: Função chamada com cada mensagem (Envelope).
+        speed: 1 reproduz em tempo real, N acelera N vezes, 0 não espera.
+
+    Returns:
+        Contadores: registros lidos, mensagens entregues e quadros inválidos.
+    """
+    stats = {"records": 0, "messages": 0, "invalid": 0, "errors": 0}
+    first = start = None
+
+    for record in records:
+        stats["records"] += 1
+
+        if speed > 0:
+            if first is None:
+                first, start = record.ts, time.monotonic()
+
+            delay = start + (record.ts - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        message = decode_record(record)
+        if message is None:
+            stats["invalid"] += 1
+            continue
+
+        try:
+            on_message(message)
+            stats["messages"] += 1
+        except Exception:
+            stats["errors"] += 1
+            logger.exception("[CAPTURE] Erro ao reproduzir a mensagem: %s", message)
+
+    return stats
@@ -0,0 +1,373 @@
+"""Formato binário compacto do envelope Bifrost, para enlaces lentos (UART 9600, LoRa).
+
+O envelope é codificado em MessagePack (subconjunto implementado aqui, compatível
+com as bibliotecas de MessagePack dos microcontroladores, como a ArduinoJson), com
+as seguintes reduções em relação ao JSON:
+
+- Chaves do envelope viram inteiros (v=0, src=1, dst=2, protocol=3, type=4, ts=5, payload=6).
+- Endereços MAC ("AA:BB:CC:DD:EE:FF") viram 6 bytes binários e voltam em maiúsculas
+  (o registro guarda e busca os MACs assim, ver utils.registry.normalize_address).
+- Valores conhecidos de protocol/type, "central" e as chaves mais comuns do payload
+  viram inteiros pequenos (tabelas abaixo, nunca reordenar, apenas acrescentar).
+- Inteiros usam o menor tamanho possível e floats que cabem em float32 (com 7
+  dígitos significativos) usam 4 bytes.
+
+Cada quadro começa com o byte MAGIC (0xB0 | versão) seguido do tamanho em varint,
+o que permite separá-lo no mesmo fluxo serial das linhas JSON, já que um JSON em
+UTF-8 nunca começa com esse byte.
+
+Exemplo de uso:
+
+    frame = encode(envelope)
+    envelope = decode(frame)
+"""
+
+import math
+import re
+import struct
+
+VERSION = 1
+MAGIC = 0xB0 | VERSION
+
+ENVELOPE_KEYS = ["v", "src", "dst", "protocol", "type", "ts", "payload"]
+
+# Tabelas de valores frequentes. Os índices fazem parte do formato.
+PROTOCOLS = ["espnow", "MQTT", "lora", "IP"]
+TYPES = ["state", "register", "register_request", "register_response", "command", "data", "ping"]
+ADDRESSES = ["central"]
+FIELDS = [
+    "temperature", "humidity", "status", "id", "device_type", "device_id", "led",
+    "state", "format", "battery", "rssi", "pressure", "value",
+]
+
+_KEY_INDEX = {key: i for i, key in enumerate(ENVELOPE_KEYS)}
+_PROTOCOL_INDEX = {value: i for i, value in enumerate(PROTOCOLS)}
+_TYPE_INDEX = {value: i for i, value in enumerate(TYPES)}
+_ADDRESS_INDEX = {value: i for i, value in enumerate(ADDRESSES)}
+_FIELD_INDEX = {value: i for i, value in enumerate(FIELDS)}
+
+_MAC = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$")
+
+class CompactError(ValueError):
+    """Quadro compacto inválido ou valor que não pode ser codificado."""
+
+##########################################################################################
+#                                 Envelope compacto                                      #
+##########################################################################################
+
+def encode(envelope: dict) -> bytes:
+    """Codifica um envelope no formato compacto, já com MAGIC e tamanho."""
+    out = bytearray()
+    _pack_map_header(out, len(envelope))
+
+    for key, value in envelope.items():
+        index = _KEY_INDEX.get(key)
+        _pack(out, index if index is not None else key)
+
+        if key in ("src", "dst"):
+            _pack_address(out, value)
+        elif key == "protocol" and value in _PROTOCOL_INDEX:
+            _pack(out, _PROTOCOL_INDEX[value])
+        elif key == "type" and value in _TYPE_INDEX:
+            _pack(out, _TYPE_INDEX[value])
+        elif key == "payload" and isinstance(value, dict):
+            _pack_map_header(out, len(value))
+            for field, item in value.items():
+                _pack(out, _FIELD_INDEX.get(field, field))
+                _pack(out, item)
+        else:
+            _pack(out, value)
+
+    header = bytearray([MAGIC])
+    _pack_varint(header, len(out))
+    return bytes(header + out)
+
+def decode(frame) -> dict:
+    """Decodifica um quadro compacto (bytes ou memoryview, com MAGIC e tamanho).
+
+    Raises:
+        CompactError: se o quadro estiver truncado ou for inválido.
+    """
+    data = bytes(frame)
+
+    if not data or data[0] != MAGIC:
+        raise CompactError("Quadro compacto com versão desconhecida")
+
+    length, pos = read_varint(data, 1)
+    if length is None or pos + length != len(data):
+        raise CompactError("Tamanho do quadro compacto inválido")
+
+    try:
+        raw, pos = _unpack(data, pos)
+    except (IndexError, struct.error) as e:
+        raise CompactError("Quadro compacto truncado") from e
+
+    if not isinstance(raw, dict):
+        raise CompactError("Quadro compacto não contém um envelope")
+
+    envelope = {}
+    for key, value in raw.items():
+        key = _lookup(ENVELOPE_KEYS, key)
+
+        if key in ("src", "dst"):
+            value = _unpack_address(value)
+        elif key == "protocol":
+            value = _lookup(PROTOCOLS, value)
+        elif key == "type":
+            value = _lookup(TYPES, value)
+        elif key == "payload" and isinstance(value, dict):
+            value = {_lookup(FIELDS, field): item for field, item in value.items()}
+
+        envelope[key] = value
+
+    return envelope
+
+def frame_length(data, start: int) -> int | None:
+    """Retorna o tamanho total do quadro que começa em start, ou None se o cabeçalho
+    ainda não chegou por completo. Usado pelo framer para separar quadros binários."""
+    length, body = read_varint(data, start + 1)
+    if length is None:
+        return None
+    return body - start + length
+
+def read_varint(data, pos: int) -> tuple[int | None, int]:
+    """Lê um varint (LEB128) em data[pos:], retorna (valor, posição seguinte)."""
+    value = 0
+    shift = 0
+
+    while pos < len(data):
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+
+        if not byte & 0x80:
+            return value, pos
+
+        shift += 7
+        if shift > 28:
+            raise CompactError("Varint muito longo")
+
+    return None, pos
+
+def _pack_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _pack_address(out: bytearray, address):
+    if isinstance(address, str) and address in _ADDRESS_INDEX:
+        _pack(out, _ADDRESS_INDEX[address])
+    elif isinstance(address, str) and _MAC.match(address):
+        _pack(out, bytes.fromhex(address.replace(":", "")))
+    else:
+        _pack(out, address)
+
+def _unpack_address(value):
+    if isinstance(value, bytes) and len(value) == 6:
+        return ":".join(f"{b:02X}" for b in value)
+    return _lookup(ADDRESSES, value)
+
+def _lookup(table: list, value):
+    """Valor da tabela para um índice, ou o próprio valor se não for um índice.
+
+    Raises:
+        CompactError: para índices negativos, que o Python aceitaria (table[-1]).
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        if value < 0:
+            raise CompactError(f"Índice negativo no quadro compacto: {value}")
+        if value < len(table):
+            return table[value]
+    return value
+
+##########################################################################################
+#                                MessagePack (subconjunto)                               #
+##########################################################################################
+
+def _pack(out: bytearray, value):
+    if value is None:
+        out.append(0xC0)
+    elif value is True:
+        out.append(0xC3)
+    elif value is False:
+        out.append(0xC2)
+    elif isinstance(value, int):
+        _pack_int(out, value)
+    elif isinstance(value, float):
+        _pack_float(out, value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        size = len(data)
+        if size < 32:
+            out.append(0xA0 | size)
+        elif size < 0x100:
+            out += bytes((0xD9, size))
+        elif size < 0x10000:
+            out.append(0xDA)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xDB)
+            out += struct.pack(">I", size)
+        out += data
+    elif isinstance(value, (bytes, bytearray)):
+        size = len(value)
+        if size < 0x100:
+            out += bytes((0xC4, size))
+        elif size < 0x10000:
+            out.append(0xC5)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xC6)
+            out += struct.pack(">I", size)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size < 0x10000:
+            out.append(0xDC)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xDD)
+            out += struct.pack(">I", size)
+        for item in value:
+            _pack(out, item)
+    elif isinstance(value, dict):
+        _pack_map_header(out, len(value))
+        for key, item in value.items():
+            _pack(out, key)
+            _pack(out, item)
+    else:
+        raise CompactError(f"Tipo não suportado no formato compacto: {type(value).__name__}")
+
+def _pack_map_header(out: bytearray, size: int):
+    if size < 16:
+        out.append(0x80 | size)
+    elif size < 0x10000:
+        out.append(0xDE)
+        out += struct.pack(">H", size)
+    else:
+        out.append(0xDF)
+        out += struct.pack(">I", size)
+
+def _pack_int(out: bytearray, value: int):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xFF)
+    elif 0 <= value < 0x100:
+        out += bytes((0xCC, value))
+    elif 0 <= value < 0x10000:
+        out.append(0xCD)
+        out += struct.pack(">H", value)
+    elif 0 <= value < 0x100000000:
+        out.append(0xCE)
+        out += struct.pack(">I", value)
+    elif 0 <= value < 0x10000000000000000:
+        out.append(0xCF)
+        out += struct.pack(">Q", value)
+    elif -0x80 <= value:
+        out.append(0xD0)
+        out += struct.pack(">b", value)
+    elif -0x8000 <= value:
+        out.append(0xD1)
+        out += struct.pack(">h", value)
+    elif -0x80000000 <= value:
+        out.append(0xD2)
+        out += struct.pack(">i", value)
+    elif -0x8000000000000000 <= value:
+        out.append(0xD3)
+        out += struct.pack(">q", value)
+    else:
+        raise CompactError("Inteiro fora do intervalo de 64 bits")
+
+def _pack_float(out: bytearray, value: float):
+    # Leituras de sensores raramente passam de 7 dígitos significativos: nesse caso o
+    # float32 preserva o valor exibido, e o decode arredonda de volta.
+    if math.isfinite(value) and abs(value) < 3.4e38:
+        single = struct.unpack(">f", struct.pack(">f", value))[0]
+        if float(f"{single:.7g}") == value:
+            out.append(0xCA)
+            out += struct.pack(">f", value)
+            return
+
+    out.append(0xCB)
+    out += struct.pack(">d", value)
+
+def _unpack(data: bytes, pos: int):
+    byte = data[pos]
+    pos += 1
+
+    if byte < 0x80:
+        return byte, pos
+    if byte >= 0xE0:
+        return byte - 0x100, pos
+    if 0x80 <= byte <= 0x8F:
+        return _unpack_map(data, pos, byte & 0x0F)
+    if 0x90 <= byte <= 0x9F:
+        return _unpack_array(data, pos, byte & 0x0F)
+    if 0xA0 <= byte <= 0xBF:
+        return _unpack_str(data, pos, byte & 0x1F)
+
+    if byte == 0xC0:
+        return None, pos
+    if byte == 0xC2:
+        return False, pos
+    if byte == 0xC3:
+        return True, pos
+
+    if byte in _SIZED:
+        fmt, kind = _SIZED[byte]
+        size = struct.calcsize(fmt)
+        (value,) = struct.unpack_from(fmt, data, pos)
+        pos += size
+
+        if kind == "int":
+            return value, pos
+        if kind == "float32":
+            return float(f"{value:.7g}"), pos
+        if kind == "float64":
+            return value, pos
+        if kind == "str":
+            return _unpack_str(data, pos, value)
+        if kind == "bin":
+            if pos + value > len(data):
+                raise CompactError("Quadro compacto truncado")
+            return data[pos:pos + value], pos + value
+        if kind == "array":
+            return _unpack_array(data, pos, value)
+        if kind == "map":
+            return _unpack_map(data, pos, value)
+
+    raise CompactError(f"Byte de tipo desconhecido: 0x{byte:02X}")
+
+_SIZED = {
+    0xC4: (">B", "bin"), 0xC5: (">H", "bin"), 0xC6: (">I", "bin"),
+    0xCA: (">f", "float32"), 0xCB: (">d", "float64"),
+    0xCC: (">B", "int"), 0xCD: (">H", "int"), 0xCE: (">I", "int"), 0xCF: (">Q", "int"),
+    0xD0: (">b", "int"), 0xD1: (">h", "int"), 0xD2: (">i", "int"), 0xD3: (">q", "int"),
+    0xD9: (">B", "str"), 0xDA: (">H", "str"), 0xDB: (">I", "str"),
+    0xDC: (">H", "array"), 0xDD: (">I", "array"),
+    0xDE: (">H", "map"), 0xDF: (">I", "map"),
+}
+
+def _unpack_str(data: bytes, pos: int, size: int):
+    if pos + size > len(data):
+        raise CompactError("Quadro compacto truncado")
+    return data[pos:pos + size].decode("utf-8"), pos + size
+
+def _unpack_array(data: bytes, pos: int, size: int):
+    items = []
+    for _ in range(size):
+        item, pos = _unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+def _unpack_map(data: bytes, pos: int, size: int):
+    result = {}
+    for _ in range(size):
+        key, pos = _unpack(data, pos)
+        value, pos = _unpack(data, pos)
+        result[key] = value
+    return result, pos
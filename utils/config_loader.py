@@ -3,6 +3,7 @@
 Este módulo define:
 - DotDict: uma subclasse de dict que permite acesso a chaves via notação de atributo.
 - load_config: função estática para ler um arquivo TOML e retornar um objeto DotDict.
+- LazyConfig: configuração lida apenas no primeiro acesso, para uso em nível de módulo.
 """  
 
 from pathlib import Path
@@ -49,3 +50,32 @@ def load_config(path: str) -> DotDict:
         data = toml.load(f)
 
     return DotDict(data)
+
+class LazyConfig:
+    """Configuração que só lê o arquivo TOML no primeiro acesso a um campo.
+
+    Permite declarar a configuração em nível de módulo (cfg = LazyConfig(...)) sem ler
+    o arquivo durante o import. Depois do primeiro acesso, se comporta como o DotDict
+    retornado por load_config().
+
+    Exemplo:
+        cfg = LazyConfig("config/config.toml")
+        print(cfg.mqtt.broker)  # o arquivo é lido aqui
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._config: DotDict | None = None
+
+    def load(self) -> DotDict:
+        if self._config is None:
+            self._config = load_config(self._path)
+        return self._config
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __repr__(self):
+        return f"LazyConfig({self._path!r})"
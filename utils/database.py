@@ -1,41 +1,320 @@
-"""Faz a conexão da dispatcher com o InfluxDB"""
+"""Faz a conexão da dispatcher com o InfluxDB
+
+As escritas não acontecem mais no caminho de roteamento: write_data() e
+write_envelope() apenas colocam o ponto (ou a mensagem) em uma fila limitada, e uma
+thread de escrita (BatchWriter) converte para line protocol e envia em lotes, por
+tamanho ou por tempo. Se a fila encher, os
+novos pontos são descartados e contabilizados, mantendo o dispatch sempre livre.
+
+Se o banco estiver fora do ar, os lotes que falharam vão para uma fila em disco
+(utils.spool.Spool) e são reenviados pela mesma thread quando o banco voltar.
+
+O influxdb_client é importado pela thread de escrita e o cliente só é criado na
+primeira escrita, lendo o .env e as variáveis de ambiente nesse momento. Importar este
+módulo é barato e não exige um InfluxDB configurado.
+
+Para testes, INFLUXDB_URL pode apontar para o stub em tests/influx_stub.py.
+"""
 
 import logging
 import os
-from dotenv import load_dotenv
+import queue
+import threading
+import time
 
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-from influxdb_client.rest import ApiException
+from utils.envelope import Envelope
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-# Carrega as configurações do .env na raiz do projeto
-load_dotenv()
+# Preenchidos sob demanda por _import_client() e _get_write_api().
+_Point = None
+_precision = None
+_api_errors: tuple = ()
+_client = None
+_write_api = None
+_org = None
+_bucket = None
+_client_lock = threading.Lock()
+
+def _import_client() -> None:
+    """Importa as classes do influxdb_client usadas pelo escritor (import caro)."""
+    global _Point, _precision, _api_errors
+
+    from influxdb_client import Point, WritePrecision
+    from influxdb_client.rest import ApiException
+
+    _Point, _precision, _api_errors = Point, WritePrecision.NS, (ApiException,)
+
+def _get_write_api():
+    """Cria o cliente do InfluxDB na primeira chamada, com as configurações do .env."""
+    global _client, _write_api, _org, _bucket
+
+    with _client_lock:
+        if _write_api is None:
+            from dotenv import load_dotenv
+            from influxdb_client import InfluxDBClient
+            from influxdb_client.client.write_api import SYNCHRONOUS
+
+            # Carrega as configurações do .env na raiz do projeto
+            load_dotenv()
+
+            _org = os.environ.get("INFLUXDB_ORG")
+            _bucket = os.environ.get("INFLUXDB_BUCKET")
+            _client = InfluxDBClient(url=os.environ.get("INFLUXDB_URL"), token=os.environ.get("INFLUXDB_TOKEN"))
+            _write_api = _client.write_api(write_options=SYNCHRONOUS)
+
+    return _write_api
+
+# Sentinela usada para encerrar a thread de escrita.
+_STOP = object()
+
+class BatchWriter:
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        queue_size: int = 10_000,
+        spool=None,
+        retry_interval: float = 10.0,
+        replay_batch: int = 5000,
+    ):
+        """Escritor em lotes do InfluxDB, executado em uma thread própria.
+
+        Args:
+            batch_size: Quantidade de pontos que dispara uma escrita imediata.
+            flush_interval: Tempo máximo (s) que um ponto espera na fila antes de ser escrito.
+            queue_size: Tamanho máximo da fila, acima disso os pontos são descartados.
+            spool: Uma utils.spool.Spool opcional, recebe os lotes que falharam.
+            retry_interval: Após uma falha, tempo (s) em que os lotes vão direto para a
+                fila em disco antes de tentar o banco novamente.
+            replay_batch: Quantidade de linhas por escrita durante o replay.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.replay_batch = replay_batch
+        self._retry_at = 0.0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+
+        # Contadores expostos em stats()
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, point_dict: dict) -> bool:
+        """Coloca um ponto na fila de escrita sem bloquear.
+
+        Pontos sem "time" recebem o instante atual aqui, e não na thread de escrita,
+        para que a espera na fila (até flush_interval) não atrase o ponto.
+
+        Returns:
+            True se o ponto foi enfileirado, False se a fila estava cheia e o ponto
+            foi descartado.
+        """
+        if not isinstance(point_dict, tuple) and "time" not in point_dict:
+            point_dict = {**point_dict, "time": time.time_ns()}
+
+        try:
+            self._queue.put_nowait(point_dict)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("Fila do InfluxDB cheia, %d pontos descartados até agora.", self.dropped)
+            return False
+
+        self.queued += 1
+        return True
+
+    def stats(self) -> dict:
+        """Retorna os contadores do escritor (e da fila em disco, se existir)."""
+        stats = {
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": self._queue.qsize(),
+        }
+
+        if self.spool is not None:
+            stats.update({f"spool_{key}": value for key, value in self.spool.stats().items()})
+        return stats
+
+    def close(self, timeout: float | None = 5.0):
+        """Escreve os pontos pendentes e encerra a thread de escrita."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Loop da thread: acumula linhas e escreve ao atingir batch_size ou flush_interval."""
+        _import_client()
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
 
-# Acessa as variáveis configuradas Pegando o token pelas variáveis do sistema.
-token = os.environ.get("INFLUXDB_TOKEN")
-url = os.environ.get("INFLUXDB_URL")
-org = os.environ.get("INFLUXDB_ORG")
-bucket = os.environ.get("INFLUXDB_BUCKET")
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
 
-# Inicializando o client do InfluxDB
-client = InfluxDBClient(url=url, token=token)
+            if item is _STOP:
+                self._flush(batch)
+                if self.spool is not None:
+                    self.spool.close()
+                return
 
-# Inicia a API de escrita usando client.
-write_api = client.write_api(write_options=SYNCHRONOUS)
+            if item is not None:
+                line = self._to_line(item)
+                if line:
+                    batch.append(line)
 
-def write_data(point_dict: dict):
-    """Usa a API do Influx para escrever no database"""
-    point = Point.from_dict(point_dict)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
 
-    try:
-        write_api.write(bucket=bucket, org=org, record=point)
-        logger.debug("Escreveu dados no InfluxDB: %s", point_dict)
-    except ApiException as e:
-        logger.error("Erro ao escrever dados no InfluxDB: %s", e.message)
+                self._replay()
+
+    def _to_line(self, item) -> str | None:
+        """Converte o item da fila (dicionário do ponto ou (measurement, Envelope, instante)) em line protocol."""
+        point_dict = item
+        try:
+            if isinstance(item, tuple):
+                point_dict = envelope_to_point_dict(message=item[1], measurement=item[0], time_ns=item[2])
+            return _Point.from_dict(point_dict, write_precision=_precision).to_line_protocol()
+        except Exception as e:
+            logger.error("Ponto inválido para o InfluxDB: %s (%s)", point_dict, e)
+            self.failed += 1
+            return None
+
+    def _flush(self, batch: list[str]):
+        """Escreve um lote de linhas no InfluxDB.
+
+        Em caso de falha de conexão, o lote vai para a fila em disco. Enquanto o banco
+        estiver fora (retry_interval), os próximos lotes vão direto para o disco.
+        """
+        if not batch:
+            return
+
+        if self.spool is not None and time.monotonic() < self._retry_at:
+            self.spool.append(batch)
+            return
+
+        try:
+            self._write(batch)
+            self.flushed += len(batch)
+            logger.debug("Escreveu %d pontos no InfluxDB", len(batch))
+            return
+        except _api_errors as e:
+            logger.error("Erro ao escrever dados no InfluxDB: %s", e.message)
+
+            # Erros do cliente (dados inválidos) nunca serão aceitos, não adianta guardar.
+            if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                self.failed += len(batch)
+                return
+        except Exception as e:
+            logger.error("Erro ao escrever dados no InfluxDB: %s", e)
+
+        self._retry_at = time.monotonic() + self.retry_interval
+
+        if self.spool is None:
+            self.failed += len(batch)
+        else:
+            self.spool.append(batch)
+
+    def _replay(self):
+        """Drena a fila em disco, um segmento por vez, quando o banco está disponível."""
+        if self.spool is None or not self.spool.pending() or time.monotonic() < self._retry_at:
+            return
+
+        try:
+            self.spool.replay(self._replay_write, batch_size=self.replay_batch, max_segments=1)
+        except Exception:
+            self._retry_at = time.monotonic() + self.retry_interval
+
+    def _replay_write(self, batch: list[str]):
+        """Escrita usada no replay, descarta lotes recusados por dados inválidos."""
+        try:
+            self._write(batch)
+        except _api_errors as e:
+            if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                logger.error("Lote da fila em disco recusado pelo InfluxDB: %s", e.message)
+                self.failed += len(batch)
+                return
+            raise
+
+    def _write(self, batch: list[str]):
+        write_api = _get_write_api()
+
+        start = time.perf_counter()
+        # As linhas já levam o instante do ponto em ns, inclusive as da fila em disco.
+        write_api.write(bucket=_bucket, org=_org, record=batch, write_precision=_precision)
+        metrics.observe("db", time.perf_counter() - start)
+
+_writer: BatchWriter | None = None
+
+def start_writer(**kwargs) -> BatchWriter:
+    """Inicia o escritor em lotes usado por write_data(), os argumentos são os de BatchWriter."""
+    global _writer
+
+    if _writer is None:
+        _writer = BatchWriter(**kwargs)
+    return _writer
+
+def write_data(point_dict: dict) -> bool:
+    """Enfileira um ponto para ser escrito no database, sem bloquear.
+
+    Se start_writer() não foi chamado, o escritor é criado com os valores padrão.
+    """
+    return (_writer or start_writer()).put(point_dict)
+
+def write_envelope(message, measurement: str) -> bool:
+    """Enfileira a telemetria de uma mensagem (Envelope), sem bloquear.
+
+    O dicionário do ponto só é montado na thread de escrita, então src, protocol, type
+    e payload da mensagem não devem ser alterados depois daqui. O instante do ponto é
+    o da chamada.
+    """
+    return (_writer or start_writer()).put((measurement, message, time.time_ns()))
+
+def writer_stats() -> dict:
+    """Contadores do escritor do InfluxDB (queued, flushed, dropped, failed, pending)."""
+    if _writer is None:
+        return {"queued": 0, "flushed": 0, "dropped": 0, "failed": 0, "pending": 0}
+    return _writer.stats()
+
+def envelope_to_point_dict(message, measurement: str, time_ns: int | None = None) -> dict:
+    """Monta o ponto do InfluxDB de uma mensagem (Envelope ou dicionário).
+
+    O ponto sempre leva o instante explícito: sem ele, o InfluxDB usaria a hora da
+    escrita, que pode ser bem depois (lotes, reenvio da fila em disco). O "ts" do
+    envelope não é usado por ter resolução de segundos, e pontos da mesma série no
+    mesmo segundo se sobrescreveriam.
+
+    Args:
+        message: A mensagem recebida.
+        measurement: Measurement do ponto.
+        time_ns: Instante do ponto em ns. Se None, o instante atual.
+    """
+    if time_ns is None:
+        time_ns = time.time_ns()
+
+    if message.__class__ is Envelope:
+        return {
+            "measurement": measurement,
+            "fields": message.payload,
+            "tags": {"src": message.src, "protocol": message.protocol, "type": message.type},
+            "time": time_ns,
+        }
 
-def envelope_to_point_dict(message: dict, measurement: str) -> dict:
     point_dict = {}
 
     point_dict["measurement"] = measurement
@@ -46,18 +325,28 @@ def envelope_to_point_dict(message: dict, measurement: str) -> dict:
         "protocol": message.get("protocol"),
         "type": message.get("type"),
     }
+    point_dict["time"] = time_ns
 
     return point_dict 
 
 def close_write_api():
-    write_api.close()
+    global _writer, _client, _write_api
+
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+    with _client_lock:
+        if _write_api is not None:
+            _write_api.close()
+            _client.close()
+            _client = _write_api = None
 
 
 def main():
     """Debug"""
 
     import random
-    import time
 
     for i in range(10):
         message = {
@@ -76,8 +365,9 @@ def main():
         write_data(envelope_to_point_dict(message=message, measurement="Testing"))
         time.sleep(0.1)
 
-
+    writer = _writer
     close_write_api()
+    print(writer.stats())
 
 if __name__ == "__main__":
     """Debug"""
@@ -0,0 +1,126 @@
+"""Filtro de banda morta para leituras repetidas dos sensores.
+
+Sensores como os termohigrômetros reportam valores quase iguais a cada envio, e cada
+envio é roteado, republicado no MQTT e gravado no InfluxDB. O filtro guarda, para cada
+dispositivo, o último valor encaminhado de cada campo do payload e só deixa a mensagem
+seguir para os sinks se algum campo mudou além da banda:
+
+    - campos numéricos: |novo - último| > max(absolute, percent% de |último|);
+    - outros campos (texto, bool, listas): qualquer diferença;
+    - campos que apareceram ou sumiram contam como mudança.
+
+A comparação é sempre com o último valor encaminhado (não com o último recebido), então
+uma deriva lenta acaba passando quando acumula mais que a banda. Depois de max_silence
+segundos sem encaminhar nada, a próxima mensagem passa mesmo sem mudança (heartbeat),
+para que os painéis saibam que o dispositivo continua vivo.
+
+Só são filtrados os device_types configurados e os tipos de mensagem em `types`.
+
+Exemplo de uso:
+
+    deadband = DeadbandFilter({
+        "thermohygrometer": {"max_silence": 300, "fields": {"temperature": {"absolute": 0.2}, "humidity": {"percent": 2.0}}},
+    })
+
+    if not deadband.accept(message, device_type):
+        return
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class _Band:
+    __slots__ = ("absolute", "percent")
+
+    def __init__(self, options: dict, default: "_Band | None" = None):
+        self.absolute = float(options.get("absolute", default.absolute if default else 0.0))
+        self.percent = float(options.get("percent", default.percent if default else 0.0))
+
+    def changed(self, last, value) -> bool:
+        if last.__class__ not in (int, float) or value.__class__ not in (int, float):
+            return last != value
+
+        return abs(value - last) > max(self.absolute, self.percent / 100 * abs(last))
+
+class _DeviceType:
+    """Bandas e heartbeat de um device_type."""
+    __slots__ = ("default", "fields", "max_silence")
+
+    def __init__(self, options: dict, max_silence: float):
+        self.default = _Band(options)
+        self.fields = {name: _Band(band, self.default) for name, band in (options.get("fields") or {}).items()}
+        self.max_silence = float(options.get("max_silence", max_silence))
+
+    def changed(self, last, payload) -> bool:
+        if last.__class__ is not dict or payload.__class__ is not dict:
+            return last != payload
+
+        if last.keys() != payload.keys():
+            return True
+
+        fields, default = self.fields, self.default
+        for key, value in payload.items():
+            if fields.get(key, default).changed(last[key], value):
+                return True
+        return False
+
+class DeadbandFilter:
+    def __init__(self, device_types: dict, types=("state", "data"), max_silence: float = 300.0):
+        """Cria o filtro.
+
+        Args:
+            device_types: {device_type: {"absolute", "percent", "max_silence", "fields": {campo: {"absolute", "percent"}}}}.
+                "absolute" e "percent" no device_type valem para os campos sem banda própria.
+            types: Tipos de mensagem filtrados, os outros (comandos, registro) sempre passam.
+            max_silence: Tempo máximo (s) sem encaminhar um dispositivo, 0 desativa o heartbeat.
+        """
+        self.device_types = {name: _DeviceType(options or {}, max_silence) for name, options in device_types.items()}
+        self.types = frozenset(types)
+
+        # remetente -> (último payload encaminhado, instante do encaminhamento)
+        self._last: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        # Contadores expostos em stats()
+        self.passed = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+
+    def accept(self, message, device_type: str | None) -> bool:
+        """Decide se a mensagem segue para os sinks, atualizando o último valor do remetente.
+
+        Returns:
+            False se a leitura está dentro da banda de todos os campos e o heartbeat
+            ainda não venceu.
+        """
+        config = self.device_types.get(device_type)
+        if config is None or message.type not in self.types:
+            return True
+
+        source, payload = message.src, message.payload
+        now = time.monotonic()
+
+        with self._lock:
+            last = self._last.get(source)
+
+            if last is not None and not config.changed(last[0], payload):
+                if not config.max_silence or now - last[1] < config.max_silence:
+                    self.suppressed += 1
+                    return False
+                self.heartbeats += 1
+
+            self._last[source] = (dict(payload) if payload.__class__ is dict else payload, now)
+            self.passed += 1
+
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._last),
+            "passed": self.passed,
+            "suppressed": self.suppressed,
+            "heartbeats": self.heartbeats,
+        }
@@ -1,25 +1,272 @@
-"""Gerenciamento dos Envelopes da Bifrost."""
+"""Gerenciamento dos Envelopes da Bifrost.
+
+A (de)serialização JSON usa o codec mais rápido disponível: orjson, msgspec ou o
+json da biblioteca padrão, nessa ordem. A variável de ambiente BIFROST_JSON_CODEC
+força um codec específico ("orjson", "msgspec" ou "json").
+
+Os handlers trabalham direto com bytes (serialize_bytes()/deserialize() aceitam
+bytes, bytearray e memoryview), evitando os .encode()/.decode() a cada mensagem.
+
+Além do JSON, existe o formato binário compacto (utils.compact) para enlaces lentos.
+O formato de cada dispositivo fica no campo "format" do registro, encode_envelope()
+codifica no formato pedido e decode_envelope() reconhece os dois automaticamente.
+
+Dentro do Dispatcher, as mensagens são objetos Envelope (com __slots__), criados por
+decode_message() direto do quadro recebido e usados pelo dispatch, pelos handlers e
+pelos sinks. Os codecs JSON serializam Envelope diretamente.
+"""
 
 import json
 import logging
+import os
 import time
 
-from pydantic import BaseModel, ValidationError
+from utils import compact
 
 logger = logging.getLogger(__name__)
 
-class Envelope(BaseModel):
-    """Envelope padrão para mensagens da Bifrost"""
-    v: int
-    protocol: str
-    src: str
-    dst: str
-    type: str
-    ts: int
-    payload: dict
+##########################################################################################
+#                                      Envelope                                          #
+##########################################################################################
+
+ENVELOPE_FIELDS = ("v", "src", "dst", "protocol", "type", "ts", "payload")
+_FIELD_SET = frozenset(ENVELOPE_FIELDS)
+
+class Envelope:
+    """Envelope padrão para mensagens da Bifrost.
+
+    Ocupa menos memória que o dicionário equivalente e seus campos são lidos como
+    atributos (message.src), que é como o caminho de roteamento deve usá-los. Campos
+    ausentes ficam como None e não são serializados.
+
+    Para o código que ainda trata mensagens como dicionários, também aceita get(),
+    message["campo"], "campo" in message, keys(), items() e dict(message).
+    """
+    __slots__ = ENVELOPE_FIELDS
+
+    def __init__(self, src=None, dst=None, payload=None, type=None, protocol=None, v=1, ts=None):
+        self.v = v
+        self.src = src
+        self.dst = dst
+        self.protocol = protocol
+        self.type = type
+        self.ts = ts
+        self.payload = payload
+
+    @classmethod
+    def from_dict(cls, data, src=None, protocol=None) -> "Envelope | None":
+        """Valida um envelope decodificado e o converte em Envelope.
+
+        A validação é a mínima para rotear: um dicionário com "src" e "dst" em texto.
+
+        Args:
+            data: Resultado de decode_envelope().
+            src: Remetente usado se o envelope não tiver "src" (o tópico, no MQTT).
+            protocol: Protocolo usado se o envelope não tiver "protocol".
+
+        Returns:
+            O Envelope, ou None se a mensagem não for válida.
+        """
+        if data.__class__ is not dict:
+            return None
+
+        get = data.get
+        source = get("src", src)
+        destination = get("dst")
+
+        if source.__class__ is not str or destination.__class__ is not str:
+            return None
+
+        envelope = cls.__new__(cls)
+        envelope.v = get("v", 1)
+        envelope.src = source
+        envelope.dst = destination
+        envelope.protocol = get("protocol", protocol)
+        envelope.type = get("type")
+        envelope.ts = get("ts")
+        envelope.payload = get("payload")
+        return envelope
+
+    def to_dict(self) -> dict:
+        """Dicionário com os campos presentes, na ordem do envelope."""
+        return {key: value for key in ENVELOPE_FIELDS if (value := getattr(self, key)) is not None}
+
+    def copy(self) -> "Envelope":
+        """Cópia rasa: o payload é compartilhado, assim como em dict.copy()."""
+        envelope = Envelope.__new__(Envelope)
+        for key in ENVELOPE_FIELDS:
+            setattr(envelope, key, getattr(self, key))
+        return envelope
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key) if key in _FIELD_SET else None
+        return default if value is None else value
+
+    def keys(self) -> list[str]:
+        return [key for key in ENVELOPE_FIELDS if getattr(self, key) is not None]
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __getitem__(self, key: str):
+        value = getattr(self, key) if key in _FIELD_SET else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return key in _FIELD_SET and getattr(self, key) is not None
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Envelope, dict)):
+            return self.to_dict() == (other if isinstance(other, dict) else other.to_dict())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Envelope({self.to_dict()})"
+
+def _default(value):
+    """Usado pelos codecs JSON para tipos que eles não conhecem."""
+    if value.__class__ is Envelope:
+        return value.to_dict()
+    raise TypeError(f"Tipo {type(value).__name__} não é serializável")
+
+##########################################################################################
+#                                    Codecs JSON                                         #
+##########################################################################################
+
+def _json_codec():
+    def dumps(data) -> bytes:
+        return json.dumps(data, separators=(",", ":"), default=_default).encode("utf-8")
+
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    return dumps, loads
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(data) -> bytes:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    return dumps, orjson.loads
 
+def _msgspec_codec():
+    import msgspec
 
+    encoder = msgspec.json.Encoder(enc_hook=_default)
+    decoder = msgspec.json.Decoder()
 
+    def loads(data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return decoder.decode(data)
+
+    return encoder.encode, loads
+
+CODECS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _json_codec,
+}
+
+def select_codec(name: str | None = None) -> str:
+    """Escolhe o codec JSON usado por serialize()/deserialize().
+
+    Args:
+        name: Nome do codec. Se None, usa BIFROST_JSON_CODEC ou o primeiro disponível
+            entre orjson, msgspec e json.
+
+    Returns:
+        O nome do codec selecionado.
+    """
+    global CODEC, _dumps, _loads
+
+    forced = name or os.environ.get("BIFROST_JSON_CODEC")
+    candidates = [forced] if forced else list(CODECS)
+
+    for candidate in candidates:
+        try:
+            _dumps, _loads = CODECS[candidate]()
+            CODEC = candidate
+            return CODEC
+        except ImportError:
+            logger.warning("Codec JSON '%s' não está instalado, usando o próximo disponível.", candidate)
+        except KeyError:
+            logger.error("Codec JSON '%s' desconhecido.", candidate)
+
+    _dumps, _loads = _json_codec()
+    CODEC = "json"
+    return CODEC
+
+CODEC: str = "json"
+_dumps, _loads = _json_codec()
+select_codec()
+
+##########################################################################################
+#                              Formatos de envelope                                      #
+##########################################################################################
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+
+def encode_envelope(data: "Envelope | dict", fmt: str | None = FORMAT_JSON) -> bytes | None:
+    """Codifica um envelope no formato do destinatário.
+
+    Args:
+        data: O envelope que será enviado (Envelope ou dicionário).
+        fmt: "json" (padrão) ou "compact", normalmente o campo "format" do registro.
+
+    Returns:
+        Os bytes do envelope, ou None em caso de erro.
+    """
+    if fmt == FORMAT_COMPACT:
+        try:
+            return compact.encode(data)
+        except compact.CompactError as e:
+            logger.error("Erro ao codificar envelope compacto: %s", e)
+            return None
+
+    return serialize_bytes(data)
+
+def decode_envelope(data: bytes | bytearray | memoryview) -> dict | None:
+    """Decodifica um envelope em JSON ou no formato compacto (reconhecido pelo MAGIC).
+
+    Returns:
+        O dicionário do envelope, ou None em caso de erro.
+    """
+    if data and data[0] == compact.MAGIC:
+        try:
+            return compact.decode(data)
+        except (compact.CompactError, UnicodeDecodeError) as e:
+            logger.error("Erro ao decodificar envelope compacto: %s", e)
+            return None
+
+    return deserialize(data)
+
+def decode_message(data: bytes | bytearray | memoryview, src: str | None = None, protocol: str | None = None) -> Envelope | None:
+    """Decodifica um quadro recebido direto em Envelope, já validado.
+
+    Args:
+        data: O quadro, em JSON ou no formato compacto.
+        src: Remetente padrão, para envelopes sem "src" (o tópico, no MQTT).
+        protocol: Protocolo padrão, para envelopes sem "protocol".
+
+    Returns:
+        O Envelope, ou None se o quadro não for um envelope válido.
+    """
+    return Envelope.from_dict(decode_envelope(data), src, protocol)
 
 ##########################################################################################
 #                          Implementação antiga da biblioteca                            #
@@ -53,22 +300,32 @@ def serialize(data: dict) -> str:
     Returns:
         Uma string JSON em caso de sucesso:
 
-        {"protocol": "MQTT", "topic": "/example/state"}
+        {"protocol":"MQTT","topic":"/example/state"}
          
-        Caso ocorrer algum erro durante a conversão, retorna um JSON vazio:
+        Caso ocorrer algum erro durante a conversão, retorna None.
+    """
+    encoded = serialize_bytes(data)
+    return encoded.decode("utf-8") if encoded is not None else None
 
-        {}
+def serialize_bytes(data: dict) -> bytes | None:
+    """Converte um dicionário em JSON já codificado em UTF-8.
+
+    É a versão usada pelos handlers, que escrevem bytes direto na porta/broker.
+
+    Returns:
+        Os bytes do JSON em caso de sucesso, None caso ocorra algum erro.
     """
     try:
-        return json.dumps(data)
+        return _dumps(data)
     except (TypeError, ValueError) as e:
         logger.error("Erro ao serializar o dicionário: %s", e)
+        return None
 
-def deserialize(data_string: str) -> dict | None:
+def deserialize(data_string: str | bytes | bytearray | memoryview) -> dict | None:
     """Converte uma string JSON em um dicionário de informações.
     
     Args:
-        data_string: Uma string JSON com dados de um dispositivo.
+        data_string: Uma string (ou bytes) JSON com dados de um dispositivo.
     
     Returns:
         Um dicionário em caso de sucesso:
@@ -81,10 +338,10 @@ def deserialize(data_string: str) -> dict | None:
         Caso ocorrer algum erro durante a conversão, retorna um None.
     """
     try:
-        return json.loads(data_string)
-    except json.JSONDecodeError as e:
+        return _loads(data_string)
+    except ValueError as e:
         logger.error("Erro ao converter string em dicionário: %s", e)
         return None
     except Exception as e:
         logger.error("Erro inesperado: %s", e)
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,151 @@
+"""Loop de eventos do Dispatcher.
+
+Substitui a varredura periódica dos handlers (read() + sleep) por um loop orientado
+a eventos. Cada handler expõe um descritor de arquivo através de fileno(): a porta
+serial usa o próprio descritor do pySerial e o MQTT usa um pipe interno que é
+sinalizado pelos callbacks da paho. O loop fica parado em select() enquanto nada
+chega e, ao acordar, esvazia todos os handlers prontos na mesma passada.
+
+Handlers sem fileno() continuam funcionando, mas são consultados periodicamente
+a cada `poll_interval` segundos.
+
+Exemplo de uso:
+
+    loop = EventLoop(on_message=lambda msg: dispatch(msg, registry, handlers))
+    loop.register("espnow", SerialHandler("/dev/ttyAMA2", 9600))
+    loop.run_forever()
+"""
+
+import logging
+import selectors
+import time
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class EventLoop:
+    def __init__(self, on_message, max_batch: int = 64, poll_interval: float = 0.1, on_flush=None):
+        """Cria o seletor usado para monitorar os handlers.
+
+        Args:
+            on_message: Função chamada para cada mensagem lida, deve esperar o dicionário
+                da mensagem.
+            max_batch: Quantidade máxima de mensagens lidas de um mesmo handler em uma
+                passada, evita que uma porta muito ativa monopolize o loop.
+            poll_interval: Intervalo de consulta dos handlers que não possuem fileno().
+            on_flush: Função opcional chamada ao fim de cada passada com mensagens,
+                para quem acumula mensagens em lotes (ex.: utils.sharding).
+        """
+        self._selector = selectors.DefaultSelector()
+        self._on_message = on_message
+        self._max_batch = max_batch
+        self._poll_interval = poll_interval
+        self._on_flush = on_flush
+
+        self._polled: dict = {}
+        self._running = False
+
+        # Handlers que atingiram max_batch e podem ter mensagens já lidas da porta.
+        self._backlog: dict = {}
+
+    def register(self, name: str, handler):
+        """Registra um handler no loop.
+
+        Se o handler possuir fileno(), o loop só irá acordá-lo quando houver dados
+        disponíveis. Do contrário, o handler é consultado periodicamente.
+
+        Args:
+            name: Nome do handler, usado apenas nos logs.
+            handler: Um handler no padrão da Bifrost (read(), send(), close()).
+        """
+        try:
+            fd = handler.fileno()
+        except (AttributeError, OSError, ValueError):
+            logger.warning("[LOOP] Handler '%s' sem descritor, será consultado a cada %.3fs", name, self._poll_interval)
+            self._polled[name] = handler
+            return
+
+        self._selector.register(fd, selectors.EVENT_READ, (name, handler))
+        logger.debug("[LOOP] Handler '%s' registrado no descritor %s", name, fd)
+
+    def run_once(self, timeout: float | None = None):
+        """Aguarda eventos e esvazia todos os handlers prontos.
+
+        Args:
+            timeout: Tempo máximo de espera. Se None, espera indefinidamente (ou até o
+                próximo poll, caso existam handlers sem descritor).
+        """
+        if self._backlog:
+            timeout = 0
+        elif self._polled and (timeout is None or timeout > self._poll_interval):
+            timeout = self._poll_interval
+
+        ready = dict(self._backlog)
+        self._backlog.clear()
+
+        for key, _ in self._selector.select(timeout):
+            name, handler = key.data
+            ready[name] = handler
+
+        ready.update(self._polled)
+        received = 0
+
+        for name, handler in ready.items():
+            count = self._drain(name, handler)
+            received += count
+
+            if count >= self._max_batch:
+                self._backlog[name] = handler
+
+        if received and self._on_flush is not None:
+            try:
+                self._on_flush()
+            except Exception:
+                logger.exception("[LOOP] Erro ao esvaziar os lotes")
+
+    def run_forever(self):
+        """Executa o loop até que stop() seja chamado."""
+        self._running = True
+
+        while self._running:
+            self.run_once()
+
+    def stop(self):
+        """Encerra o loop ao final da passada atual."""
+        self._running = False
+
+    def close(self):
+        """Fecha o seletor, os handlers devem ser fechados por quem os criou."""
+        self._selector.close()
+
+    def _drain(self, name: str, handler) -> int:
+        """Lê as mensagens disponíveis em um handler, até o limite de max_batch.
+
+        Usa read_batch() quando o handler oferece leitura em lote, do contrário chama
+        read() até que não existam mais mensagens.
+        """
+        read_batch = getattr(handler, "read_batch", None)
+        start = time.perf_counter()
+
+        if read_batch is not None:
+            messages = read_batch(self._max_batch)
+        else:
+            messages = []
+            while len(messages) < self._max_batch:
+                message = handler.read()
+                if not message:
+                    break
+                messages.append(message)
+
+        if messages:
+            metrics.observe("read", time.perf_counter() - start, protocol=name)
+            metrics.inc("messages", len(messages), protocol=name)
+
+        for message in messages:
+            try:
+                self._on_message(message)
+            except Exception:
+                logger.exception("[LOOP] Erro ao despachar mensagem de '%s': %s", name, message)
+
+        return len(messages)
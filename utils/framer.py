@@ -0,0 +1,140 @@
+"""Separação incremental de quadros em um fluxo de bytes.
+
+As portas seriais entregam bytes sem respeitar os limites das mensagens: uma leitura
+pode trazer meia mensagem, várias mensagens ou lixo. O LineFramer acumula esses bytes
+e devolve todos os quadros completos (terminados pelo delimitador) como memoryviews,
+sem copiar cada quadro. Quadros incompletos ficam guardados até a próxima leitura.
+
+Opcionalmente, quadros binários com tamanho prefixado (formato compacto, ver
+utils.compact) podem circular no mesmo fluxo: um quadro que começa com `binary_magic`
+é separado pelo tamanho informado em vez do delimitador.
+
+Exemplo de uso:
+
+    framer = LineFramer()
+    framer.feed(b'{"src": "a"}\\n{"sr')   # [memoryview(b'{"src": "a"}')]
+    framer.feed(b'c": "b"}\\n')            # [memoryview(b'{"src": "b"}')]
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = b" \t\r\n\x00"
+
+class LineFramer:
+    def __init__(self, delimiter: bytes = b"\n", max_frame: int = 4096, binary_magic: int | None = None, frame_length=None):
+        """Cria um framer vazio.
+
+        Args:
+            delimiter: Byte que encerra cada quadro.
+            max_frame: Tamanho máximo de um quadro. Se o buffer passar disso sem
+                encontrar o delimitador, o conteúdo é descartado como lixo.
+            binary_magic: Primeiro byte dos quadros binários, None desativa.
+            frame_length: Função (dados, início) -> tamanho total do quadro binário, ou
+                None se o cabeçalho ainda estiver incompleto.
+        """
+        self.delimiter = delimiter
+        self.max_frame = max_frame
+        self.binary_magic = binary_magic
+        self.frame_length = frame_length
+
+        self.discarded = 0
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[memoryview]:
+        """Adiciona bytes recebidos e retorna todos os quadros completos.
+
+        Os quadros retornados não incluem o delimitador nem espaços nas pontas. Eles
+        apontam para um bloco imutável, então podem ser guardados sem cuidado extra.
+
+        Args:
+            data: Bytes lidos da porta.
+
+        Returns:
+            Lista (possivelmente vazia) de memoryviews, uma para cada quadro.
+        """
+        if self._buffer:
+            self._buffer += data
+
+            # Sem quadros binários, só vale a pena copiar o buffer se uma linha fechou.
+            if self.binary_magic is None and self._buffer.rfind(self.delimiter) < 0:
+                self._check_overflow()
+                return []
+
+            # Uma única cópia por leitura, para todos os quadros completos.
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            # Sem resto anterior: os quadros apontam direto para os bytes lidos.
+            chunk = data
+
+        frames, consumed = self._split(chunk)
+
+        if consumed < len(chunk):
+            self._buffer += chunk[consumed:]
+            self._check_overflow()
+
+        return frames
+
+    def reset(self) -> None:
+        """Descarta o quadro parcial guardado."""
+        self._buffer.clear()
+
+    def _split(self, chunk: bytes) -> tuple[list[memoryview], int]:
+        """Separa o bloco em quadros, retornando fatias sem cópia e o total consumido."""
+        view = memoryview(chunk)
+        size = len(chunk)
+        frames = []
+        start = 0
+
+        while start < size:
+            if chunk[start] in _WHITESPACE:
+                start += 1
+                continue
+
+            if self.binary_magic is not None and chunk[start] == self.binary_magic:
+                try:
+                    length = self.frame_length(chunk, start)
+                except ValueError:
+                    length = 0
+
+                if length is None:
+                    break
+
+                # Tamanho absurdo: o byte mágico era lixo, procura o próximo quadro.
+                if not length or length > self.max_frame:
+                    self.discarded += 1
+                    start += 1
+                    continue
+
+                if start + length > size:
+                    break
+
+                frames.append(view[start:start + length])
+                start += length
+                continue
+
+            stop = chunk.find(self.delimiter, start)
+            if stop < 0:
+                break
+
+            last = stop
+            while last > start and chunk[last - 1] in _WHITESPACE:
+                last -= 1
+
+            if last - start > self.max_frame:
+                self.discarded += 1
+            else:
+                frames.append(view[start:last])
+
+            start = stop + 1
+
+        return frames, start
+
+    def _check_overflow(self) -> None:
+        """Descarta o buffer se ele passar de max_frame sem um quadro completo."""
+        if len(self._buffer) > self.max_frame:
+            logger.debug("Quadro maior que %d bytes descartado", self.max_frame)
+            self.discarded += 1
+            self._buffer.clear()
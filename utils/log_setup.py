@@ -0,0 +1,170 @@
+"""Configuração dos logs do Dispatcher.
+
+Aplica o dicionário de config/logs.toml (logging.config.dictConfig) e, se a seção
+[queue] estiver ativa, tira a formatação e a escrita dos logs da thread de roteamento:
+os handlers configurados passam a ser chamados por uma única thread (QueueListener),
+e os loggers só montam a mensagem com os argumentos e colocam o registro em uma fila. Com a fila cheia, os registros são
+descartados e contados, o Dispatcher nunca espera pelo cartão SD.
+
+    [queue]
+    enabled = true
+    size = 10000
+
+Logs de DEBUG por dispositivo podem ser limitados com RateLimitFilter: cada
+dispositivo (o `extra={"device": ...}` do registro) tem um token bucket próprio, e
+os registros acima do limite são descartados antes mesmo de entrar na fila.
+
+    [filters.por_dispositivo]
+    "()" = "utils.log_setup.RateLimitFilter"
+    rate = 1.0
+    burst = 5
+
+Exemplo de uso:
+
+    listener = configure_logging(load_config("config/logs.toml"))
+    ...
+    stop_logging(listener)
+"""
+
+import copy
+import logging
+import logging.config
+import logging.handlers
+import queue
+import time
+
+# Usado só para formatar tracebacks em _QueueHandler.prepare().
+_formatter = logging.Formatter()
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float = 1.0, burst: int = 5, level: str | int = "DEBUG", max_keys: int = 4096):
+        """Limita os registros de cada dispositivo.
+
+        Args:
+            rate: Registros por segundo liberados para cada dispositivo.
+            burst: Registros liberados de uma vez.
+            level: Só registros até este nível são limitados, avisos e erros passam sempre.
+            max_keys: Dispositivos acompanhados, ao atingir o limite a contagem recomeça.
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self.max_keys = max_keys
+
+        self.suppressed = 0
+        self._buckets: dict[str, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        device = getattr(record, "device", None)
+        if device is None or record.levelno > self.level:
+            return True
+
+        now = time.monotonic()
+        bucket = self._buckets.get(device)
+
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.clear()
+            bucket = self._buckets[device] = [float(self.burst), now]
+
+        tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+
+        if tokens < 1.0:
+            bucket[0] = tokens
+            self.suppressed += 1
+            return False
+
+        bucket[0] = tokens - 1.0
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Coloca o registro na fila, junto dos handlers de destino."""
+
+    def __init__(self, log_queue: queue.Queue, targets: tuple):
+        super().__init__(log_queue)
+        self.targets = targets
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Como no QueueHandler da stdlib, a mensagem é montada aqui: os argumentos (envelopes,
+        # dicionários) podem mudar antes do listener formatar o registro. O traceback vai
+        # pronto em exc_text, que os formatters dos handlers de destino ainda acrescentam.
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _formatter.formatException(record.exc_info)
+
+        # Cópia: o mesmo registro passa pelo QueueHandler de cada logger ancestral.
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.log_targets = self.targets
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Entrega cada registro apenas aos handlers do logger que o gerou."""
+
+    def handle(self, record: logging.LogRecord) -> None:
+        for handler in getattr(record, "log_targets", self.handlers):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+def configure_logging(config: dict) -> logging.handlers.QueueListener | None:
+    """Aplica a configuração dos logs.
+
+    Args:
+        config: Dicionário no formato do dictConfig, com a seção opcional [queue].
+
+    Returns:
+        O QueueListener iniciado, ou None se os logs forem síncronos.
+    """
+    config = dict(config)
+    queue_config = config.pop("queue", None) or {}
+
+    logging.config.dictConfig(config)
+
+    if not queue_config.get("enabled"):
+        return None
+
+    log_queue = queue.Queue(queue_config.get("size") or 10_000)
+
+    loggers = [logging.getLogger()]
+    loggers += [logging.getLogger(name) for name in (config.get("loggers") or {}) if name != "root"]
+
+    # Loggers com o mesmo conjunto de handlers compartilham o QueueHandler.
+    queue_handlers: dict[tuple, _QueueHandler] = {}
+    all_handlers = []
+
+    for target in loggers:
+        handlers = tuple(target.handlers)
+        if not handlers:
+            continue
+
+        queue_handler = queue_handlers.get(handlers)
+        if queue_handler is None:
+            queue_handler = queue_handlers[handlers] = _QueueHandler(log_queue, handlers)
+
+        for handler in handlers:
+            target.removeHandler(handler)
+            if handler not in all_handlers:
+                all_handlers.append(handler)
+
+        target.addHandler(queue_handler)
+
+    listener = _QueueListener(log_queue, *all_handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def stop_logging(listener: logging.handlers.QueueListener | None) -> None:
+    """Escreve os registros que ainda estão na fila e encerra a thread dos logs."""
+    if listener is not None:
+        listener.stop()
@@ -0,0 +1,419 @@
+"""Métricas do Dispatcher: contadores e histogramas de latência por etapa.
+
+Cada etapa do caminho de uma mensagem registra o tempo gasto em um histograma,
+separado por protocolo e, quando faz sentido, por dispositivo:
+
+    read     -- leitura de um handler (read_batch), por porta
+    parse    -- conversão de um quadro em envelope, por protocolo
+    lookup   -- consulta da rota/registro no dispatch, por protocolo de origem
+    send     -- entrega ao handler de destino (handleMessage), por protocolo e destino
+    db       -- escrita de um lote no InfluxDB
+    dispatch -- dispatch completo de uma mensagem, por protocolo e remetente
+    outbound -- envios pedidos pelos processos do modo shards, por handler
+
+Os histogramas são log-lineares, no estilo do HdrHistogram: 32 faixas por potência
+de 2, em nanossegundos, o que dá um erro relativo de no máximo ~3% em qualquer
+percentil, com memória proporcional às faixas usadas. Registrar um valor custa uma
+conta de bits e um incremento de dicionário.
+
+As métricas podem ser lidas de três formas:
+    - texto no formato do Prometheus, em http://<host>:<porta>/metrics;
+    - o mesmo texto em um socket UNIX local (basta conectar e ler);
+    - um resumo JSON publicado periodicamente no MQTT (bifrost/central/metrics).
+
+Outros componentes que já mantêm contadores (fila do InfluxDB, filas das portas,
+tabela de rotas...) entram como coletores, chamados apenas na hora da leitura.
+
+Sem trava no caminho quente: com mais de um roteador, incrementos simultâneos podem
+se perder, o que é aceitável para métricas. A trava só protege a criação de séries e
+as leituras, que copiam histogramas e contadores com ela e formatam as cópias fora
+dela, já que observe() e inc() continuam criando chaves enquanto a leitura acontece.
+
+Exemplo de uso:
+
+    from utils.metrics import metrics
+
+    start = time.perf_counter()
+    handler.handleMessage(...)
+    metrics.observe("send", time.perf_counter() - start, protocol="espnow", device="display")
+
+    metrics.add_collector("influx", writer_stats)
+    metrics.start_http_server("127.0.0.1", 9108)
+"""
+
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.envelope import serialize_bytes
+
+logger = logging.getLogger(__name__)
+
+# Faixas por potência de 2 (2**5 = 32, erro relativo <= 1/32)
+_SUB_BITS = 5
+_SUB_COUNT = 1 << _SUB_BITS
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Rótulo usado quando o limite de séries é atingido
+OTHER = "other"
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, nanos: int) -> None:
+        """Registra um valor em nanossegundos."""
+        counts = self.counts
+        index = _index(nanos)
+        counts[index] = counts.get(index, 0) + 1
+
+        self.count += 1
+        self.total += nanos
+        if nanos > self.max:
+            self.max = nanos
+
+    def percentile(self, quantile: float) -> int:
+        """Retorna o valor (ns) abaixo do qual estão `quantile` dos registros.
+
+        O valor é o limite superior da faixa, então nunca subestima a latência.
+        """
+        if not self.count:
+            return 0
+
+        target = quantile * self.count
+        seen = 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_upper_bound(index), self.max)
+
+        return self.max
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram()
+        histogram.counts = dict(self.counts)
+        histogram.count, histogram.total, histogram.max = self.count, self.total, self.max
+        return histogram
+
+    def merge(self, other: "Histogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+def _index(nanos: int) -> int:
+    """Faixa do valor: exata até 63, depois 32 faixas por potência de 2."""
+    if nanos < _SUB_COUNT * 2:
+        return nanos if nanos > 0 else 0
+
+    shift = nanos.bit_length() - _SUB_BITS - 1
+    return shift * _SUB_COUNT + (nanos >> shift)
+
+def _upper_bound(index: int) -> int:
+    """Maior valor (ns) que cai na faixa `index`."""
+    if index < _SUB_COUNT * 2:
+        return index
+
+    shift = index // _SUB_COUNT - 1
+    mantissa = index - shift * _SUB_COUNT
+    return ((mantissa + 1) << shift) - 1
+
+class Metrics:
+    def __init__(self, enabled: bool = True, max_series: int = 4096):
+        """Cria um conjunto vazio de métricas.
+
+        Args:
+            enabled: Com False, observe() e inc() não fazem nada.
+            max_series: Limite de combinações de rótulos. Acima dele, novos
+                dispositivos são agrupados no rótulo "other".
+        """
+        self.enabled = enabled
+        self.max_series = max_series
+
+        self.started = time.time()
+
+        # (etapa, protocolo, dispositivo) -> Histogram
+        self._histograms: dict[tuple, Histogram] = {}
+        # (nome, protocolo, dispositivo) -> int
+        self._counters: dict[tuple, int] = {}
+        # nome -> função sem argumentos que retorna {chave: número}
+        self._collectors: dict[str, object] = {}
+
+        # Criação de séries e leituras, ver o docstring do módulo.
+        self._lock = threading.Lock()
+
+        self._servers: list = []
+        self._publisher: threading.Thread | None = None
+        self._stop_event = threading.Event()
+
+    def observe(self, stage: str, seconds: float, protocol: str | None = None, device: str | None = None) -> None:
+        """Registra a duração de uma etapa."""
+        if not self.enabled:
+            return
+
+        histogram = self._histograms.get((stage, protocol, device))
+        if histogram is None:
+            histogram = self._new_series(self._histograms, (stage, protocol, device), Histogram)
+
+        # Histogram.record() escrito aqui mesmo, esta é a função mais chamada do Dispatcher.
+        nanos = int(seconds * 1_000_000_000)
+        index = _index(nanos) if nanos >= _SUB_COUNT * 2 else max(nanos, 0)
+
+        counts = histogram.counts
+        counts[index] = counts.get(index, 0) + 1
+        histogram.count += 1
+        histogram.total += nanos
+        if nanos > histogram.max:
+            histogram.max = nanos
+
+    def inc(self, name: str, value: int = 1, protocol: str | None = None, device: str | None = None) -> None:
+        """Soma `value` a um contador."""
+        if not self.enabled:
+            return
+
+        key = (name, protocol, device)
+        counters = self._counters
+
+        if key not in counters:
+            with self._lock:
+                if len(counters) >= self.max_series:
+                    key = (name, protocol, OTHER)
+                counters[key] = counters.get(key, 0) + value
+            return
+
+        counters[key] = counters.get(key, 0) + value
+
+    def add_collector(self, name: str, function) -> None:
+        """Cadastra uma função que retorna contadores já mantidos por outro componente.
+
+        Args:
+            name: Prefixo das métricas (ex.: "influx" gera bifrost_influx_<chave>).
+            function: Função sem argumentos que retorna um dicionário {chave: número}.
+        """
+        self._collectors[name] = function
+
+    def _new_series(self, series: dict, key: tuple, factory):
+        with self._lock:
+            if len(series) >= self.max_series:
+                key = (key[0], key[1], OTHER)
+
+            # Outra thread pode ter criado a série enquanto esta esperava a trava.
+            existing = series.get(key)
+            if existing is not None:
+                return existing
+
+            value = series[key] = factory()
+            return value
+
+    def reset(self) -> None:
+        """Zera histogramas e contadores, mantendo coletores e servidores."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    def merge(self, histograms: dict[tuple, Histogram], counters: dict[tuple, int]) -> None:
+        """Soma histogramas e contadores coletados em outro processo (modo shards)."""
+        for key, histogram in histograms.items():
+            existing = self._histograms.get(key)
+            if existing is None:
+                existing = self._new_series(self._histograms, key, Histogram)
+            existing.merge(histogram)
+
+        for (name, protocol, device), value in counters.items():
+            self.inc(name, value, protocol=protocol, device=device)
+
+    def histograms(self) -> dict[tuple, Histogram]:
+        """Cópia dos histogramas, que podem ser lidos enquanto observe() continua."""
+        with self._lock:
+            return {key: histogram.copy() for key, histogram in list(self._histograms.items())}
+
+    def counters(self) -> dict[tuple, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def collect(self) -> dict[str, dict]:
+        """Executa os coletores, ignorando os que falharem."""
+        values = {}
+
+        for name, function in list(self._collectors.items()):
+            try:
+                values[name] = function() or {}
+            except Exception:
+                logger.exception("[METRICS] Erro no coletor '%s'", name)
+
+        return values
+
+    def render_prometheus(self) -> str:
+        """Retorna todas as métricas no formato texto do Prometheus."""
+        lines = [
+            "# TYPE bifrost_uptime_seconds gauge",
+            f"bifrost_uptime_seconds {time.time() - self.started:.0f}",
+        ]
+
+        lines.append("# TYPE bifrost_stage_latency_seconds summary")
+        for (stage, protocol, device), histogram in sorted(self.histograms().items(), key=_sort_key):
+            labels = _labels(stage=stage, protocol=protocol, device=device)
+            for quantile in QUANTILES:
+                value = histogram.percentile(quantile) / 1_000_000_000
+                lines.append(f'bifrost_stage_latency_seconds{{{labels},quantile="{quantile}"}} {value:.9f}')
+            lines.append(f"bifrost_stage_latency_seconds_sum{{{labels}}} {histogram.total / 1_000_000_000:.9f}")
+            lines.append(f"bifrost_stage_latency_seconds_count{{{labels}}} {histogram.count}")
+
+        counters = self.counters()
+        names = sorted({key[0] for key in counters})
+        for name in names:
+            lines.append(f"# TYPE bifrost_{name}_total counter")
+            for (counter, protocol, device), value in sorted(counters.items(), key=_sort_key):
+                if counter == name:
+                    labels = _labels(protocol=protocol, device=device)
+                    lines.append(f"bifrost_{name}_total{{{labels}}} {value}" if labels else f"bifrost_{name}_total {value}")
+
+        for collector, values in self.collect().items():
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE bifrost_{collector}_{key} gauge")
+                lines.append(f"bifrost_{collector}_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Resumo das métricas em um dicionário, usado na publicação via MQTT.
+
+        Latências em microssegundos, agrupadas por etapa e protocolo (os
+        dispositivos de uma mesma etapa são somados).
+        """
+        stages: dict[tuple, Histogram] = {}
+        for (stage, protocol, _), histogram in self.histograms().items():
+            merged = stages.setdefault((stage, protocol), Histogram())
+            merged.merge(histogram)
+
+        latency = {}
+        for (stage, protocol), histogram in sorted(stages.items(), key=_sort_key):
+            latency.setdefault(stage, {})[protocol or "all"] = {
+                "count": histogram.count,
+                "p50": round(histogram.percentile(0.5) / 1000, 1),
+                "p99": round(histogram.percentile(0.99) / 1000, 1),
+                "max": round(histogram.max / 1000, 1),
+            }
+
+        counters: dict[str, dict] = {}
+        for (name, protocol, _), value in self.counters().items():
+            group = counters.setdefault(name, {})
+            group[protocol or "all"] = group.get(protocol or "all", 0) + value
+
+        return {
+            "ts": int(time.time()),
+            "uptime": int(time.time() - self.started),
+            "latency_us": latency,
+            "counters": counters,
+            **self.collect(),
+        }
+
+    def start_http_server(self, host: str = "127.0.0.1", port: int = 9108) -> bool:
+        """Serve o texto do Prometheus em http://host:port/metrics, em uma thread."""
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("[METRICS] %s", format % args)
+
+        try:
+            server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            logger.error("[METRICS] Não foi possível abrir %s:%s: %s", host, port, e)
+            return False
+
+        self._serve(server, "metrics-http")
+        logger.info("[METRICS] Métricas em http://%s:%s/metrics", host, server.server_address[1])
+        return True
+
+    def start_unix_server(self, path: str) -> bool:
+        """Escreve o texto do Prometheus para cada conexão no socket UNIX `path`."""
+        metrics = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(metrics.render_prometheus().encode("utf-8"))
+
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = socketserver.ThreadingUnixStreamServer(path, _Handler)
+        except (OSError, AttributeError) as e:
+            logger.error("[METRICS] Não foi possível abrir o socket '%s': %s", path, e)
+            return False
+
+        self._serve(server, "metrics-unix")
+        logger.info("[METRICS] Métricas no socket '%s'", path)
+        return True
+
+    def _serve(self, server, name: str) -> None:
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+        self._servers.append(server)
+
+    def start_publisher(self, handler, interval: float = 10.0, topic: str = "bifrost/central/metrics") -> None:
+        """Publica snapshot() via MQTT a cada `interval` segundos, em uma thread.
+
+        Args:
+            handler: O MQTTHandler do Dispatcher.
+            interval: Intervalo entre publicações.
+            topic: Tópico das publicações.
+        """
+        def run():
+            while not self._stop_event.wait(interval):
+                try:
+                    handler.publish(topic, serialize_bytes(self.snapshot()))
+                except Exception:
+                    logger.exception("[METRICS] Erro ao publicar as métricas")
+
+        self._publisher = threading.Thread(target=run, name="metrics-publisher", daemon=True)
+        self._publisher.start()
+
+    def close(self) -> None:
+        """Encerra os servidores e a publicação periódica."""
+        self._stop_event.set()
+
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+        self._servers.clear()
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items() if value is not None)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _sort_key(item) -> tuple:
+    return tuple("" if part is None else str(part) for part in item[0])
+
+# Instância usada por todo o Dispatcher.
+metrics = Metrics()
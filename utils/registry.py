@@ -1,8 +1,30 @@
 """Mantém registro de dispositivos em um arquivo JSON
 
 Recebe um caminho até um arquivo json (caso não exista, será criado), onde será armazenado
-o registro de dispositivos. Todos os dispositivos são armazenados em self._registry, e esse
-dicionário local é sincronizado com o arquivo JSON sempre que um novo dispositivo é adicionado.
+o registro de dispositivos. Todos os dispositivos são armazenados em self._registry.
+
+Cada alteração vira uma linha em um journal ao lado do JSON (devices.journal), em vez de
+reescrever o arquivo inteiro. As linhas são agrupadas por uma janela curta (debounce) e
+gravadas com um único fsync. De tempos em tempos o journal é compactado: o registro
+completo é escrito em um arquivo temporário e substitui o JSON de forma atômica, então
+uma queda de energia nunca deixa o JSON pela metade. Ao iniciar, o registro é o JSON
+mais as alterações do journal. Alterações ainda dentro da janela de debounce podem ser
+perdidas numa queda, o dispositivo simplesmente se registra de novo.
+
+Para que as consultas não cresçam com o tamanho da frota, o registro mantém índices
+secundários (address -> id, topic -> id e protocolo -> ids). Toda alteração do registro
+deve passar por _index()/_unindex() para manter os índices sincronizados.
+
+Endereços MAC são guardados e buscados em maiúsculas (normalize_address), como o
+formato compacto os decodifica: "2c:f4:..." e "2C:F4:..." são o mesmo dispositivo.
+Tópicos MQTT diferenciam maiúsculas e não são alterados.
+
+Outros componentes que guardam informações derivadas do registro (como a tabela de
+rotas) podem se cadastrar com add_listener() para serem avisados de cada alteração.
+
+Sem caminho (path=None), o registro fica só em memória. É assim que os processos do
+modo shards (utils.sharding) mantêm uma réplica: recebem snapshot() ao iniciar e
+cada alteração do processo principal por apply().
 
 Exemplo de uso:
 
@@ -12,24 +34,63 @@ Exemplo de uso:
 
 import json
 import logging
+import os
+import re
+import threading
 from pathlib import Path
 
 from utils.envelope import make_envelope
 
 logger = logging.getLogger(__name__)
 
+_MAC = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$")
+
+def normalize_address(address):
+    """Endereço MAC em maiúsculas; outros endereços e tópicos voltam como vieram."""
+    if isinstance(address, str) and _MAC.match(address):
+        return address.upper()
+    return address
+
 class DeviceRegistry():
-    def __init__(self, path: str):
+    def __init__(self, path: str | None, debounce: float = 0.5, compact_after: int = 256, devices: dict | None = None):
         """Carrega e salva localmente o JSON de configuração (caso não existir, inicia um json vazio). 
 
         Args:
-            path: O caminho até o arquivo json usado para registrar.
+            path: O caminho até o arquivo json usado para registrar. Com None, o registro
+                fica apenas em memória, começando por `devices`.
+            debounce: Tempo (s) em que as alterações são agrupadas antes de irem para o
+                journal. Com 0, cada alteração é gravada na hora.
+            compact_after: Linhas no journal que disparam a compactação no JSON.
+            devices: Registro inicial {id: info}, usado apenas sem `path`.
         """
 
-        self.path = Path(path)
+        self.path = Path(path) if path is not None else None
+        self.journal_path = self.path.with_suffix(".journal") if path is not None else None
+        self.debounce = debounce
+        self.compact_after = compact_after
         self._registry: dict = {}
 
-        if self.path.exists():
+        # Alterações aguardando o journal, e linhas já gravadas desde a última compactação.
+        self._pending: list[str] = []
+        self._journal_lines = 0
+        self._timer: threading.Timer | None = None
+        self._io_lock = threading.Lock()
+
+        # Protege as alterações (registro + índices) quando há mais de um roteador.
+        self._lock = threading.RLock()
+
+        # Funções chamadas com o device_id sempre que um dispositivo muda.
+        self._listeners: list = []
+
+        # Índices secundários, sempre derivados de self._registry.
+        self._by_address: dict[str, str] = {}
+        self._by_topic: dict[str, str] = {}
+        self._by_protocol: dict[str, dict[str, dict]] = {}
+
+        if self.path is None:
+            self._registry = {device_id: dict(info) for device_id, info in (devices or {}).items()}
+
+        elif self.path.exists():
             try:
                 with self.path.open('r', encoding='utf-8') as f:
                     self._registry = json.load(f)
@@ -40,19 +101,266 @@ class DeviceRegistry():
         else:
             logger.info("Arquivo '%s' não encontrado. Criando novo registro vazio.", self.path)
             self._registry = {}
-            self.save()
+
+        # Alterações que ainda não tinham sido compactadas no JSON.
+        if self.path is not None:
+            replayed = self._replay_journal()
+
+            if replayed or not self.path.exists():
+                self.save()
+
+        self._rebuild_indexes()
+
+    def add_listener(self, callback) -> None:
+        """Cadastra uma função chamada com o device_id a cada add/update/remove."""
+        self._listeners.append(callback)
+
+    def _notify(self, device_id: str) -> None:
+        for callback in self._listeners:
+            try:
+                callback(device_id)
+            except Exception:
+                logger.exception("Erro ao notificar alteração do device '%s'", device_id)
+
+    def _rebuild_indexes(self) -> None:
+        """Reconstrói todos os índices a partir do registro local."""
+        self._by_address.clear()
+        self._by_topic.clear()
+        self._by_protocol.clear()
+
+        for device_id, info in self._registry.items():
+            self._index(device_id, info)
+
+    def _index(self, device_id: str, info: dict) -> None:
+        """Adiciona um dispositivo aos índices secundários.
+
+        Em caso de endereços duplicados, o primeiro dispositivo registrado é mantido,
+        assim como acontecia na busca linear.
+        """
+        address = normalize_address(info.get("address"))
+        if address is not None:
+            self._by_address.setdefault(address, device_id)
+
+        topic = info.get("topic")
+        if topic is not None:
+            self._by_topic.setdefault(topic, device_id)
+
+        protocol = info.get("protocol")
+        self._by_protocol.setdefault(protocol, {})[device_id] = info
+
+    def _unindex(self, device_id: str, info: dict) -> None:
+        """Remove um dispositivo dos índices secundários."""
+        address = normalize_address(info.get("address"))
+        if self._by_address.get(address) == device_id:
+            del self._by_address[address]
+            self._reindex_key("address", address, self._by_address, skip=device_id)
+
+        topic = info.get("topic")
+        if self._by_topic.get(topic) == device_id:
+            del self._by_topic[topic]
+            self._reindex_key("topic", topic, self._by_topic, skip=device_id)
+
+        devices = self._by_protocol.get(info.get("protocol"))
+        if devices is not None:
+            devices.pop(device_id, None)
+            if not devices:
+                del self._by_protocol[info.get("protocol")]
+
+    def _reindex_key(self, field: str, value: str, index: dict, skip: str) -> None:
+        """Procura outro dispositivo com o mesmo address/topic após uma remoção.
+
+        Só acontece quando existem endereços duplicados, caso raro e fora do caminho
+        de roteamento.
+        """
+        for device_id, info in self._registry.items():
+            if device_id != skip and normalize_address(info.get(field)) == value:
+                index[value] = device_id
+                return
 
     def save(self) -> None:
-        """Salva o registro local em um arquivo JSON"""
+        """Salva o registro local no arquivo JSON e esvazia o journal.
+
+        O JSON é escrito em um arquivo temporário e só então substitui o anterior
+        (os.replace), então o arquivo nunca fica pela metade.
+        """
+        if self.path is None:
+            return
+
+        with self._io_lock:
+            self._write_journal()
+            self._compact()
+
+    def flush(self) -> None:
+        """Grava imediatamente as alterações que aguardam o debounce."""
+        if self.path is None:
+            return
+
+        with self._io_lock:
+            self._write_journal()
+
+            if self._journal_lines >= self.compact_after:
+                self._compact()
+
+    def close(self) -> None:
+        """Cancela o debounce pendente e grava as alterações restantes."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        self.flush()
+
+    def _record(self, operation: str, device_id: str, info: dict | None = None) -> None:
+        """Guarda uma alteração para o journal. Deve ser chamado com self._lock adquirido."""
+        if self.path is None:
+            return
+
+        entry = {"op": operation, "id": device_id}
+        if info is not None:
+            entry["info"] = info
+
+        self._pending.append(json.dumps(entry, ensure_ascii=False))
+
+    def _schedule(self) -> None:
+        """Agenda a gravação das alterações pendentes.
+
+        Deve ser chamado sem self._lock, já que a gravação imediata adquire
+        self._io_lock e depois self._lock.
+        """
+        if self.debounce <= 0:
+            self.flush()
+            return
+
+        with self._lock:
+            if self._pending and self._timer is None:
+                self._timer = threading.Timer(self.debounce, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Falha ao gravar o journal '%s'", self.journal_path)
+
+    def _write_journal(self) -> None:
+        """Acrescenta as alterações pendentes ao journal, com um único fsync."""
+        with self._lock:
+            lines, self._pending = self._pending, []
+
+        if not lines:
+            return
+
+        try:
+            with self.journal_path.open('a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            logger.error("Falha ao gravar o journal '%s': '%s'", self.journal_path, e)
+            with self._lock:
+                self._pending[:0] = lines
+            raise
+
+        self._journal_lines += len(lines)
+        logger.debug("%d alteração(ões) gravada(s) em '%s'", len(lines), self.journal_path)
+
+    def _compact(self) -> None:
+        """Escreve o registro inteiro no JSON de forma atômica e trunca o journal.
+
+        Alterações feitas durante a compactação já estão no JSON e, se também
+        chegarem ao journal depois, são reaplicadas sem efeito ao iniciar.
+        """
+        with self._lock:
+            data = json.dumps(self._registry, indent=4, ensure_ascii=False)
+
+        temp_path = self.path.with_name(self.path.name + ".tmp")
 
         try:
-            with self.path.open('w', encoding='utf-8') as f:
-                json.dump(self._registry, f, indent=4, ensure_ascii=False)
+            with temp_path.open('w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_path, self.path)
+            _fsync_directory(self.path.parent)
+
+            with self.journal_path.open('w', encoding='utf-8') as f:
+                os.fsync(f.fileno())
+
+            self._journal_lines = 0
             logger.debug("Registro salvo com sucesso em '%s'", self.path)
         except Exception as e:
             logger.error("Falha ao salvar JSON no arquivo '%s' : '%s'", self.path, e)
             raise
 
+    def _replay_journal(self) -> int:
+        """Aplica ao registro as alterações do journal.
+
+        Uma última linha incompleta (queda durante a escrita) é ignorada.
+
+        Returns:
+            Quantidade de alterações aplicadas.
+        """
+        if not self.journal_path.exists():
+            return 0
+
+        applied = 0
+
+        with self.journal_path.open('r', encoding='utf-8') as f:
+            for number, line in enumerate(f, start=1):
+                try:
+                    entry = json.loads(line)
+                    operation, device_id = entry["op"], entry["id"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    logger.warning("Linha %d inválida no journal '%s', ignorada", number, self.journal_path)
+                    continue
+
+                if operation == "set":
+                    self._registry[device_id] = entry.get("info") or {}
+                elif operation == "del":
+                    self._registry.pop(device_id, None)
+                else:
+                    continue
+
+                applied += 1
+
+        if applied:
+            logger.info("%d alteração(ões) recuperada(s) do journal '%s'", applied, self.journal_path)
+
+        return applied
+
+    def snapshot(self) -> dict[str, dict]:
+        """Retorna uma cópia do registro inteiro {id: info}."""
+        with self._lock:
+            return {device_id: dict(info) for device_id, info in self._registry.items()}
+
+    def apply(self, device_id: str, info: dict | None) -> None:
+        """Aplica uma alteração feita em outro registro (réplica do modo shards).
+
+        Args:
+            device_id: Dispositivo alterado.
+            info: Informações novas do dispositivo, ou None se ele foi removido.
+        """
+        with self._lock:
+            old = self._registry.pop(device_id, None)
+            if old is not None:
+                self._unindex(device_id, old)
+
+            if info is not None:
+                self._registry[device_id] = info
+                self._index(device_id, info)
+                self._record("set", device_id, info)
+            else:
+                self._record("del", device_id)
+
+            self._notify(device_id)
+
+        self._schedule()
+
     def get_by_id(self, device_id: str) -> dict | None:
         """Retorna dicionário com informações de dispositivos cadastrados
         
@@ -82,10 +390,27 @@ class DeviceRegistry():
         Se não existir, retorna None
 
         """
-        for id, info in self._registry.items():
-            if info.get("address") == address or info.get("topic") == address:
-                return info
-        return None
+        device_id = self.get_id_by_address(address)
+
+        if device_id is None:
+            return None
+        return self._registry.get(device_id)
+
+    def get_id_by_address(self, address: str) -> str | None:
+        """Retorna o id do dispositivo cadastrado com o adress/topic, ou None."""
+        device_id = self._by_address.get(address) or self._by_topic.get(address)
+
+        # MAC em minúsculas: só normaliza quando a busca direta falha (caminho raro).
+        if device_id is None and address.__class__ is str and not address.isupper():
+            device_id = self._by_address.get(normalize_address(address))
+        return device_id
+
+    def get_by_protocol(self, protocol: str) -> dict[str, dict]:
+        """Retorna um dicionário {id: info} com os dispositivos de um protocolo.
+
+        O dicionário retornado é o próprio índice interno e não deve ser alterado.
+        """
+        return self._by_protocol.get(protocol, {})
 
     def add(self, device_id: str, address: str, protocol: str, **kwargs) -> dict:
         """ Adiciona um dispositivo no registro de dispositivos.
@@ -102,27 +427,104 @@ class DeviceRegistry():
 
         """
 
-        if device_id in self._registry:
-            logger.info("Device '%s' já existe no registro, não irá registrar.", device_id)
+        with self._lock:
+            if device_id in self._registry:
+                logger.info("Device '%s' já existe no registro, não irá registrar.", device_id)
             
-            response = {
-                "status": "already_registered",
-                "device_id": device_id
-            }
+                response = {
+                    "status": "already_registered",
+                    "device_id": device_id
+                }
 
-        else:
-            self._registry[device_id] = {
-                "address": address,
-                "protocol": protocol,
-                **kwargs
-            }
+            else:
+                # Dispositivos MQTT são encontrados pelo tópico, os demais pelo endereço.
+                if protocol == "MQTT":
+                    key, value = "topic", address
+                else:
+                    key, value = "address", normalize_address(address)
+
+                self._registry[device_id] = {
+                    key: value,
+                    "protocol": protocol,
+                    **kwargs
+                }
+                self._index(device_id, self._registry[device_id])
+
+                self._record("set", device_id, self._registry[device_id])
+                logger.info("Device '%s' foi registrado!", device_id)
+                self._notify(device_id)
+
+                response = {
+                    "status": "success",
+                    "device_id": device_id
+                }
+
+        self._schedule()
+        return make_envelope(src = "central", dst = address, msg_type = "register_response", payload = response);
+
+    def update(self, device_id: str, **fields) -> dict | None:
+        """Atualiza os campos de um dispositivo já cadastrado.
+
+        Args:
+            device_id: id do dispositivo que será atualizado.
+            **fields: campos que serão sobrescritos (address, topic, protocol...).
+
+        Returns:
+            O dicionário atualizado do dispositivo, ou None se ele não existir.
+        """
+        with self._lock:
+            info = self._registry.get(device_id)
+
+            if info is None:
+                logger.info("Device '%s' não existe no registro, não irá atualizar.", device_id)
+                return None
+
+            if "address" in fields:
+                fields["address"] = normalize_address(fields["address"])
+
+            self._unindex(device_id, info)
+            info.update(fields)
+            self._index(device_id, info)
+
+            self._record("set", device_id, info)
+            logger.info("Device '%s' foi atualizado!", device_id)
+            self._notify(device_id)
+
+        self._schedule()
+        return info
+
+    def remove(self, device_id: str) -> bool:
+        """Remove um dispositivo do registro.
+
+        Returns:
+            True se o dispositivo foi removido, False se ele não existia.
+        """
+        with self._lock:
+            info = self._registry.pop(device_id, None)
+
+            if info is None:
+                logger.info("Device '%s' não existe no registro, não irá remover.", device_id)
+                return False
+
+            self._unindex(device_id, info)
+
+            self._record("del", device_id)
+            logger.info("Device '%s' foi removido!", device_id)
+            self._notify(device_id)
 
-            self.save()
-            logger.info("Device '%s' foi registrado!", device_id)
+        self._schedule()
+        return True
 
-            response = {
-                "status": "success",
-                "device_id": device_id
-            }
+def _fsync_directory(directory: Path) -> None:
+    """Garante que a troca de nomes do os.replace chegou ao disco."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
 
-        return make_envelope(src = "central", dst = address, msg_type = "register_response", payload = response);
\ No newline at end of file
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,139 @@
+"""Tabela de rotas compilada do Dispatcher.
+
+Para cada par (endereço do remetente, id do destino) já visto, guarda o resultado
+de todas as consultas que o dispatch faria: handler de destino, informações do
+destinatário, endereço resolvido e o measurement do InfluxDB. O caminho principal
+passa a ser uma única consulta de dicionário por mensagem.
+
+As rotas são invalidadas de forma incremental: a tabela se cadastra como listener
+do DeviceRegistry e, quando um dispositivo muda, descarta apenas as rotas em que ele
+aparece como remetente ou destino. Falhas (remetente ou destino desconhecido) não
+são guardadas, o dispatch segue pelo caminho completo nesses casos.
+
+Com mais de um roteador (router_workers), rotas são compiladas em paralelo com as
+invalidações do registro. A consulta de uma rota já guardada continua sem trava;
+gravar, invalidar e esvaziar a tabela acontecem sob uma trava, e uma rota compilada
+enquanto alguma invalidação acontecia é devolvida, mas não guardada.
+
+Exemplo de uso:
+
+    routes = RouteTable(registry, handlers)
+    route = routes.lookup("2C:F4:32:16:F5:17", "termohigrometro-MQTT")
+    if route is not None:
+        route.handler.handleMessage(destination_info=route.destination_info, message=message)
+"""
+
+import logging
+import threading
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+class Route(NamedTuple):
+    handler: object
+    destination_info: dict
+    address: str | None
+    protocol: str
+    measurement: str | None
+
+class RouteTable:
+    def __init__(self, registry, handlers: dict, max_routes: int = 65_536):
+        """Cria uma tabela vazia, preenchida sob demanda por lookup().
+
+        Args:
+            registry: O DeviceRegistry do Dispatcher.
+            handlers: Dicionário protocolo -> handler.
+            max_routes: Limite de rotas guardadas, ao atingir a tabela é esvaziada.
+        """
+        self.registry = registry
+        self.handlers = handlers
+        self.max_routes = max_routes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._routes: dict[tuple[str, str], Route] = {}
+        self._by_device: dict[str, set[tuple[str, str]]] = {}
+
+        # Gravações e invalidações. A geração muda a cada invalidação.
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        registry.add_listener(self.invalidate)
+
+    def lookup(self, source_address: str, destination_id: str) -> Route | None:
+        """Retorna a rota do remetente até o destino, compilando se necessário.
+
+        Returns:
+            A Route, ou None se o remetente ou o destino não estiverem cadastrados, ou
+            se não houver handler para o protocolo do destino.
+        """
+        route = self._routes.get((source_address, destination_id))
+
+        if route is not None:
+            self.hits += 1
+            return route
+
+        self.misses += 1
+        return self._compile(source_address, destination_id)
+
+    def invalidate(self, device_id: str) -> None:
+        """Descarta as rotas em que o dispositivo aparece como remetente ou destino."""
+        with self._lock:
+            self._generation += 1
+            for key in self._by_device.pop(device_id, ()):
+                self._routes.pop(key, None)
+
+    def stats(self) -> dict:
+        """Contadores: consultas resolvidas pela tabela, compilações e rotas guardadas."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._routes)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._generation += 1
+        self._routes.clear()
+        self._by_device.clear()
+
+    def _compile(self, source_address: str, destination_id: str) -> Route | None:
+        generation = self._generation
+
+        source_id = self.registry.get_id_by_address(source_address)
+        if source_id is None:
+            return None
+
+        source_info = self.registry.get_by_id(source_id)
+        destination_info = self.registry.get_by_id(destination_id)
+        if not destination_info:
+            return None
+
+        protocol = destination_info.get("protocol")
+        handler = self.handlers.get(protocol)
+        if handler is None:
+            return None
+
+        route = Route(
+            handler=handler,
+            destination_info=destination_info,
+            address=destination_info.get("address") or destination_info.get("topic"),
+            protocol=protocol,
+            measurement=source_info.get("device_type"),
+        )
+
+        with self._lock:
+            # O registro mudou durante a compilação: a rota pode estar velha, não guarda.
+            if generation != self._generation:
+                return route
+
+            if len(self._routes) >= self.max_routes:
+                logger.debug("[ROUTES] Limite de %d rotas atingido, esvaziando a tabela", self.max_routes)
+                self._clear()
+
+            key = (source_address, destination_id)
+            self._routes[key] = route
+            self._by_device.setdefault(source_id, set()).add(key)
+            self._by_device.setdefault(destination_id, set()).add(key)
+
+        return route
@@ -0,0 +1,233 @@
+"""Regras de roteamento declarativas do Dispatcher.
+
+Além do destino (`dst`) de cada mensagem, o Dispatcher pode encaminhar cópias para
+outros lugares seguindo regras lidas de um TOML (config/routes.toml). Cada regra
+filtra por protocolo, tipo, remetente e chaves do payload, e lista os sinks para
+onde a mensagem vai:
+
+    [[rules]]
+    name = "espelho-telemetria"
+    protocol = "+"
+    type = "state"
+    src = "#"
+    sinks = [
+      { mqtt = "bifrost/{protocol}/{id}/telemetry" },
+      { influxdb = true },
+    ]
+
+Os filtros usam os coringas do MQTT sobre o "tópico" `<protocol>/<type>/<src>`:
+"+" casa com um nível e "#" com o resto. Como tópicos MQTT também são remetentes,
+`src` pode ter vários níveis ("sensores/#"). Filtros omitidos casam com tudo.
+
+Sinks disponíveis:
+    device   -- entrega a um dispositivo do registro, pelo id.
+    mqtt     -- publica a mensagem inteira no tópico (aceita {src}, {dst}, {type},
+                {protocol} e {id}, o id do remetente).
+    influxdb -- grava no InfluxDB, no measurement informado ou no tipo do remetente.
+    drop     -- descarta a mensagem: os sinks seguintes e o roteamento pelo `dst`
+                não acontecem.
+
+As regras são compiladas em uma trie, nível a nível, então o custo de uma consulta
+depende da profundidade do tópico e não da quantidade de regras. O resultado de
+cada combinação (protocol, type, src) ainda fica em cache.
+
+Exemplo de uso:
+
+    rules = load_rules("config/routes.toml")
+    for rule in rules.match(message):
+        for sink in rule.sinks:
+            ...
+"""
+
+import logging
+from typing import NamedTuple
+
+from utils.config_loader import load_config
+
+logger = logging.getLogger(__name__)
+
+SINK_DEVICE = "device"
+SINK_MQTT = "mqtt"
+SINK_INFLUXDB = "influxdb"
+SINK_DROP = "drop"
+
+SINK_KINDS = (SINK_DEVICE, SINK_MQTT, SINK_INFLUXDB, SINK_DROP)
+
+class Sink(NamedTuple):
+    kind: str
+    target: str | None
+
+class Rule(NamedTuple):
+    name: str
+    order: int
+    payload: tuple[str, ...]
+    sinks: tuple[Sink, ...]
+
+class _Node:
+    __slots__ = ("children", "rules", "tail")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.rules: list[Rule] = []   # Regras que terminam exatamente neste nível
+        self.tail: list[Rule] = []    # Regras terminadas em "#" a partir deste nível
+
+class RuleSet:
+    def __init__(self, rules: list[dict] | None = None, cache_size: int = 4096):
+        """Compila as regras na trie.
+
+        Args:
+            rules: Lista de regras como lidas do TOML. Regras inválidas são
+                ignoradas com um aviso no log.
+            cache_size: Combinações (protocol, type, src) guardadas em cache.
+        """
+        self.cache_size = cache_size
+
+        self.rules: list[Rule] = []
+        self._root = _Node()
+        self._cache: dict[tuple, tuple[Rule, ...]] = {}
+
+        for order, raw in enumerate(rules or []):
+            self.add(raw, order)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def add(self, raw: dict, order: int | None = None) -> Rule | None:
+        """Compila uma regra e a insere na trie.
+
+        Returns:
+            A Rule criada, ou None se a regra for inválida.
+        """
+        order = len(self.rules) if order is None else order
+        name = raw.get("name") or f"regra-{order}"
+
+        sinks = []
+        for entry in raw.get("sinks") or []:
+            sink = _parse_sink(entry)
+            if sink is None:
+                logger.warning("[RULES] Sink inválido em '%s': %s", name, entry)
+                return None
+            sinks.append(sink)
+
+        if not sinks:
+            logger.warning("[RULES] Regra '%s' sem sinks, ignorada", name)
+            return None
+
+        payload = raw.get("payload") or ()
+        if isinstance(payload, str):
+            payload = (payload,)
+
+        pattern = "/".join((raw.get("protocol") or "+", raw.get("type") or "+", raw.get("src") or "#"))
+        levels = pattern.split("/")
+
+        if "#" in levels[:-1]:
+            logger.warning("[RULES] '#' só pode ser o último nível: '%s' em '%s'", pattern, name)
+            return None
+
+        rule = Rule(name=name, order=order, payload=tuple(payload), sinks=tuple(sinks))
+
+        node = self._root
+        for level in levels:
+            if level == "#":
+                node.tail.append(rule)
+                break
+            node = node.children.setdefault(level, _Node())
+        else:
+            node.rules.append(rule)
+
+        self.rules.append(rule)
+        self._cache.clear()
+        return rule
+
+    def match(self, message) -> list[Rule]:
+        """Retorna as regras que casam com a mensagem (Envelope), na ordem do arquivo."""
+        key = (message.protocol, message.type, message.src)
+
+        candidates = self._cache.get(key)
+        if candidates is None:
+            candidates = self._match_topic(key)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = candidates
+
+        if not candidates:
+            return []
+
+        payload = message.payload
+        if not isinstance(payload, dict):
+            payload = {}
+
+        return [rule for rule in candidates if all(k in payload for k in rule.payload)]
+
+    def _match_topic(self, key: tuple) -> tuple[Rule, ...]:
+        protocol, message_type, source = (str(part) if part is not None else "" for part in key)
+        levels = [protocol, message_type, *source.split("/")]
+
+        found: list[Rule] = []
+        nodes = [self._root]
+
+        for level in levels:
+            following = []
+            for node in nodes:
+                found.extend(node.tail)
+
+                child = node.children.get(level)
+                if child is not None:
+                    following.append(child)
+
+                child = node.children.get("+")
+                if child is not None:
+                    following.append(child)
+
+            nodes = following
+            if not nodes:
+                break
+
+        for node in nodes:
+            found.extend(node.rules)
+            found.extend(node.tail)
+
+        # Uma regra aparece uma vez só, mesmo que case por mais de um caminho.
+        unique = {rule.order: rule for rule in found}
+        return tuple(unique[order] for order in sorted(unique))
+
+def _parse_sink(entry) -> Sink | None:
+    """Converte `{ mqtt = "tópico" }`, `{ device = "id" }`, `{ influxdb = true }` ou "drop"."""
+    if entry == SINK_DROP:
+        return Sink(SINK_DROP, None)
+
+    if not isinstance(entry, dict) or len(entry) != 1:
+        return None
+
+    kind, target = next(iter(entry.items()))
+    if kind not in SINK_KINDS:
+        return None
+
+    if kind in (SINK_INFLUXDB, SINK_DROP):
+        if target is False:
+            return None
+        return Sink(kind, target if isinstance(target, str) else None)
+
+    if not isinstance(target, str) or not target:
+        return None
+
+    return Sink(kind, target)
+
+def load_rules(path: str) -> RuleSet:
+    """Lê as regras de um TOML relativo à raiz do projeto.
+
+    Returns:
+        Um RuleSet, vazio se o arquivo não existir ou for inválido.
+    """
+    try:
+        data = load_config(path)
+    except FileNotFoundError:
+        logger.info("[RULES] %s não encontrado, sem regras de roteamento", path)
+        return RuleSet()
+    except Exception as e:
+        logger.error("[RULES] Erro ao ler %s: %s", path, e)
+        return RuleSet()
+
+    rules = RuleSet(data.get("rules") or [])
+    logger.info("[RULES] %d regra(s) de roteamento carregada(s)", len(rules))
+    return rules
@@ -0,0 +1,439 @@
+"""Dispatch dividido entre processos (shards), para usar todos os núcleos.
+
+No CPython, as threads do Dispatcher disputam o mesmo GIL: parsing, consultas ao
+registro, regras e a preparação das escritas do InfluxDB acabam, na prática, em um
+único núcleo. No modo shards, o processo principal continua com toda a E/S dos
+protocolos (portas seriais e MQTT) e apenas distribui as mensagens entre processos
+de roteamento:
+
+    - o processo de cada mensagem é escolhido pelo remetente (crc32 do "src"), então
+      as mensagens de um dispositivo são sempre tratadas pelo mesmo processo, na
+      ordem em que chegaram;
+    - as mensagens seguem em lotes por uma multiprocessing.Queue por processo. Um
+      lote é enviado ao atingir batch_size ou em flush(), chamado pelo loop de
+      eventos ao fim de cada passada. O envio nunca espera: com a fila cheia, ou
+      com o processo morto, o lote é descartado e contado em `dropped`;
+    - cada processo tem uma réplica do registro em memória. Só o registro do
+      processo principal grava em disco, e cada alteração dele é repassada a todas
+      as réplicas por uma fila de controle sem limite, então o listener do registro
+      nunca espera. Cada lote leva a versão do registro em que foi enviado, e o
+      processo aplica as alterações até essa versão antes de rotear o lote;
+    - os handlers dos processos (OutboxHandler) não enviam nada: guardam os envios
+      pedidos pelo dispatch e os devolvem ao processo principal, que os executa
+      nos handlers reais;
+    - as métricas dos processos são enviadas periodicamente e somadas às do
+      processo principal, e os logs passam pelos handlers configurados nele.
+
+O que cada processo faz com as mensagens é definido por `setup`, uma função de
+módulo (os processos são criados com "spawn" e importam a função) que recebe o
+índice do shard, a réplica do registro e os handlers e retorna a função chamada
+para cada mensagem.
+
+Exemplo de uso:
+
+    shards = ShardPool(workers=4, setup=shard_worker, handlers=handlers, registry=registry).start()
+    loop = EventLoop(on_message=shards.submit, on_flush=shards.flush)
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+import time
+import zlib
+
+from utils.metrics import metrics
+from utils.registry import DeviceRegistry
+
+logger = logging.getLogger(__name__)
+
+# Tipos dos itens trocados entre os processos.
+_BATCH = "batch"
+_STOP = "stop"
+_ACTIONS = "actions"
+_METRICS = "metrics"
+_FAILED = "failed"
+
+# Tempo máximo (s) que um processo espera pela alteração do registro de que um lote depende.
+_CONTROL_TIMEOUT = 5.0
+
+def shard_of(source, workers: int) -> int:
+    """Índice do shard de um remetente, o mesmo em qualquer processo e execução."""
+    key = str(source).encode("utf-8") if source is not None else b""
+    return zlib.crc32(key) % workers
+
+class OutboxHandler:
+    """Handler dos processos de shard: guarda os envios para o processo principal."""
+
+    def __init__(self, name: str, outbox: list):
+        self.name = name
+        self._outbox = outbox
+
+    def handleMessage(self, destination_info: dict, message):
+        self._outbox.append((self.name, "handleMessage", (), {"destination_info": destination_info, "message": message}))
+
+    def send(self, *args, **kwargs):
+        self._outbox.append((self.name, "send", args, kwargs))
+
+    def publish(self, *args, **kwargs):
+        self._outbox.append((self.name, "publish", args, kwargs))
+
+class ShardPool:
+    def __init__(
+        self,
+        workers: int,
+        setup,
+        handlers: dict,
+        registry: DeviceRegistry,
+        teardown=None,
+        batch_size: int = 64,
+        queue_size: int = 1024,
+        metrics_interval: float = 1.0,
+    ):
+        """Prepara os processos de roteamento, iniciados em start().
+
+        Args:
+            workers: Quantidade de processos.
+            setup: Função de módulo setup(índice, registro, handlers) -> on_message,
+                executada em cada processo.
+            handlers: Handlers reais, usados para executar os envios dos processos.
+            registry: Registro do processo principal, replicado em cada processo.
+            teardown: Função de módulo opcional executada em cada processo ao encerrar.
+            batch_size: Mensagens acumuladas para um processo antes de um envio imediato.
+            queue_size: Lotes aguardando em cada processo, acima disso os lotes são descartados.
+            metrics_interval: Intervalo (s) em que os processos enviam as métricas.
+        """
+        self.workers = workers
+        self.setup = setup
+        self.teardown = teardown
+        self.handlers = handlers
+        self.registry = registry
+        self.batch_size = batch_size
+        self.metrics_interval = metrics_interval
+
+        self._context = multiprocessing.get_context("spawn")
+        self._inbound = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._control = [self._context.Queue() for _ in range(workers)]
+        self._outbound = self._context.Queue()
+        self._logs = self._context.Queue()
+
+        self._buffers: list[list] = [[] for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._closing = False
+
+        # Alterações do registro já repassadas às réplicas.
+        self._version = 0
+
+        self._processes: list = []
+        self._threads: list[threading.Thread] = []
+        self._dead: set[int] = set()
+
+        # Última leitura dos coletores de cada processo: {nome: {chave: número}}
+        self._collected: list[dict] = [{} for _ in range(workers)]
+
+        # Contadores expostos em stats()
+        self.submitted = 0
+        self.dropped = 0
+        self.batches = 0
+        self.actions = 0
+        self.failed = 0
+
+    def start(self) -> "ShardPool":
+        """Inicia os processos, já com o estado atual do registro."""
+        # O listener vem antes do snapshot: uma alteração entre os dois chega duas
+        # vezes à réplica, o que não muda o resultado.
+        self.registry.add_listener(self._on_registry_change)
+        devices = self.registry.snapshot()
+        level = logging.getLogger().getEffectiveLevel()
+
+        for index in range(self.workers):
+            process = self._context.Process(
+                target=_worker_main,
+                name=f"shard-{index}",
+                args=(
+                    index, self._inbound[index], self._control[index], self._outbound, self._logs, devices, list(self.handlers),
+                    self.setup, self.teardown, self.metrics_interval, level, metrics.enabled,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+        self._threads = [
+            threading.Thread(target=self._collect, name="shards-outbound", daemon=True),
+            threading.Thread(target=self._forward_logs, name="shards-logs", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        logger.info("[SHARDS] %d processos de roteamento iniciados", self.workers)
+        return self
+
+    def submit(self, message) -> None:
+        """Encaminha uma mensagem (Envelope) ao processo do seu remetente."""
+        index = shard_of(message.src, self.workers)
+
+        with self._lock:
+            buffer = self._buffers[index]
+            buffer.append(message)
+            self.submitted += 1
+
+            if len(buffer) >= self.batch_size:
+                self._send(index)
+
+    def flush(self) -> None:
+        """Envia os lotes incompletos. Chamado ao fim de cada passada do loop."""
+        with self._lock:
+            for index, buffer in enumerate(self._buffers):
+                if buffer:
+                    self._send(index)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "dead": len(self._dead),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "actions": self.actions,
+            "failed": self.failed,
+        }
+
+    def collected(self, name: str) -> dict:
+        """Soma, entre os processos, os contadores de um coletor (ex.: "routes")."""
+        total = {}
+
+        for values in self._collected:
+            for key, value in values.get(name, {}).items():
+                if isinstance(value, (int, float)):
+                    total[key] = total.get(key, 0) + value
+
+        return total
+
+    def close(self, timeout: float | None = 5.0) -> None:
+        """Encerra os processos após as mensagens já enviadas e executa os envios restantes."""
+        self.flush()
+
+        with self._lock:
+            self._closing = True
+
+        for index, inbound in enumerate(self._inbound):
+            if index in self._dead:
+                continue
+            try:
+                inbound.put((_STOP, None), timeout=timeout)
+            except queue.Full:
+                logger.warning("[SHARDS] Fila do processo %d cheia ao encerrar", index)
+
+        for index, process in enumerate(self._processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("[SHARDS] Processo %d não encerrou a tempo, finalizando", index)
+                process.terminate()
+
+        self._outbound.put(None)
+        self._logs.put(None)
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _send(self, index: int) -> None:
+        """Envia o lote acumulado de um processo, sem esperar. Chamado com self._lock."""
+        batch, self._buffers[index] = self._buffers[index], []
+
+        if index in self._dead:
+            self.dropped += len(batch)
+            return
+
+        try:
+            self._inbound[index].put_nowait((_BATCH, (self._version, batch)))
+            self.batches += 1
+        except queue.Full:
+            self.dropped += len(batch)
+            logger.warning("[SHARDS] Fila do processo %d cheia, %d mensagem(ns) descartada(s) (%d no total)", index, len(batch), self.dropped)
+
+    def _on_registry_change(self, device_id: str) -> None:
+        """Repassa uma alteração do registro a todas as réplicas.
+
+        Roda dentro do lock do registro, então nada aqui espera. Os lotes pendentes
+        saem antes, com put_nowait e a versão anterior, e são roteados com o registro
+        antigo. A alteração vai pelas filas de controle, que não têm limite.
+        """
+        info = self.registry.get_by_id(device_id)
+        info = dict(info) if info is not None else None
+
+        with self._lock:
+            if self._closing:
+                return
+
+            for index, buffer in enumerate(self._buffers):
+                if buffer:
+                    self._send(index)
+
+            self._version += 1
+            for index, control in enumerate(self._control):
+                if index not in self._dead:
+                    control.put_nowait((self._version, device_id, info))
+
+    def _collect(self) -> None:
+        """Thread que executa os envios e soma as métricas vindas dos processos."""
+        while True:
+            try:
+                item = self._outbound.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+
+            if item is None:
+                return
+
+            kind, index, payload = item
+
+            if kind == _ACTIONS:
+                self._execute(payload)
+
+            elif kind == _METRICS:
+                histograms, counters, collected = payload
+                metrics.merge(histograms, counters)
+                self._collected[index] = collected
+
+            elif kind == _FAILED:
+                self._mark_dead(index, payload)
+
+    def _execute(self, actions: list) -> None:
+        for name, method, args, kwargs in actions:
+            handler = self.handlers.get(name)
+            if handler is None:
+                continue
+
+            start = time.perf_counter()
+
+            try:
+                getattr(handler, method)(*args, **kwargs)
+                self.actions += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("[SHARDS] Erro ao executar '%s' no handler '%s'", method, name)
+
+            metrics.observe("outbound", time.perf_counter() - start, protocol=name)
+
+    def _check_workers(self) -> None:
+        if self._closing:
+            return
+
+        for index, process in enumerate(self._processes):
+            if index not in self._dead and not process.is_alive():
+                self._mark_dead(index, f"código {process.exitcode}")
+
+    def _mark_dead(self, index: int, reason: str) -> None:
+        """Marca o processo como morto: seus lotes passam a ser descartados e contados."""
+        with self._lock:
+            if index in self._dead:
+                return
+            self._dead.add(index)
+
+            # O que já estava acumulado para ele também se perde.
+            self.dropped += len(self._buffers[index])
+            self._buffers[index] = []
+
+        logger.error("[SHARDS] Processo %d encerrou (%s), suas mensagens serão descartadas", index, reason)
+
+    def _forward_logs(self) -> None:
+        """Thread que entrega os logs dos processos aos handlers do processo principal."""
+        while True:
+            record = self._logs.get()
+            if record is None:
+                return
+
+            target = logging.getLogger(record.name)
+            if target.isEnabledFor(record.levelno):
+                target.handle(record)
+
+def _apply_registry(registry: DeviceRegistry, control, applied: int, version: int) -> int:
+    """Aplica na réplica as alterações do registro até `version`, a versão de um lote.
+
+    Alterações mais novas ficam na fila: lotes enviados antes delas ainda podem estar
+    a caminho e devem ser roteados com o registro antigo.
+
+    Returns:
+        A última versão aplicada.
+    """
+    while applied < version:
+        try:
+            # A alteração é enviada antes do lote, mas por outra fila: pode chegar depois dele.
+            applied, device_id, info = control.get(timeout=_CONTROL_TIMEOUT)
+        except queue.Empty:
+            logger.warning("[SHARDS] Alteração %d do registro não chegou, roteando com a versão %d", version, applied)
+            break
+
+        registry.apply(device_id, info)
+
+    return applied
+
+def _worker_main(index, inbound, control, outbound, logs, devices, handler_names, setup, teardown, interval, level, metrics_enabled):
+    """Laço de um processo de shard."""
+    # O Ctrl+C chega a todo o grupo de processos, quem encerra os shards é o principal.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(logging.handlers.QueueHandler(logs))
+    root.setLevel(level)
+
+    metrics.enabled = metrics_enabled
+
+    registry = DeviceRegistry(None, devices=devices)
+    outbox: list = []
+    handlers = {name: OutboxHandler(name, outbox) for name in handler_names}
+
+    try:
+        on_message = setup(index, registry, handlers)
+    except Exception as e:
+        logger.exception("[SHARDS] Falha ao iniciar o processo %d", index)
+        # Sem isso o principal só perceberia pelo processo encerrado, segundos depois.
+        outbound.put((_FAILED, index, f"falha no setup: {e!r}"))
+        sys.exit(1)
+
+    running = True
+    applied = 0
+    report_at = time.monotonic() + interval
+
+    while running:
+        try:
+            kind, payload = inbound.get(timeout=interval)
+        except queue.Empty:
+            kind, payload = None, None
+
+        if kind == _BATCH:
+            version, batch = payload
+            applied = _apply_registry(registry, control, applied, version)
+
+            for message in batch:
+                try:
+                    on_message(message)
+                except Exception:
+                    logger.exception("[SHARDS] Erro ao despachar mensagem: %s", message)
+
+        elif kind == _STOP:
+            running = False
+
+        if outbox:
+            outbound.put((_ACTIONS, index, list(outbox)))
+            outbox.clear()
+
+        now = time.monotonic()
+        if now >= report_at or not running:
+            report_at = now + interval
+            histograms, counters = metrics.histograms(), metrics.counters()
+            metrics.reset()
+            outbound.put((_METRICS, index, (histograms, counters, metrics.collect())))
+
+    if teardown is not None:
+        try:
+            teardown()
+        except Exception:
+            logger.exception("[SHARDS] Erro ao encerrar o processo %d", index)
@@ -0,0 +1,201 @@
+"""Fila em disco para pontos que não puderam ser escritos no InfluxDB.
+
+Os pontos (já em line protocol) são anexados a segmentos numerados dentro de um
+diretório. Cada chamada de append() faz um único fsync para o lote inteiro, e o
+segmento atual é rotacionado ao atingir `segment_bytes`. O espaço total é limitado
+por `max_bytes`: ao ultrapassar, os segmentos mais antigos são descartados.
+
+Quando o banco volta, replay() drena os segmentos do mais antigo para o mais novo
+em lotes grandes. Toda a fila é usada apenas pela thread de escrita do InfluxDB,
+nunca pelo caminho de roteamento.
+
+Exemplo de uso:
+
+    spool = Spool("spool/influxdb")
+    spool.append(["sensor,src=a temp=21"])
+    spool.replay(write_batch=lambda lines: write_api.write(record=lines))
+"""
+
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class Spool:
+    SUFFIX = ".seg"
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024, max_bytes: int = 256 * 1024 * 1024):
+        """Abre (ou cria) o diretório da fila em disco.
+
+        Args:
+            directory: Diretório onde os segmentos serão gravados.
+            segment_bytes: Tamanho a partir do qual um novo segmento é iniciado.
+            max_bytes: Espaço máximo ocupado pela fila, os segmentos mais antigos são
+                descartados ao ultrapassar.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+
+        self.spooled = 0
+        self.replayed = 0
+        self.evicted = 0
+
+        self._segments: list[Path] = sorted(self.directory.glob(f"*{self.SUFFIX}"))
+        self._sizes: dict[Path, int] = {path: path.stat().st_size for path in self._segments}
+        self._file = None
+
+        if self._segments:
+            logger.info("Fila em disco '%s' com %d segmentos pendentes.", self.directory, len(self._segments))
+
+    @property
+    def size(self) -> int:
+        """Espaço ocupado pelos segmentos, em bytes."""
+        return sum(self._sizes.values())
+
+    def pending(self) -> bool:
+        """Indica se existem pontos aguardando replay."""
+        return bool(self._segments)
+
+    def stats(self) -> dict:
+        return {
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "evicted": self.evicted,
+            "segments": len(self._segments),
+            "bytes": self.size,
+        }
+
+    def append(self, lines: list[str]) -> None:
+        """Anexa um lote de linhas ao segmento atual com um único fsync."""
+        if not lines:
+            return
+
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+
+        try:
+            file = self._current()
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        except OSError as e:
+            logger.error("Falha ao gravar %d pontos na fila em disco: %s", len(lines), e)
+            return
+
+        path = self._segments[-1]
+        self._sizes[path] += len(data)
+        self.spooled += len(lines)
+
+        if self._sizes[path] >= self.segment_bytes:
+            self._close_current()
+
+        self._evict()
+
+    def replay(self, write_batch, batch_size: int = 5000, max_segments: int | None = None) -> int:
+        """Reenvia os pontos gravados, do segmento mais antigo para o mais novo.
+
+        Para no primeiro erro: as linhas ainda não enviadas continuam no segmento e
+        serão tentadas no próximo replay, e a exceção é repassada para quem chamou.
+
+        Args:
+            write_batch: Função que recebe uma lista de linhas e lança exceção em caso
+                de falha.
+            batch_size: Quantidade de linhas por chamada de write_batch.
+            max_segments: Limita quantos segmentos são drenados nesta chamada.
+
+        Returns:
+            Quantidade de linhas reenviadas.
+        """
+        sent = 0
+        drained = 0
+
+        while self._segments and (max_segments is None or drained < max_segments):
+            path = self._segments[0]
+
+            # Nunca lê o segmento que ainda está aberto para escrita.
+            if self._file is not None and path == self._segments[-1]:
+                self._close_current()
+
+            try:
+                lines = path.read_text(encoding="utf-8").splitlines()
+            except OSError as e:
+                logger.error("Falha ao ler segmento '%s': %s", path, e)
+                self._drop(path)
+                continue
+
+            for start in range(0, len(lines), batch_size):
+                try:
+                    write_batch(lines[start:start + batch_size])
+                except Exception as e:
+                    logger.warning("Replay da fila em disco interrompido após %d pontos: %s", sent, e)
+                    self._rewrite(path, lines[start:])
+                    raise
+
+                sent += len(lines[start:start + batch_size])
+                self.replayed += len(lines[start:start + batch_size])
+
+            self._drop(path)
+            drained += 1
+
+        if sent:
+            logger.info("Replay da fila em disco: %d pontos reenviados.", sent)
+        return sent
+
+    def close(self) -> None:
+        self._close_current()
+
+    def _current(self):
+        """Retorna o segmento aberto para escrita, criando um novo se necessário."""
+        if self._file is None:
+            sequence = int(self._segments[-1].stem) + 1 if self._segments else 0
+            path = self.directory / f"{sequence:012d}{self.SUFFIX}"
+
+            self._file = path.open("ab")
+            self._segments.append(path)
+            self._sizes[path] = 0
+
+        return self._file
+
+    def _close_current(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _evict(self) -> None:
+        """Descarta os segmentos mais antigos até respeitar max_bytes."""
+        while len(self._segments) > 1 and self.size > self.max_bytes:
+            path = self._segments[0]
+
+            try:
+                lost = path.read_bytes().count(b"\n")
+            except OSError:
+                lost = 0
+
+            self.evicted += lost
+            self._drop(path)
+            logger.warning("Fila em disco cheia, segmento '%s' descartado (%d pontos).", path.name, lost)
+
+    def _rewrite(self, path: Path, lines: list[str]) -> None:
+        """Substitui atomicamente o segmento pelas linhas que ainda não foram enviadas."""
+        tmp = path.with_suffix(".tmp")
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+
+        with tmp.open("wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+        self._sizes[path] = len(data)
+
+    def _drop(self, path: Path) -> None:
+        self._segments.remove(path)
+        self._sizes.pop(path, None)
+
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,84 @@
+"""Perfil de inicialização do Dispatcher.
+
+Guarda quanto tempo cada fase da inicialização levou, contando desde o início do
+processo (inclusive a inicialização do Python e os imports), e o tempo até a primeira
+mensagem recebida. Os valores entram nas métricas pelo coletor "startup"
+(bifrost_startup_<fase>_seconds) e um resumo vai para o log quando o Dispatcher fica
+pronto.
+
+Para ver o custo de cada import, use tests/startup_profile.py.
+
+Exemplo de uso:
+
+    from utils.startup import startup
+
+    startup.mark("registry")
+    ...
+    startup.ready()
+    metrics.add_collector("startup", startup.stats)
+"""
+
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+def _process_start() -> float:
+    """Instante (na escala de time.monotonic) em que o processo começou.
+
+    No Linux, usa o starttime de /proc/self/stat (resolução de um tick, ~10 ms). Nos
+    outros sistemas, usa o import deste módulo.
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+
+        # starttime é o 22º campo; após o nome do processo, o 3º campo tem índice 0.
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - started
+        return time.monotonic() - max(age, 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+class StartupProfile:
+    def __init__(self):
+        self.started = _process_start()
+
+        # fase -> segundos desde o início do processo, na ordem em que terminaram
+        self.phases: dict[str, float] = {}
+        self.first_message_at: float | None = None
+
+    def mark(self, phase: str) -> float:
+        """Registra o fim de uma fase e retorna os segundos desde o início do processo."""
+        elapsed = self.phases[phase] = time.monotonic() - self.started
+        logger.debug("[STARTUP] %s em %.3fs", phase, elapsed)
+        return elapsed
+
+    def ready(self) -> None:
+        """Marca o Dispatcher como pronto e loga o tempo de cada fase."""
+        self.mark("ready")
+
+        previous, parts = 0.0, []
+        for phase, elapsed in self.phases.items():
+            parts.append(f"{phase} {elapsed - previous:.3f}s")
+            previous = elapsed
+
+        logger.info("[STARTUP] Pronto em %.3fs (%s)", self.phases["ready"], " | ".join(parts))
+
+    def first_message(self) -> None:
+        """Registra a primeira mensagem recebida, as chamadas seguintes não fazem nada."""
+        if self.first_message_at is not None:
+            return
+
+        self.first_message_at = time.monotonic() - self.started
+        logger.info("[STARTUP] Primeira mensagem %.3fs após o início do processo", self.first_message_at)
+
+    def stats(self) -> dict:
+        values = {f"{phase}_seconds": round(elapsed, 6) for phase, elapsed in self.phases.items()}
+
+        if self.first_message_at is not None:
+            values["first_message_seconds"] = round(self.first_message_at, 6)
+        return values
+
+startup = StartupProfile()
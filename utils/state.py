@@ -0,0 +1,150 @@
+"""Último estado conhecido de cada dispositivo, em memória.
+
+Guarda, por dispositivo cadastrado, o último valor de cada campo do payload das
+mensagens de estado (tipos em `types`, como "state" e "data"), com o remetente, o
+protocolo, o tipo e o instante da última mensagem. Payloads que não são dicionários
+ficam no campo "value". Os campos são mesclados: um sensor que envia temperatura e
+umidade em mensagens separadas tem as duas no estado.
+
+A tabela é limitada: acima de max_devices, o dispositivo atualizado há mais tempo é
+descartado, e cada dispositivo guarda no máximo max_fields campos. Dispositivos
+removidos do registro saem da tabela (ver watch()).
+
+A cada mudança de valor, os listeners recebem (device_id, estado, campos alterados).
+Mensagens que só repetem os valores atualizam o instante, sem notificar. Os listeners
+rodam no caminho de roteamento e devem só enfileirar (ver utils.state_api).
+
+Exemplo de uso:
+
+    state = StateStore(max_devices=1024)
+    state.watch(registry)
+    state.add_listener(lambda device_id, current, changed: print(device_id, changed))
+
+    state.update("termohigrometro", message)
+    state.snapshot("termohigrometro")
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class StateStore:
+    def __init__(self, max_devices: int = 1024, max_fields: int = 64, types=("state", "data")):
+        """Cria a tabela vazia.
+
+        Args:
+            max_devices: Dispositivos guardados, o atualizado há mais tempo sai primeiro.
+            max_fields: Campos guardados por dispositivo, campos novos acima disso são ignorados.
+            types: Tipos de mensagem que descrevem o estado do remetente (comandos não entram).
+        """
+        self.max_devices = max_devices
+        self.max_fields = max_fields
+        self.types = frozenset(types)
+
+        # device_id -> {"fields": {...}, "src", "protocol", "type", "updated"}
+        self._devices: OrderedDict[str, dict] = OrderedDict()
+        self._listeners: list = []
+        self._lock = threading.Lock()
+
+        # Contadores expostos em stats()
+        self.updates = 0
+        self.changes = 0
+        self.evicted = 0
+
+    def add_listener(self, callback) -> None:
+        """Cadastra uma função chamada com (device_id, estado, campos alterados) a cada mudança."""
+        self._listeners.append(callback)
+
+    def watch(self, registry) -> None:
+        """Remove da tabela os dispositivos removidos do registro."""
+        def on_change(device_id: str):
+            if registry.get_by_id(device_id) is None:
+                self.remove(device_id)
+
+        registry.add_listener(on_change)
+
+    def update(self, device_id: str, message) -> dict:
+        """Atualiza o estado do dispositivo com a mensagem.
+
+        Returns:
+            Os campos que mudaram de valor (vazio se a mensagem só repetiu o estado ou
+            se o tipo da mensagem não está em `types`).
+        """
+        if message.type not in self.types:
+            return {}
+
+        payload = message.payload
+        if payload.__class__ is not dict:
+            payload = {"value": payload}
+
+        with self._lock:
+            current = self._devices.get(device_id)
+
+            if current is None:
+                current = self._devices[device_id] = {"fields": {}}
+                if len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._devices.move_to_end(device_id)
+
+            fields = current["fields"]
+            changed = {}
+
+            for key, value in payload.items():
+                if key in fields:
+                    if fields[key] == value:
+                        continue
+                elif len(fields) >= self.max_fields:
+                    continue
+
+                fields[key] = changed[key] = value
+
+            current["src"] = message.src
+            current["protocol"] = message.protocol
+            current["type"] = message.type
+            current["updated"] = time.time()
+
+            self.updates += 1
+            if changed:
+                self.changes += 1
+                state = self._copy(current)
+
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(device_id, state, changed)
+                except Exception:
+                    logger.exception("[STATE] Erro ao notificar a mudança de '%s'", device_id)
+
+        return changed
+
+    def remove(self, device_id: str) -> None:
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def snapshot(self, device_id: str | None = None) -> dict | None:
+        """Cópia do estado de um dispositivo (None se desconhecido) ou de todos, {id: estado}."""
+        with self._lock:
+            if device_id is not None:
+                current = self._devices.get(device_id)
+                return self._copy(current) if current is not None else None
+
+            return {device_id: self._copy(current) for device_id, current in self._devices.items()}
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "updates": self.updates,
+            "changes": self.changes,
+            "evicted": self.evicted,
+        }
+
+    @staticmethod
+    def _copy(current: dict) -> dict:
+        state = dict(current)
+        state["fields"] = dict(current["fields"])
+        return state
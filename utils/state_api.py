@@ -0,0 +1,174 @@
+"""API local do último estado dos dispositivos (utils.state), via HTTP e WebSocket.
+
+Rotas HTTP:
+
+    GET /api/state              -> {device_id: estado} de todos os dispositivos
+    GET /api/state/<device_id>  -> estado de um dispositivo, 404 se desconhecido
+
+Socket.IO, na mesma porta:
+
+    subscribe   {"devices": ["termohigrometro"]}  (sem "devices": todos)
+        -> "snapshot" com o estado atual dos dispositivos pedidos
+        -> "state" {"device", "state", "changed"} a cada mudança de valor
+    unsubscribe {"devices": [...]}                (sem "devices": cancela tudo)
+
+Flask e Flask-SocketIO só são importados em start(). O servidor (werkzeug, modo
+"threading" do Flask-SocketIO) roda em uma thread. As mudanças chegam do StateStore
+por uma fila limitada e são enviadas por outra thread, fora do caminho de roteamento;
+com a fila cheia, as mudanças mais novas são descartadas e contadas.
+
+Exemplo de uso:
+
+    api = StateAPI(state, host="127.0.0.1", port=9110)
+    api.start()
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sala de quem assina todos os dispositivos. As dos dispositivos são "device:<id>".
+_ALL = "devices:*"
+
+class StateAPI:
+    def __init__(self, store, host: str = "127.0.0.1", port: int = 9110, cors_origins=(), queue_size: int = 1024):
+        """Prepara a API, o servidor é iniciado em start().
+
+        Args:
+            store: O StateStore servido.
+            host: Endereço de escuta, o padrão só aceita conexões locais.
+            port: Porta HTTP/WebSocket.
+            cors_origins: Origens liberadas para painéis em outro endereço ("*" libera todas).
+            queue_size: Mudanças aguardando envio aos assinantes.
+        """
+        self.store = store
+        self.host = host
+        self.port = port
+        self.cors_origins = list(cors_origins)
+
+        self._changes: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._server = None
+        self._socketio = None
+
+        # Contadores expostos em stats()
+        self.pushed = 0
+        self.dropped = 0
+        self.clients = 0
+
+    def start(self) -> bool:
+        """Abre o servidor e começa a enviar as mudanças. Retorna False se não foi possível."""
+        try:
+            from flask import Flask, jsonify, request
+            from flask_socketio import SocketIO, join_room, leave_room, rooms
+            from werkzeug.serving import make_server
+        except ImportError as e:
+            logger.error("[STATE] API indisponível, Flask/Flask-SocketIO não instalados: %s", e)
+            return False
+
+        app = Flask(__name__)
+        origins = "*" if "*" in self.cors_origins else (self.cors_origins or None)
+        socketio = SocketIO(app, async_mode="threading", cors_allowed_origins=origins, logger=False, engineio_logger=False)
+        store = self.store
+
+        @app.after_request
+        def allow_origin(response):
+            origin = request.headers.get("Origin")
+            if origin and (origins == "*" or origin in self.cors_origins):
+                response.headers["Access-Control-Allow-Origin"] = origin
+            return response
+
+        @app.get("/api/state")
+        def get_all():
+            return jsonify(store.snapshot())
+
+        @app.get("/api/state/<device_id>")
+        def get_device(device_id: str):
+            state = store.snapshot(device_id)
+            if state is None:
+                return jsonify({"error": f"dispositivo '{device_id}' sem estado"}), 404
+            return jsonify(state)
+
+        @socketio.on("connect")
+        def on_connect(auth=None):
+            self.clients += 1
+
+        @socketio.on("disconnect")
+        def on_disconnect(reason=None):
+            self.clients -= 1
+
+        @socketio.on("subscribe")
+        def on_subscribe(data=None):
+            devices = (data or {}).get("devices") if isinstance(data, dict) else None
+
+            if devices:
+                for device_id in devices:
+                    join_room(f"device:{device_id}")
+                snapshot = {device_id: state for device_id in devices if (state := store.snapshot(device_id)) is not None}
+            else:
+                join_room(_ALL)
+                snapshot = store.snapshot()
+
+            socketio.emit("snapshot", snapshot, to=request.sid)
+
+        @socketio.on("unsubscribe")
+        def on_unsubscribe(data=None):
+            devices = (data or {}).get("devices") if isinstance(data, dict) else None
+            subscribed = [room for room in rooms() if room == _ALL or room.startswith("device:")]
+
+            for room in subscribed:
+                if not devices or room[len("device:"):] in devices:
+                    leave_room(room)
+
+        try:
+            self._server = make_server(self.host, self.port, app, threaded=True)
+        except OSError as e:
+            logger.error("[STATE] Não foi possível abrir %s:%s: %s", self.host, self.port, e)
+            return False
+
+        # Um log por requisição do werkzeug poluiria o log do Dispatcher.
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        self._socketio = socketio
+        self.store.add_listener(self._on_change)
+
+        threading.Thread(target=self._server.serve_forever, name="state-api", daemon=True).start()
+        threading.Thread(target=self._push, name="state-push", daemon=True).start()
+
+        logger.info("[STATE] Estado dos dispositivos em http://%s:%s/api/state", self.host, self._server.server_port)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "clients": self.clients,
+            "pushed": self.pushed,
+            "dropped": self.dropped,
+            "pending": self._changes.qsize(),
+        }
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._changes.put(None)
+            self._server.shutdown()
+            self._server = None
+
+    def _on_change(self, device_id: str, state: dict, changed: dict) -> None:
+        """Listener do StateStore, chamado no roteamento: só enfileira."""
+        try:
+            self._changes.put_nowait({"device": device_id, "state": state, "changed": changed})
+        except queue.Full:
+            self.dropped += 1
+
+    def _push(self) -> None:
+        """Thread que envia as mudanças a quem assina o dispositivo ou todos."""
+        while True:
+            change = self._changes.get()
+            if change is None:
+                return
+
+            try:
+                self._socketio.emit("state", change, to=[_ALL, f"device:{change['device']}"])
+                self.pushed += 1
+            except Exception:
+                logger.exception("[STATE] Erro ao enviar a mudança de '%s'", change["device"])
@@ -0,0 +1,145 @@
+"""Controle de remetentes desconhecidos do Dispatcher.
+
+Toda mensagem de um remetente fora do registro gera um register_request, que nas
+UARTs a 9600 bps ocupa o enlace de descida. Um único dispositivo mal configurado
+mandando telemetria sem parar poderia saturar a porta e atrasar o tráfego dos
+dispositivos cadastrados.
+
+UnknownSources guarda, por endereço:
+    - um cache negativo com validade (ttl): enquanto válido, o dispatch nem consulta
+      o registro ou a tabela de rotas;
+    - um token bucket que limita quantos register_request o endereço recebe
+      (`burst` imediatos e depois `rate` por segundo). Os pedidos que passarem do
+      limite são contados em `suppressed`.
+
+A entrada é descartada assim que um dispositivo com o endereço é registrado (a
+classe se cadastra como listener do DeviceRegistry). Os endereços MAC são guardados
+em maiúsculas, como no registro (utils.registry.normalize_address): um dispositivo
+que mandou "2c:f4:..." antes de se registrar sai do cache ao ser registrado.
+
+Exemplo de uso:
+
+    unknown = UnknownSources(registry)
+    if unknown.contains(address) or registry.get_by_address(address) is None:
+        unknown.remember(address)
+        if unknown.allow(address):
+            request_for_register(address, handler)
+"""
+
+import logging
+import time
+
+from utils.registry import normalize_address
+
+logger = logging.getLogger(__name__)
+
+class UnknownSources:
+    def __init__(self, registry, ttl: float = 30.0, rate: float = 0.2, burst: int = 2, max_entries: int = 4096, clock=time.monotonic):
+        """Cria o cache vazio.
+
+        Args:
+            registry: O DeviceRegistry do Dispatcher.
+            ttl: Tempo (s) em que um endereço é considerado desconhecido sem
+                consultar o registro.
+            rate: register_request por segundo liberados para cada endereço.
+            burst: Pedidos liberados de uma vez para um endereço novo.
+            max_entries: Endereços guardados, os mais antigos saem primeiro.
+            clock: Relógio usado nas contas, substituível para testes.
+        """
+        self.registry = registry
+        self.ttl = ttl
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self.requests = 0
+        self.suppressed = 0
+
+        # address -> [validade do cache negativo, tokens, instante da última recarga]
+        # Sem lock: com mais de um roteador, a pior corrida libera um pedido a mais.
+        self._entries: dict[str, list] = {}
+
+        registry.add_listener(self._on_registry_change)
+
+    def contains(self, address: str) -> bool:
+        """Retorna True se o endereço está no cache negativo e ainda é válido."""
+        entry = self._entries.get(normalize_address(address))
+        return entry is not None and entry[0] > self.clock()
+
+    def remember(self, address: str) -> None:
+        """Marca o endereço como desconhecido por mais `ttl` segundos.
+
+        Se o endereço já tinha entrada, o token bucket é mantido, então a validade
+        vencer não libera uma nova rajada de pedidos.
+        """
+        address = normalize_address(address)
+        now = self.clock()
+        entry = self._entries.get(address)
+
+        if entry is not None:
+            entry[0] = now + self.ttl
+            return
+
+        if len(self._entries) >= self.max_entries:
+            self._evict(now)
+
+        self._entries[address] = [now + self.ttl, float(self.burst), now]
+
+    def allow(self, address: str) -> bool:
+        """Consome um token do endereço. Retorna False se o pedido deve ser suprimido."""
+        address = normalize_address(address)
+        entry = self._entries.get(address)
+        if entry is None:
+            self.remember(address)
+            entry = self._entries[address]
+
+        now = self.clock()
+        tokens = min(float(self.burst), entry[1] + (now - entry[2]) * self.rate)
+        entry[2] = now
+
+        if tokens < 1.0:
+            entry[1] = tokens
+            self.suppressed += 1
+            return False
+
+        entry[1] = tokens - 1.0
+        self.requests += 1
+        return True
+
+    def forget(self, address: str) -> None:
+        """Remove o endereço do cache negativo e do limite de pedidos."""
+        self._entries.pop(normalize_address(address), None)
+
+    def stats(self) -> dict:
+        """Contadores: endereços desconhecidos, pedidos enviados e suprimidos."""
+        return {
+            "unknown_sources": len(self._entries),
+            "register_requests": self.requests,
+            "register_suppressed": self.suppressed,
+        }
+
+    def _on_registry_change(self, device_id: str) -> None:
+        info = self.registry.get_by_id(device_id)
+        if not info:
+            return
+
+        for field in ("address", "topic"):
+            address = info.get(field)
+            if address is not None:
+                self.forget(address)
+
+    def _evict(self, now: float) -> None:
+        """Abre espaço: descarta as entradas vencidas, ou a mais antiga."""
+        # Só saem as vencidas que já recuperaram todos os tokens, para não zerar o limite.
+        expired = [
+            address for address, entry in self._entries.items()
+            if entry[0] <= now and entry[1] + (now - entry[2]) * self.rate >= self.burst
+        ]
+
+        for address in expired:
+            del self._entries[address]
+
+        if len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+            logger.debug("[UNKNOWN] Limite de %d endereços atingido", self.max_entries)
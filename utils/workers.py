@@ -0,0 +1,210 @@
+"""Leitura em threads dedicadas e roteamento através de uma fila compartilhada.
+
+Modo alternativo ao loop de eventos (utils.event_loop): cada handler ganha uma thread
+leitora (PortReader) que espera pelo próprio descritor e coloca as mensagens em uma
+fila limitada compartilhada. Uma ou mais threads roteadoras (Router) consomem essa
+fila e chamam o dispatch. Assim uma porta lenta, ou um envio demorado, não impede a
+leitura das outras portas.
+
+A fila é uma queue.Queue: no CPython não existe uma fila limitada sem trava, e essa
+é a implementação em C usada pela própria biblioteca padrão para trocas entre threads.
+
+Com mais de um roteador, a ordem entre mensagens de um mesmo dispositivo deixa de
+ser garantida. Por isso o padrão é um único roteador.
+
+O ReaderPool junta as duas partes e oferece a mesma interface do EventLoop
+(register(), run_forever() e close()).
+
+Exemplo de uso:
+
+    pool = ReaderPool(on_message=lambda msg: dispatch(msg, registry, handlers), queue_size=1024)
+    pool.register("espnow", SerialHandler("/dev/ttyAMA2", 9600))
+    pool.register("lora", SerialHandler("/dev/ttyAMA5", 9600))
+    pool.run_forever()
+"""
+
+import logging
+import queue
+import select
+import threading
+import time
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sentinela usada para encerrar os roteadores.
+_STOP = object()
+
+class PortReader(threading.Thread):
+    def __init__(self, name: str, handler, inbound: queue.Queue, put_timeout: float = 1.0, poll_interval: float = 0.5):
+        """Thread que lê continuamente um handler e alimenta a fila de entrada.
+
+        Args:
+            name: Nome do handler, usado no nome da thread e nos logs.
+            handler: Handler no padrão da Bifrost, precisa oferecer fileno().
+            inbound: Fila compartilhada com os roteadores.
+            put_timeout: Tempo máximo (s) esperando espaço na fila antes de descartar.
+            poll_interval: Intervalo máximo de espera, usado para conferir o pedido de parada.
+        """
+        super().__init__(name=f"reader-{name}", daemon=True)
+
+        self.handler = handler
+        self.inbound = inbound
+        self.put_timeout = put_timeout
+        self.poll_interval = poll_interval
+
+        self.received = 0
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        fd = self.handler.fileno()
+        logger.info("[READER] Thread de leitura de '%s' iniciada", self.name)
+
+        while not self._stop_event.is_set():
+            try:
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+            except (OSError, ValueError):
+                # Descritor fechado durante o encerramento.
+                break
+
+            if not ready:
+                continue
+
+            try:
+                messages = self._read()
+            except Exception:
+                logger.exception("[READER] Erro ao ler '%s'", self.name)
+                continue
+
+            for message in messages:
+                self._put(message)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _read(self) -> list[dict]:
+        read_batch = getattr(self.handler, "read_batch", None)
+        start = time.perf_counter()
+
+        if read_batch is not None:
+            messages = read_batch()
+        else:
+            messages = []
+            while (message := self.handler.read()):
+                messages.append(message)
+
+        if messages:
+            port = self.name.removeprefix("reader-")
+            metrics.observe("read", time.perf_counter() - start, protocol=port)
+            metrics.inc("messages", len(messages), protocol=port)
+
+        return messages
+
+    def _put(self, message: dict):
+        """Entrega a mensagem aos roteadores, bloqueando no máximo put_timeout."""
+        try:
+            self.inbound.put(message, timeout=self.put_timeout)
+            self.received += 1
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("[READER] Fila de entrada cheia, mensagem de '%s' descartada (%d no total)", self.name, self.dropped)
+
+class Router:
+    def __init__(self, inbound: queue.Queue, on_message, workers: int = 1, on_flush=None):
+        """Threads que consomem a fila de entrada e chamam on_message.
+
+        Args:
+            inbound: Fila compartilhada com as threads leitoras.
+            on_message: Função chamada para cada mensagem, deve esperar o dicionário.
+            workers: Quantidade de threads roteadoras.
+            on_flush: Função opcional chamada sempre que a fila de entrada esvazia.
+        """
+        self.inbound = inbound
+        self.on_message = on_message
+        self.on_flush = on_flush
+
+        self.routed = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"router-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        """Pede o encerramento de todos os roteadores após as mensagens já enfileiradas."""
+        for _ in self._threads:
+            self.inbound.put(_STOP)
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wait(self):
+        """Bloqueia até os roteadores terminarem (ou até um KeyboardInterrupt)."""
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1.0)
+
+    def _run(self):
+        while True:
+            message = self.inbound.get()
+
+            if message is _STOP:
+                return
+
+            try:
+                self.on_message(message)
+                self.routed += 1
+            except Exception:
+                logger.exception("[ROUTER] Erro ao despachar mensagem: %s", message)
+
+            if self.on_flush is not None and self.inbound.empty():
+                try:
+                    self.on_flush()
+                except Exception:
+                    logger.exception("[ROUTER] Erro ao esvaziar os lotes")
+
+class ReaderPool:
+    def __init__(self, on_message, queue_size: int = 1024, workers: int = 1, on_flush=None):
+        """Conjunto de threads leitoras e roteadoras com a interface do EventLoop.
+
+        Args:
+            on_message: Função chamada para cada mensagem lida.
+            queue_size: Tamanho máximo da fila de entrada compartilhada.
+            workers: Quantidade de threads roteadoras.
+            on_flush: Função opcional chamada quando a fila de entrada esvazia.
+        """
+        self.on_message = on_message
+        self.on_flush = on_flush
+        self.workers = workers
+
+        self.inbound = queue.Queue(maxsize=queue_size)
+        self.readers: list[PortReader] = []
+        self.router: Router | None = None
+
+    def register(self, name: str, handler):
+        """Cria a thread leitora de um handler, iniciada em run_forever()."""
+        self.readers.append(PortReader(name, handler, self.inbound))
+
+    def run_forever(self):
+        """Inicia leitores e roteadores e bloqueia até o encerramento."""
+        self.router = Router(self.inbound, on_message=self.on_message, workers=self.workers, on_flush=self.on_flush)
+
+        for reader in self.readers:
+            reader.start()
+
+        self.router.wait()
+
+    def close(self):
+        """Para os leitores e encerra os roteadores após esvaziar a fila."""
+        for reader in self.readers:
+            reader.stop()
+        for reader in self.readers:
+            if reader.is_alive():
+                reader.join()
+
+        if self.router is not None:
+            self.router.stop()